@@ -13,6 +13,7 @@ from app.config import PROJECTS_PATH
 from app.database import database
 import app.domains.projects.crud as crud
 from app.auth import get_current_user
+import services.pipelines.mezzanine as mezzanine
 
 router = fastapi.APIRouter()
 
@@ -133,6 +134,10 @@ async def upload_project_file(
     with open(file_path, 'wb') as f:
         f.write(await file.read())
 
+    # Normalize uploaded footage right away, so renders only need to trim it
+    if folder == 'videos':
+        mezzanine.build_mezzanine_in_background(file_path)
+
 
 @router.get('/{project_id}/files/download', tags=['Projects'])
 def download_file(
@@ -3,6 +3,7 @@ import logging
 import os
 import threading
 import uuid
+from typing import Optional
 
 import fastapi
 import pydantic
@@ -23,6 +24,11 @@ class RunRequest(pydantic.BaseModel):
     pause_threshold: float = 0.5
     pause_padding: float = 0.1
     whisper_model: str = 'small'
+    quantized: bool = False
+    language: Optional[str] = None
+    long_form: bool = False
+    batched: bool = False
+    vad: bool = False
 
     video_name: str
     output_name: str
@@ -38,13 +44,18 @@ def run_pause_cutter_tool_thread(
         pause_cutter = PauseCutter(
             working_dir=os.path.join(PROJECTS_PATH, str(project_id)),
             whisper_model=request.whisper_model,
+            language=request.language,
+            quantized=request.quantized,
         )
 
         pause_cutter.run(
             video_name=request.video_name,
             output_name=request.output_name,
             pause_threshold=request.pause_threshold,
-            pad=request.pause_padding
+            pad=request.pause_padding,
+            long_form=request.long_form,
+            batched=request.batched,
+            vad=request.vad
         )
 
         logging.info("pause cutter tool completed")
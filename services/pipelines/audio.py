@@ -0,0 +1,214 @@
+import json
+import os
+import shlex
+import subprocess
+
+import numpy as np
+
+from services.pipelines.cache import DiskCache, file_content_hash, make_key
+
+# whisper works on 16 kHz mono float32, every analysis stage reads the same buffer
+SAMPLE_RATE = 16000
+
+# 16 kHz float32 mono is ~230 MB per hour of media
+DECODED_AUDIO_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+
+_decoded_audio_cache: DiskCache = None
+
+
+def get_decoded_audio_cache() -> DiskCache:
+    global _decoded_audio_cache
+    if _decoded_audio_cache is None:
+        _decoded_audio_cache = DiskCache('decoded_audio', DECODED_AUDIO_CACHE_MAX_BYTES)
+    return _decoded_audio_cache
+
+
+def get_audio_sample_rate(media_path: str) -> int:
+    """
+    Get the sample rate of the first audio stream using FFprobe.
+    """
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "stream=sample_rate",
+        "-of", "json",
+        media_path
+    ]
+    res = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    streams = json.loads(res.stdout).get("streams", [])
+    if not streams:
+        raise ValueError(f"No audio stream found in '{media_path}'.")
+    return int(streams[0]["sample_rate"])
+
+
+def decode_audio(media_path: str, sample_rate: int = SAMPLE_RATE) -> str:
+    """
+    Decodes the audio of a media file once into a float32 mono .npy file, keyed by the content hash.
+
+    :param media_path: Path to the media file
+    :param sample_rate: The target sample rate, None keeps the native one
+    :return: Path to the cached .npy file
+    """
+    if sample_rate is None:
+        sample_rate = get_audio_sample_rate(media_path)
+
+    cache = get_decoded_audio_cache()
+    key = make_key(file_content_hash(media_path), sample_rate, 'mono', 'f32le')
+
+    cached_path = cache.get_path(key, '.npy')
+    if cached_path is not None:
+        return cached_path
+
+    raw_path = cache.temp_path('.raw')
+    npy_path = cache.temp_path('.npy')
+
+    cmd = [
+        "ffmpeg", "-y",
+        "-nostdin",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-i", media_path,
+        "-vn",
+        "-ac", "1",
+        "-ar", str(sample_rate),
+        "-f", "f32le",
+        raw_path
+    ]
+
+    print("Running ffmpeg:\n", " ".join(shlex.quote(arg) for arg in cmd))
+
+    try:
+        subprocess.run(cmd, check=True)
+
+        # Prepend an .npy header to the raw samples, so readers can np.load(mmap_mode=...) it
+        n_samples = os.path.getsize(raw_path) // 4
+        with open(npy_path, 'wb') as dst, open(raw_path, 'rb') as src:
+            np.lib.format.write_array_header_1_0(dst, {
+                'descr': '<f4',
+                'fortran_order': False,
+                'shape': (n_samples,)
+            })
+            for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                dst.write(chunk)
+
+        return cache.put_file(key, '.npy', npy_path, move=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg command failed with error: {e.stderr}")
+    finally:
+        for tmp_path in (raw_path, npy_path):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def load_audio(media_path: str, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Returns the decoded audio of a media file as a memory-mapped float32 array.
+
+    The mapping is copy-on-write: readers share the page cache and nothing is copied unless written to.
+
+    :param media_path: Path to the media file
+    :param sample_rate: The target sample rate, None keeps the native one
+    :return: 1-D float32 array of samples in [-1, 1]
+    """
+    return np.load(decode_audio(media_path, sample_rate), mmap_mode='c')
+
+
+def audio_duration(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> float:
+    return len(samples) / sample_rate
+
+
+def frame_levels(samples: np.ndarray, sample_rate: int = SAMPLE_RATE, frame_length: float = 0.01) -> np.ndarray:
+    """
+    Returns the peak level in dBFS of each frame of 'frame_length' seconds.
+    """
+    frame_size = max(1, int(sample_rate * frame_length))
+    n_frames = len(samples) // frame_size
+    if n_frames == 0:
+        return np.empty(0, dtype=np.float32)
+
+    # Work through the buffer in blocks, so a long memory-mapped file is never copied as a whole
+    peaks = np.empty(n_frames, dtype=np.float32)
+    block_frames = max(1, (60 * sample_rate) // frame_size)
+    for first in range(0, n_frames, block_frames):
+        last = min(first + block_frames, n_frames)
+        block = samples[first * frame_size:last * frame_size].reshape(last - first, frame_size)
+        peaks[first:last] = np.abs(block).max(axis=1)
+
+    return 20 * np.log10(np.maximum(peaks, 1e-10))
+
+
+def find_runs(mask: np.ndarray) -> list[tuple[int, int]]:
+    """
+    Returns (start, end) index pairs of the runs of True values in a boolean array, end exclusive.
+    """
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def detect_silences(
+        samples: np.ndarray,
+        noise_threshold: float,
+        duration_threshold: float,
+        sample_rate: int = SAMPLE_RATE,
+        frame_length: float = 0.01
+) -> list[dict]:
+    """
+    Finds the silent sections of a decoded audio buffer, the same way ffmpeg's silencedetect does.
+
+    :param samples: The decoded audio, see load_audio
+    :param noise_threshold: The noise threshold in dB (e.g., -30 for -30dB).
+    :param duration_threshold: The minimum duration (in seconds) for silence to be detected.
+    :param sample_rate: The sample rate of 'samples'
+    :param frame_length: The analysis frame length in seconds
+    :return: A list of dictionaries, each with {"start": float, "end": float}.
+    """
+    silent = frame_levels(samples, sample_rate, frame_length) < noise_threshold
+
+    pauses = []
+    for start, end in find_runs(silent):
+        if (end - start) * frame_length >= duration_threshold:
+            pauses.append({"start": start * frame_length, "end": end * frame_length})
+
+    return pauses
+
+
+def detect_speech_regions(
+        samples: np.ndarray,
+        noise_threshold: float = -40,
+        min_silence: float = 0.5,
+        padding: float = 0.2,
+        sample_rate: int = SAMPLE_RATE
+) -> list[dict]:
+    """
+    A cheap energy-based voice activity detector: everything that is not a long enough silence is speech.
+
+    :param samples: The decoded audio, see load_audio
+    :param noise_threshold: Frames below this level in dB are silent
+    :param min_silence: Shorter silences are kept as part of the speech around them
+    :param padding: Seconds of context kept on both sides of every speech region
+    :param sample_rate: The sample rate of 'samples'
+    :return: Sorted, non-overlapping {"start", "end"} regions in seconds
+    """
+    total = audio_duration(samples, sample_rate)
+
+    regions = []
+    last_end = 0.0
+    for silence in detect_silences(samples, noise_threshold, min_silence, sample_rate=sample_rate):
+        if silence["start"] > last_end:
+            regions.append({"start": last_end, "end": silence["start"]})
+        last_end = silence["end"]
+    if last_end < total:
+        regions.append({"start": last_end, "end": total})
+
+    merged = []
+    for region in regions:
+        start = max(0.0, region["start"] - padding)
+        end = min(total, region["end"] + padding)
+        if merged and start <= merged[-1]["end"]:
+            merged[-1]["end"] = end
+        else:
+            merged.append({"start": start, "end": end})
+
+    return merged
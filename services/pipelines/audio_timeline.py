@@ -0,0 +1,271 @@
+import shlex
+import subprocess
+
+import services.pipelines.ffmpeg as ffmpeg
+import services.pipelines.loudness as loudness
+
+# Every clip is brought to the same format before mixing
+MIX_SAMPLE_RATE = 48000
+MIX_CHANNEL_LAYOUT = 'stereo'
+
+
+class AudioClip:
+    path: str = None
+    start: float = None
+    bus: str = None
+
+    gain_db: float = None
+    fade_in: float = None
+    fade_out: float = None
+
+    offset: float = None
+    duration: float = None
+    loop: bool = False
+
+    # Target integrated loudness (LUFS), None to keep the file's own level
+    loudness: float = None
+
+    def __init__(self, path: str, start: float, bus: str, gain_db: float = 0.0, fade_in: float = 0.0,
+                 fade_out: float = 0.0, offset: float = 0.0, duration: float = None, loop: bool = False,
+                 loudness: float = None):
+        self.path = path
+        self.start = start
+        self.bus = bus
+        self.gain_db = gain_db
+        self.fade_in = fade_in
+        self.fade_out = fade_out
+        self.offset = offset
+        self.duration = duration
+        self.loop = loop
+        self.loudness = loudness
+
+    def length(self) -> float:
+        if self.duration is not None:
+            return self.duration
+        return ffmpeg.get_media_duration(self.path) - self.offset
+
+
+class AudioTimeline:
+    """
+    Timed audio clips on named buses (e.g. speech, music, sfx), mixed in a single ffmpeg filter graph.
+
+    Each clip gets its gain, fades and position, the clips of a bus are summed, a bus can be ducked
+    under another one with a sidechain compressor, and the buses are summed into the final mix.
+    mux puts the mix on a video without re-encoding the video.
+
+        timeline = AudioTimeline(duration=42.0)
+        timeline.add(speech_path, start=0.0, bus='speech')
+        timeline.add(music_path, start=0.0, bus='music', gain_db=-25, fade_out=2.0, loop=True, loudness=-16)
+        timeline.duck('music', under='speech')
+        timeline.mux(video_path, output_path)
+    """
+
+    clips: list[AudioClip] = []
+    duration: float = None
+
+    bus_gains: dict[str, float] = {}
+    ducking: dict[str, dict] = {}
+
+    def __init__(self, duration: float = None):
+        """
+        :param duration: Length of the mix, defaults to the end of the last clip
+        """
+        self.clips = []
+        self.duration = duration
+        self.bus_gains = {}
+        self.ducking = {}
+
+    def add(self, path: str, start: float = 0.0, bus: str = 'sfx', gain_db: float = 0.0, fade_in: float = 0.0,
+            fade_out: float = 0.0, offset: float = 0.0, duration: float = None, loop: bool = False,
+            loudness: float = None) -> 'AudioTimeline':
+        """
+        Adds a clip to the timeline.
+
+        :param path: The media file to take the audio from
+        :param start: Where the clip starts on the timeline, in seconds
+        :param bus: The bus to mix the clip into
+        :param gain_db: The gain of the clip
+        :param fade_in: Fade in length, in seconds
+        :param fade_out: Fade out length, in seconds
+        :param offset: Where to start reading the file, in seconds
+        :param duration: How much of the file to use, defaults to all of it (or until the end of the timeline if looped)
+        :param loop: Repeat the file, e.g. for background music shorter than the video
+        :param loudness: Normalize the file to this integrated loudness (LUFS) first, 'gain_db' applies on top.
+                         The file is measured once, see services.pipelines.loudness
+        """
+        if loop and duration is None and self.duration is None:
+            raise ValueError("A looped clip needs a duration, or the timeline one")
+
+        if loop and duration is None:
+            duration = self.duration - start
+
+        self.clips.append(AudioClip(path, start, bus, gain_db, fade_in, fade_out, offset, duration, loop, loudness))
+        return self
+
+    def set_bus_gain(self, bus: str, gain_db: float) -> 'AudioTimeline':
+        self.bus_gains[bus] = gain_db
+        return self
+
+    def duck(self, bus: str, under: str, threshold: float = 0.05, ratio: float = 8.0, attack: float = 20.0,
+             release: float = 400.0) -> 'AudioTimeline':
+        """
+        Lowers a bus while another one is loud, e.g. the music under the speech (sidechaincompress).
+
+        :param bus: The bus to lower
+        :param under: The bus that triggers the ducking
+        :param threshold: The level of 'under' above which the ducking starts, linear (0-1)
+        :param ratio: How much to lower 'bus'
+        :param attack: How fast the ducking starts, in ms
+        :param release: How fast it stops, in ms
+        """
+        self.ducking[bus] = {
+            "under": under,
+            "threshold": threshold,
+            "ratio": ratio,
+            "attack": attack,
+            "release": release
+        }
+        return self
+
+    def total_duration(self) -> float:
+        if self.duration is not None:
+            return self.duration
+        return max((clip.start + clip.length() for clip in self.clips), default=0.0)
+
+    def build_graph(self, first_input: int = 0) -> (list[str], list[str], str):
+        """
+        Builds the ffmpeg inputs and filters producing the mix.
+
+        :param first_input: The input index of the first clip, when other inputs come before
+        :return: (input arguments, filter_complex parts, label of the mix)
+        """
+        if not self.clips:
+            raise ValueError("The audio timeline is empty")
+
+        inputs = []
+        filters = []
+        buses: dict[str, list[str]] = {}
+
+        for i, clip in enumerate(self.clips):
+            index = first_input + i
+            length = clip.length()
+
+            if clip.loop:
+                inputs += ["-stream_loop", "-1"]
+            if clip.offset:
+                inputs += ["-ss", str(clip.offset)]
+            inputs += ["-t", str(length), "-i", clip.path]
+
+            chain = [
+                f"aresample={MIX_SAMPLE_RATE}",
+                f"aformat=sample_fmts=fltp:channel_layouts={MIX_CHANNEL_LAYOUT}",
+                "asetpts=PTS-STARTPTS"
+            ]
+            gain_db = clip.gain_db
+            if clip.loudness is not None:
+                gain_db += loudness.loudness_gain(clip.path, target_loudness=clip.loudness)
+            if gain_db:
+                chain.append(f"volume={gain_db:.2f}dB")
+            if clip.fade_in > 0:
+                chain.append(f"afade=t=in:st=0:d={clip.fade_in}")
+            if clip.fade_out > 0:
+                chain.append(f"afade=t=out:st={max(0.0, length - clip.fade_out)}:d={clip.fade_out}")
+            if clip.start > 0:
+                chain.append(f"adelay=delays={int(round(clip.start * 1000))}:all=1")
+
+            filters.append(f"[{index}:a]{','.join(chain)}[c{i}]")
+            buses.setdefault(clip.bus, []).append(f"[c{i}]")
+
+        # 1) Sum the clips of every bus
+        bus_labels = {}
+        for bus, labels in buses.items():
+            label = f"[bus_{bus}]"
+            gain = f",volume={self.bus_gains[bus]}dB" if self.bus_gains.get(bus) else ""
+            if len(labels) == 1:
+                filters.append(f"{labels[0]}anull{gain}{label}")
+            else:
+                filters.append(f"{''.join(labels)}amix=inputs={len(labels)}:duration=longest:normalize=0{gain}{label}")
+            bus_labels[bus] = label
+
+        # 2) Duck buses under others, the trigger bus is split so it is still mixed in
+        keys = {}
+        for bus, ducking in self.ducking.items():
+            if bus in bus_labels and ducking["under"] in bus_labels:
+                keys.setdefault(ducking["under"], []).append(bus)
+
+        for under, ducked in keys.items():
+            split_labels = [f"[key_{under}_{bus}]" for bus in ducked]
+            filters.append(f"{bus_labels[under]}asplit={len(ducked) + 1}[mix_{under}]{''.join(split_labels)}")
+            bus_labels[under] = f"[mix_{under}]"
+
+            for bus, key_label in zip(ducked, split_labels):
+                d = self.ducking[bus]
+                filters.append(
+                    f"{bus_labels[bus]}{key_label}sidechaincompress=threshold={d['threshold']}:ratio={d['ratio']}:"
+                    f"attack={d['attack']}:release={d['release']}[ducked_{bus}]"
+                )
+                bus_labels[bus] = f"[ducked_{bus}]"
+
+        # 3) Sum the buses, cut to the timeline's length
+        duration = self.total_duration()
+        labels = list(bus_labels.values())
+        # padded first, so the mix is never shorter than the timeline
+        if len(labels) == 1:
+            filters.append(f"{labels[0]}apad,atrim=duration={duration}[mix]")
+        else:
+            filters.append(
+                f"{''.join(labels)}amix=inputs={len(labels)}:duration=longest:normalize=0,"
+                f"apad,atrim=duration={duration}[mix]"
+            )
+
+        return inputs, filters, "[mix]"
+
+    def render(self, output_path: str, audio_codec: str = 'aac', bitrate: str = '192k'):
+        """
+        Renders the mix to an audio file.
+        """
+        inputs, filters, label = self.build_graph()
+
+        cmd = [
+            "ffmpeg", '-y',
+            '-hide_banner',
+            "-loglevel", "error",
+            *inputs,
+            '-filter_complex', "; ".join(filters),
+            '-map', label,
+            '-c:a', audio_codec,
+            '-b:a', bitrate,
+            output_path
+        ]
+        _run(cmd)
+
+    def mux(self, video_path: str, output_path: str, bitrate: str = '192k'):
+        """
+        Puts the mix on a video, replacing its audio. The video stream is copied, not re-encoded.
+        """
+        inputs, filters, label = self.build_graph(first_input=1)
+
+        cmd = [
+            "ffmpeg", '-y',
+            '-hide_banner',
+            "-loglevel", "error",
+            '-i', video_path,
+            *inputs,
+            '-filter_complex', "; ".join(filters),
+            '-map', '0:v',
+            '-map', label,
+            '-c:v', 'copy',
+            '-c:a', 'aac',
+            '-b:a', bitrate,
+            output_path
+        ]
+        _run(cmd)
+
+
+def _run(cmd: list[str]):
+    try:
+        print("Running ffmpeg:\n", " ".join(shlex.quote(arg) for arg in cmd))
+
+        subprocess.run(cmd, check=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg command failed with error: {e.stderr}")
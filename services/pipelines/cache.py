@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+from platformdirs import user_data_dir
+
+# Shared across projects, lives next to the app data (see app/config.py)
+CACHE_DIR = os.environ.get('PERSONA_CACHE_DIR', os.path.join(user_data_dir('persona_ai'), 'data', 'cache'))
+
+_hash_memo: dict[tuple, str] = {}
+_hash_memo_lock = threading.Lock()
+
+
+def file_content_hash(path: str) -> str:
+    """
+    Returns the sha256 hex digest of a file's content.
+
+    Hashing a large upload is not free, so the digest is memoized per (path, size, mtime).
+
+    :param path: Path to the file
+    :return: The hex digest
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+    with _hash_memo_lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    result = digest.hexdigest()
+    with _hash_memo_lock:
+        _hash_memo[memo_key] = result
+
+    return result
+
+
+def make_key(*parts) -> str:
+    """
+    Builds a stable cache key out of JSON-serializable parts.
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class DiskCache:
+    """
+    A size-bounded, file-per-entry cache with LRU eviction.
+
+    Entries are stored as '<key><ext>' inside '<root>/<namespace>'. A hit touches the
+    entry's mtime, and eviction removes the least recently used entries until the
+    namespace fits into max_bytes again. Pinned entries (see pin) are never evicted.
+    """
+
+    directory: str = None
+    max_bytes: int = None
+
+    def __init__(self, namespace: str, max_bytes: int, root: str = CACHE_DIR):
+        self.directory = os.path.join(root, namespace)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pinned: dict[str, int] = {}
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{key}{ext}")
+
+    def get_path(self, key: str, ext: str) -> str or None:
+        """
+        Returns the path of a cached entry (and marks it as recently used), or None on a miss.
+        """
+        path = self.path(key, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put_file(self, key: str, ext: str, src_path: str, move: bool = False) -> str:
+        """
+        Stores a file in the cache. The write is atomic, readers never see a partial entry.
+
+        :param key: The cache key
+        :param ext: The extension of the entry, e.g. '.mp3'
+        :param src_path: The file to store
+        :param move: Move the file instead of copying it
+        :return: The path of the cached entry
+        """
+        path = self.path(key, ext)
+        if move:
+            os.replace(src_path, path)
+        else:
+            tmp_path = self.temp_path(ext)
+            with open(src_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                    dst.write(chunk)
+            os.replace(tmp_path, path)
+
+        self.evict()
+        return path
+
+    def temp_path(self, ext: str) -> str:
+        """
+        Returns a unique path inside the cache directory to write an entry to before put_file(move=True).
+        """
+        return os.path.join(self.directory, f".tmp_{uuid.uuid4().hex}{ext}")
+
+    def get_json(self, key: str):
+        path = self.get_path(key, '.json')
+        if path is None:
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def put_json(self, key: str, value) -> str:
+        tmp_path = self.temp_path('.json')
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        return self.put_file(key, '.json', tmp_path, move=True)
+
+    def pin(self, path: str):
+        """
+        Protects an entry (it may not exist yet) from eviction until it is unpinned as many times.
+        """
+        with self._lock:
+            self._pinned[path] = self._pinned.get(path, 0) + 1
+
+    def unpin(self, path: str):
+        with self._lock:
+            count = self._pinned.get(path, 0) - 1
+            if count > 0:
+                self._pinned[path] = count
+            else:
+                self._pinned.pop(path, None)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits into max_bytes, or only pinned
+        entries are left.
+        """
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if not entry.is_file() or entry.name.startswith('.tmp_'):
+                    continue
+                stat = entry.stat()
+                total += stat.st_size
+                # pinned entries count towards the size, but only the others can go
+                if entry.path not in self._pinned:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            if total <= self.max_bytes:
+                return
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
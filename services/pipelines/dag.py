@@ -0,0 +1,307 @@
+import json
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable
+
+from services.pipelines.cache import DiskCache, file_content_hash, make_key
+
+
+class Step:
+    """
+    One node of a pipeline DAG.
+
+    The step's function is called with keyword arguments:
+      - one per entry of 'inputs', the path of an output of another step,
+        given as (step name, output name)
+      - one per entry of 'files', the path of an external file
+      - one per entry of 'params', a JSON-serializable value
+      - one per entry of 'outputs', the path the step must write that output to
+
+    The outputs are stored under a hash of (input content hashes, params, step version, tool version),
+    so a step only runs when something it depends on has changed.
+    """
+
+    name: str = None
+    func: Callable = None
+
+    inputs: dict[str, tuple[str, str]] = {}
+    files: dict[str, str] = {}
+    params: dict[str, any] = {}
+    outputs: dict[str, str] = {}
+
+    version: str = None
+
+    def __init__(self, name: str, func: Callable, outputs: dict[str, str], inputs: dict[str, tuple[str, str]] = None,
+                 files: dict[str, str] = None, params: dict[str, any] = None, version: str = '1'):
+        """
+        :param name: Unique name of the step
+        :param func: The function doing the work
+        :param outputs: Output name -> file extension, e.g. {"output_path": ".mp4"}
+        :param inputs: Argument name -> (step name, output name)
+        :param files: Argument name -> path of an external input file, hashed by content
+        :param params: Argument name -> value
+        :param version: Bump when the step's implementation changes its output
+        """
+        self.name = name
+        self.func = func
+        self.outputs = outputs
+        self.inputs = inputs or {}
+        self.files = files or {}
+        self.params = params or {}
+        self.version = version
+
+
+def write_json(path: str, value):
+    with open(path, 'w') as f:
+        json.dump(value, f)
+
+
+def read_json(path: str):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def get_ffmpeg_version() -> str:
+    try:
+        result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True, check=True)
+        return result.stdout.splitlines()[0]
+    except (subprocess.CalledProcessError, FileNotFoundError, IndexError):
+        return "unknown"
+
+
+class DAGExecutor:
+    """
+    Runs a DAG of steps with content-addressed caching of their outputs.
+
+    - A step whose outputs are already cached is skipped, and so is everything only it depends on.
+      Since outputs survive the process, a crashed or stopped run resumes from the last completed step.
+    - Independent steps run concurrently on a thread pool (the heavy lifting happens in ffmpeg subprocesses).
+    - The outputs a run still needs are pinned in the cache, so filling the cache during the run never
+      evicts the input of a pending step, or an output before 'on_complete' has handled it.
+    """
+
+    cache: DiskCache = None
+    logger: logging.Logger = None
+
+    max_workers: int = None
+    tool_version: str = None
+
+    def __init__(self, cache: DiskCache, logger: logging.Logger, max_workers: int = None, tool_version: str = None):
+        self.cache = cache
+        self.logger = logger
+        self.max_workers = max_workers or os.cpu_count()
+        self.tool_version = tool_version if tool_version is not None else get_ffmpeg_version()
+
+    def _compute_keys(self, steps: dict[str, Step], order: list[str]) -> dict[str, str]:
+        keys = {}
+        for name in order:
+            step = steps[name]
+            keys[name] = make_key(
+                step.name,
+                step.version,
+                self.tool_version,
+                step.params,
+                sorted(step.outputs.items()),
+                # an output of another step is identified by that step's key, no need to hash it again
+                {arg: [keys[ref[0]], ref[1]] for arg, ref in step.inputs.items()},
+                {arg: file_content_hash(path) for arg, path in step.files.items()},
+            )
+        return keys
+
+    @staticmethod
+    def _topological_order(steps: dict[str, Step]) -> list[str]:
+        order = []
+        state = {}
+
+        def visit(name: str):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError(f"Pipeline has a cycle through step '{name}'")
+            if name not in steps:
+                raise ValueError(f"Unknown step '{name}'")
+
+            state[name] = 'visiting'
+            for ref in steps[name].inputs.values():
+                visit(ref[0])
+            state[name] = 'done'
+            order.append(name)
+
+        for step_name in steps:
+            visit(step_name)
+
+        return order
+
+    def _cached_outputs(self, step: Step, key: str) -> dict[str, str] or None:
+        paths = {}
+        for output_name, ext in step.outputs.items():
+            path = self.cache.get_path(f"{key}_{output_name}", ext)
+            if path is None:
+                return None
+            paths[output_name] = path
+        return paths
+
+    def _output_paths(self, step: Step, key: str) -> list[str]:
+        return [self.cache.path(f"{key}_{output_name}", ext) for output_name, ext in step.outputs.items()]
+
+    def _run_step(self, step: Step, key: str, input_paths: dict[str, str]) -> dict[str, str]:
+        tmp_outputs = {output_name: self.cache.temp_path(ext) for output_name, ext in step.outputs.items()}
+
+        start = time.time()
+        try:
+            step.func(**input_paths, **step.files, **step.params, **tmp_outputs)
+
+            outputs = {}
+            for output_name, tmp_path in tmp_outputs.items():
+                outputs[output_name] = self.cache.put_file(
+                    f"{key}_{output_name}", step.outputs[output_name], tmp_path, move=True
+                )
+        finally:
+            for tmp_path in tmp_outputs.values():
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        self.logger.info(f"✅ Step '{step.name}' done in {time.time() - start:.2f} sec")
+        return outputs
+
+    def run(self, steps: list[Step], targets: list[str] = None,
+            on_complete: Callable[[str, dict[str, str]], None] = None) -> dict[str, dict[str, str]]:
+        """
+        Runs whatever is needed to produce the outputs of the target steps.
+
+        :param steps: All the steps of the pipeline
+        :param targets: The names of the steps whose outputs are wanted, defaults to all steps
+        :param on_complete: Called with (step name, output name -> path) as soon as a needed step is done
+                            or found cached, while its outputs are still pinned, e.g. to copy them out
+        :return: Step name -> output name -> path, for every step that was needed
+        """
+        results, errors, order = self._execute(steps, targets, keep_going=False, on_complete=on_complete)
+
+        if errors:
+            # Report the first failing step in pipeline order, regardless of timing
+            first = next(name for name in order if name in errors)
+            raise errors[first]
+
+        return results
+
+    def run_keep_going(self, steps: list[Step], targets: list[str] = None,
+                       on_complete: Callable[[str, dict[str, str]], None] = None) \
+            -> (dict[str, dict[str, str]], dict[str, Exception]):
+        """
+        Like run, but a failing step only stops the steps depending on it, everything else still runs.
+        Meant for DAGs made of independent parts, e.g. a batch of videos.
+
+        :return: (step name -> output name -> path for every step that completed, step name -> error for
+                 every step that failed), the steps depending on a failed step are in neither
+        """
+        results, errors, _ = self._execute(steps, targets, keep_going=True, on_complete=on_complete)
+        return results, errors
+
+    def _execute(self, steps: list[Step], targets: list[str] or None, keep_going: bool,
+                 on_complete: Callable[[str, dict[str, str]], None] = None) \
+            -> (dict[str, dict[str, str]], dict[str, Exception], list[str]):
+        by_name = {step.name: step for step in steps}
+        order = self._topological_order(by_name)
+        keys = self._compute_keys(by_name, order)
+
+        # Every needed output is pinned from when it is found or about to be written, until the steps
+        # reading it are over and on_complete has seen it
+        pinned: dict[str, list[str]] = {}
+
+        def pin(name: str):
+            paths = self._output_paths(by_name[name], keys[name])
+            for path in paths:
+                self.cache.pin(path)
+            pinned[name] = paths
+
+        def unpin(name: str):
+            for path in pinned.pop(name, []):
+                self.cache.unpin(path)
+
+        # 1) Walk back from the targets, a cached step does not need its dependencies
+        results: dict[str, dict[str, str]] = {}
+        to_run: list[str] = []
+        seen = set()
+
+        def require(name: str):
+            if name in seen:
+                return
+            seen.add(name)
+
+            pin(name)
+            cached = self._cached_outputs(by_name[name], keys[name])
+            if cached is not None:
+                self.logger.info(f"✅ Step '{name}' is cached, skipping")
+                results[name] = cached
+                return
+
+            to_run.append(name)
+            for ref in by_name[name].inputs.values():
+                require(ref[0])
+
+        # 2) Run the missing steps as soon as their dependencies are done
+        remaining = []
+        running = {}
+        errors: dict[str, Exception] = {}
+        readers: dict[str, int] = {}
+
+        def release(name: str):
+            if readers.get(name, 0) == 0:
+                unpin(name)
+
+        def complete(name: str):
+            if on_complete is not None:
+                on_complete(name, results[name])
+            release(name)
+
+        def finish(name: str):
+            for ref in by_name[name].inputs.values():
+                readers[ref[0]] -= 1
+                if ref[0] in results:
+                    release(ref[0])
+
+        try:
+            for target in (targets or order):
+                require(target)
+
+            remaining = [name for name in order if name in to_run]
+            for name in remaining:
+                for ref in by_name[name].inputs.values():
+                    readers[ref[0]] = readers.get(ref[0], 0) + 1
+
+            for name in order:
+                if name in results:
+                    complete(name)
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                while remaining or running:
+                    if keep_going or not errors:
+                        for name in list(remaining):
+                            step = by_name[name]
+                            if all(ref[0] in results for ref in step.inputs.values()):
+                                input_paths = {arg: results[ref[0]][ref[1]] for arg, ref in step.inputs.items()}
+                                running[pool.submit(self._run_step, step, keys[name], input_paths)] = name
+                                remaining.remove(name)
+
+                    if not running:
+                        break
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        try:
+                            results[name] = future.result()
+                        except Exception as e:
+                            self.logger.error(f"❌ Step '{name}' failed: {e}")
+                            errors[name] = e
+                        else:
+                            complete(name)
+                        finish(name)
+        finally:
+            for name in list(pinned):
+                unpin(name)
+
+        return results, errors, order
@@ -1,8 +1,20 @@
 import json
+import os
 import shlex
+import shutil
 import subprocess
 import platform
-import re
+
+from services.pipelines import audio, reframe as reframing, streaming
+from services.pipelines.cache import DiskCache, file_content_hash, make_key
+
+# A 1080x1920 still clip is ~100 KB per second
+PHOTO_CLIP_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# How a photo moves during its clip, see create_photo_clip
+PHOTO_MOTIONS = ('none', 'zoom_in', 'zoom_out', 'pan_right', 'pan_left')
+
+_photo_clip_cache: DiskCache = None
 
 
 def build_concat_cmd(input_file_paths: list[str], output_file_path: str) -> list[str]:
@@ -39,6 +51,36 @@ def build_concat_cmd(input_file_paths: list[str], output_file_path: str) -> list
     return command
 
 
+def build_concat_stream_cmd(footages: list[dict]) -> list[str]:
+    """
+    Builds a command that cuts, formats (see format_youtube_short_video) and concatenates video footages
+    in one filter graph and writes the result as raw frames to stdout (see services.pipelines.streaming),
+    so no snippet or concatenated file is written.
+
+    :param footages:  List of {"path": str, "duration": float}, in timeline order
+    :return: The ffmpeg command
+    """
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error"]
+
+    filter_parts = []
+    for i, footage in enumerate(footages):
+        cmd += ["-t", str(footage["duration"]), "-i", footage["path"]]
+        filter_parts.append(
+            f"[{i}:v]setpts=PTS-STARTPTS,crop=(9/16*ih):ih,scale=1080:1920,fps={streaming.FPS},setsar=1[v{i}]"
+        )
+
+    inputs = "".join(f"[v{i}]" for i in range(len(footages)))
+    filter_parts.append(f"{inputs}concat=n={len(footages)}:v=1[outv]")
+
+    cmd += [
+        "-filter_complex", "; ".join(filter_parts),
+        "-map", "[outv]",
+        *streaming.rawvideo_output_args()
+    ]
+
+    return cmd
+
+
 def get_gpu_accelerated_h264_encoder():
     """
     Detects the available H.264 GPU-accelerated encoder on the current platform.
@@ -222,7 +264,24 @@ def has_video_track(media_path: str) -> bool:
     return False
 
 
-def format_youtube_short_video(video_path: str, clip_length: float, video_encoder: str, output_path: str):
+def get_parallel_jobs_budget(n_jobs: int) -> (int, int):
+    """
+    Splits the host's core budget between concurrent ffmpeg jobs.
+
+    The budget is the number of cores available to this process, or PERSONA_FFMPEG_CORES if set.
+
+    :param n_jobs:  Number of independent jobs to run
+    :return: (number of concurrent jobs, ffmpeg threads per job)
+    """
+    cores = int(os.environ.get('PERSONA_FFMPEG_CORES', 0)) or (
+        len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    )
+    workers = max(1, min(n_jobs, cores))
+    return workers, max(1, cores // workers)
+
+
+def format_youtube_short_video(video_path: str, clip_length: float, video_encoder: str, output_path: str,
+                               threads: int = None, reframe: bool = False):
     """
     Normalized (scales, cuts, and encodes) a video to fit the YouTube Shorts format (1080x1920).
 
@@ -230,6 +289,8 @@ def format_youtube_short_video(video_path: str, clip_length: float, video_encode
     :param clip_length:  Length of the clip in seconds to cut
     :param video_encoder:  The encoder to use, preferably a GPU accelerated one, like video_toolbox for Mac
     :param output_path:  Path where to save the output video
+    :param threads:  Limit ffmpeg's threads, when several jobs share the cores (see get_parallel_jobs_budget)
+    :param reframe:  Follow the subject instead of cropping the center (see services.pipelines.reframe)
     :return: None
     """
 
@@ -242,6 +303,13 @@ def format_youtube_short_video(video_path: str, clip_length: float, video_encode
             f"for '{video_path}'."
         )
 
+    crop_filter = 'crop=(9/16*ih):ih'
+    commands_path = f"{output_path}.cmd"
+    if reframe:
+        crop_filter = reframing.write_crop_filter(
+            reframing.get_crop_path(video_path, duration=clip_length), commands_path, start=0.0, end=clip_length
+        )
+
     # 3) Run ffmpeg to scale, cut, and encode
     try:
         cmd = [
@@ -250,19 +318,119 @@ def format_youtube_short_video(video_path: str, clip_length: float, video_encode
             "-loglevel", "warning",
             '-i', video_path,
             "-t", str(clip_length),
-            '-vf', 'crop=(9/16*ih):ih,scale=1080:1920',
+            '-vf', f'{crop_filter},scale=1080:1920',
             '-b:v', '8M',
             '-r', '30',
             '-c:v', video_encoder,
             '-an',
             output_path
         ]
+        if threads is not None:
+            cmd[-1:-1] = ['-threads', str(threads)]
+
+        print("Running ffmpeg:\n", " ".join(shlex.quote(arg) for arg in cmd))
+
+        subprocess.run(cmd, check=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg command failed with error: {e.stderr}")
+    finally:
+        if reframe and os.path.exists(commands_path):
+            os.remove(commands_path)
+
+
+def get_photo_clip_cache() -> DiskCache:
+    global _photo_clip_cache
+    if _photo_clip_cache is None:
+        _photo_clip_cache = DiskCache('photo_clips', PHOTO_CLIP_CACHE_MAX_BYTES)
+    return _photo_clip_cache
+
+
+def _photo_motion_filter(motion: str, frames: int) -> str:
+    # Rendered at twice the size first, zoompan is jittery on rounding at the output size
+    base = 'scale=2160:3840:force_original_aspect_ratio=increase,crop=2160:3840'
+    center = "x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)'"
+
+    if motion == 'zoom_in':
+        move = f"zoompan=z='1+0.15*on/{frames}':{center}"
+    elif motion == 'zoom_out':
+        move = f"zoompan=z='1.15-0.15*on/{frames}':{center}"
+    elif motion == 'pan_right':
+        move = f"zoompan=z=1.15:x='(iw-iw/zoom)*on/{frames}':y='ih/2-(ih/zoom/2)'"
+    elif motion == 'pan_left':
+        move = f"zoompan=z=1.15:x='(iw-iw/zoom)*(1-on/{frames})':y='ih/2-(ih/zoom/2)'"
+    else:
+        raise ValueError(f"Unknown photo motion '{motion}', expected one of {PHOTO_MOTIONS}")
+
+    return f"{base},{move}:d={frames}:s=1080x1920:fps=30,format=yuv420p"
+
+
+def create_photo_clip(photo_path: str, clip_length: float, encoder: str, output_path: str, motion: str = 'none'):
+    """
+    Turns a photo into a 1080x1920 video clip (center-cropped, like format_youtube_short_video).
+
+    A still clip is cheap: the photo is decoded, scaled and cropped once, and the loop filter repeats
+    that frame. With libx264 '-tune stillimage' makes the repeated frames almost free.
+    Clips are cached per (photo content hash, length, motion, encoder).
+
+    :param photo_path:  Path to the photo
+    :param clip_length:  Length of the clip in seconds
+    :param encoder:  The encoder to use
+    :param output_path:  Path where to save the clip
+    :param motion:  One of PHOTO_MOTIONS, a slow zoom or pan costs a scale per frame
+    :return: None
+    """
+    shutil.copyfile(get_photo_clip(photo_path, clip_length, encoder, motion), output_path)
+
+
+def get_photo_clip(photo_path: str, clip_length: float, encoder: str, motion: str = 'none') -> str:
+    """
+    Same as create_photo_clip, but returns the path of the cached clip instead of copying it.
+    """
+    if motion not in PHOTO_MOTIONS:
+        raise ValueError(f"Unknown photo motion '{motion}', expected one of {PHOTO_MOTIONS}")
+
+    cache = get_photo_clip_cache()
+    key = make_key(file_content_hash(photo_path), round(clip_length, 3), motion, encoder)
+
+    cached_path = cache.get_path(key, '.mp4')
+    if cached_path is not None:
+        return cached_path
+
+    if motion == 'none':
+        # the photo is read, scaled and cropped once, then the single frame is repeated
+        video_filter = (
+            'scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920,format=yuv420p,'
+            f'loop=loop=-1:size=1,fps=30,trim=duration={clip_length}'
+        )
+    else:
+        video_filter = _photo_motion_filter(motion, max(1, round(clip_length * 30)))
+
+    tmp_path = cache.temp_path('.mp4')
+    try:
+        cmd = [
+            "ffmpeg", '-y',
+            '-hide_banner',
+            "-loglevel", "warning",
+            '-i', photo_path,
+            '-vf', video_filter,
+            '-t', str(clip_length),
+            '-r', '30',
+            '-c:v', encoder,
+        ]
+        if encoder == 'libx264':
+            cmd += ['-tune', 'stillimage', '-preset', 'veryfast']
+        cmd += ['-an', tmp_path]
 
         print("Running ffmpeg:\n", " ".join(shlex.quote(arg) for arg in cmd))
 
         subprocess.run(cmd, check=True)
+
+        return cache.put_file(key, '.mp4', tmp_path, move=True)
     except subprocess.CalledProcessError as e:
         raise RuntimeError(f"ffmpeg command failed with error: {e.stderr}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 def add_audio(video_path, audio_path, encoder, output_path: str):
@@ -333,6 +501,55 @@ def mix_background_audio(video_path, audio_path, output_path: str, volume_adjust
         raise RuntimeError(f"ffmpeg command failed with error: {e.stderr}")
 
 
+def build_finish_stream_cmd(audio_timeline, video_encoder: str, output_path: str, effect_path: str = None,
+                            blend_mode: str = None, opacity: float = None) -> list[str]:
+    """
+    Builds the last stage of a streamed render: reads raw frames from stdin (see services.pipelines.streaming),
+    optionally blends an effect over them (see overlay_effect), and encodes them with the mix of an audio timeline.
+
+    :param audio_timeline:  The audio, a services.pipelines.audio_timeline.AudioTimeline
+    :param video_encoder:  The encoder to use, preferably a GPU accelerated one
+    :param output_path:  Path where to save the output video
+    :param effect_path:  Optional effect video to blend over the frames
+    :param blend_mode:  The blend mode of the effect, e.g. "screen"
+    :param opacity:  The opacity of the effect
+    :return: The ffmpeg command
+    """
+    cmd = [
+        "ffmpeg", '-y',
+        '-hide_banner',
+        "-loglevel", "error",
+        *streaming.rawvideo_input_args(),  # input #0 => the frames
+    ]
+
+    filters = []
+    video_label = '0:v'
+    first_audio_input = 1
+    if effect_path is not None:
+        cmd += ['-i', effect_path]  # input #1 => effect
+        filters.append(f"[0:v][1:v]blend=all_mode='{blend_mode}':all_opacity={opacity}[outv]")
+        video_label = '[outv]'
+        first_audio_input = 2
+
+    audio_inputs, audio_filters, audio_label = audio_timeline.build_graph(first_input=first_audio_input)
+    cmd += audio_inputs
+    filters += audio_filters
+
+    cmd += [
+        '-filter_complex', "; ".join(filters),
+        '-map', video_label,
+        '-map', audio_label,
+        '-c:v', video_encoder,
+        '-b:v', '5M',
+        '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac',
+        '-b:a', '192k',
+        output_path
+    ]
+
+    return cmd
+
+
 def loop_video(video_path: str, loop_count: int, output_path: str):
     """
     Loop a video a specified number of times.
@@ -362,60 +579,29 @@ def loop_video(video_path: str, loop_count: int, output_path: str):
 
 def detect_silence_pauses(media_path: str, noise_threshold: float, duration_threshold: float) -> list[dict]:
     """
-    Runs ffmpeg with the silencedetect filter on the given media file and returns a list
-    of dictionaries representing the silent pauses. Each dictionary has the keys "start"
-    and "end" which denote the start and end times (in seconds) of the silent section.
+    Returns a list of dictionaries representing the silent pauses of the given media file.
+    Each dictionary has the keys "start" and "end" which denote the start and end times
+    (in seconds) of the silent section.
+
+    The audio is read from the shared decoded-audio cache (see services.pipelines.audio),
+    so the media is not decoded again if another stage (e.g. whisper) already did it.
 
     :param media_path: Path to the input media file.
     :param noise_threshold: The noise threshold in dB (e.g., -30 for -30dB).
     :param duration_threshold: The minimum duration (in seconds) for silence to be detected.
     :return: A list of dictionaries, each with {"start": float, "end": float}.
     """
-    # Build the silencedetect filter string. Example: "silencedetect=noise=-30dB:d=1"
-    filter_str = f"silencedetect=noise={noise_threshold}dB:d={duration_threshold}"
-    
-    # Build the ffmpeg command.
-    # Using -f null - causes ffmpeg to process the input without writing an output file.
-    cmd = [
-        "ffmpeg",
-        "-hide_banner",  # optional: hides extra banner info
-        "-i", media_path,
-        "-af", filter_str,
-        "-f", "null",  # null output format
-        "-"
-    ]
-    
-    # Run the command and capture stderr (where ffmpeg logs silencedetect messages)
-    # Note: We use text=True (or universal_newlines=True) so that the output is str, not bytes.
-    process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    log_output = process.stderr
-
-    pauses = []
-    current_silence_start = None
-
-    # Iterate over each line of the log output
-    for line in log_output.splitlines():
-        # Look for a silence_start message
-        start_match = re.search(r"silence_start: (\d+\.?\d*)", line)
-        if start_match:
-            current_silence_start = float(start_match.group(1))
-        
-        # Look for a silence_end message. This line often also contains a silence_duration value.
-        end_match = re.search(r"silence_end: (\d+\.?\d*)", line)
-        if end_match and current_silence_start is not None:
-            current_silence_end = float(end_match.group(1))
-            pauses.append({"start": current_silence_start, "end": current_silence_end})
-            # Reset the current_silence_start for the next detected pause.
-            current_silence_start = None
-
-    return pauses
+    samples = audio.load_audio(media_path)
+    return audio.detect_silences(samples, noise_threshold, duration_threshold)
+
 
 def trim_pauses_from_media(
         media_path: str,
         pauses: list[dict],
         output_path: str,
         video_codec: str = "libx264",
-        audio_codec: str = "aac"
+        audio_codec: str = "aac",
+        total_duration: float = None
 ) -> None:
     """
     Removes the specified pauses from an audio file, producing a shorter output.
@@ -426,9 +612,11 @@ def trim_pauses_from_media(
     :param pauses: A list of dicts, each with {"start": float, "end": float} in seconds,
                    indicating the regions to remove. They need not be sorted; we sort them.
     :param output_path: Where to save the trimmed audio.
+    :param total_duration: The duration of the media if already known (e.g. from the decoded audio), skips probing
     """
     # 1) Get the total duration of the audio
-    total_duration = get_media_duration(media_path)
+    if total_duration is None:
+        total_duration = get_media_duration(media_path)
 
     has_video = has_video_track(media_path)
 
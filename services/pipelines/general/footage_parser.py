@@ -1,5 +1,5 @@
 import re
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 ##############################################################################
 # 2) Parse Script (with Inserted Footages)
@@ -60,10 +60,96 @@ def parse_script_with_footages(script: str) -> List[Dict]:
     return tokens
 
 
+class FootageStreamParser:
+    """
+    Finds footage blocks in a script while it is still being generated, so work on a footage
+    (e.g. normalizing the video) can start before the whole script is there.
+
+        parser = FootageStreamParser()
+        for delta in deltas:
+            for footage in parser.feed(delta):
+                ...  # {"type": "footage", "footage_kind": "video", "filename": "file_abc.mp4"}
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.position = 0
+
+    def feed(self, delta: str) -> List[Dict]:
+        """
+        Adds the next part of the script, returns the footage blocks it completed.
+        """
+        self.text += delta
+
+        footages = []
+        for match in FOOTAGE_BLOCK_PATTERN.finditer(self.text, self.position):
+            footages.append({
+                "type": "footage",
+                "footage_kind": match.group(1),
+                "filename": match.group(2)
+            })
+            self.position = match.end()
+
+        return footages
+
+
 ##############################################################################
 # 3) Align Footages with Word Timestamps
 ##############################################################################
 
+WORD_NORMALIZE_PATTERN = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalize_word(text: str) -> str:
+    """
+    Lowercases a word and drops its punctuation, so "World!" and "world" compare equal.
+    """
+    return WORD_NORMALIZE_PATTERN.sub('', text).lower()
+
+
+def align_words(script_words: List[str], spoken_words: List[str], window: int = 8) -> List[Optional[int]]:
+    """
+    Aligns the (normalized) words of the script with the (normalized) words of the speech in one pass.
+
+    Both sequences are walked together. On a mismatch the closest resynchronization point within 'window'
+    words of either sequence is taken (an insertion, a deletion or a substitution), so the cost stays
+    O(script words + spoken words) however long the script is.
+
+    :return: For every script word, the index of the spoken word it matched, or None
+    """
+    n, m = len(script_words), len(spoken_words)
+    matched: List[Optional[int]] = [None] * n
+
+    i = j = 0
+    while i < n and j < m:
+        if script_words[i] == spoken_words[j]:
+            matched[i] = j
+            i += 1
+            j += 1
+            continue
+
+        # The smallest total skip (di + dj) after which the words agree again
+        skip = None
+        for distance in range(1, window + 1):
+            for di in range(distance + 1):
+                dj = distance - di
+                if i + di < n and j + dj < m and script_words[i + di] == spoken_words[j + dj]:
+                    skip = (di, dj)
+                    break
+            if skip is not None:
+                break
+
+        if skip is None:
+            # nothing agrees nearby, treat it as a substitution
+            i += 1
+            j += 1
+        else:
+            i += skip[0]
+            j += skip[1]
+
+    return matched
+
+
 def assign_footage_timings(tokens: List[Dict], words: List[Dict], photo_length=1.0) -> List[Dict]:
     """
     Given 'tokens' from parse_script_with_footages(), and a 'words' array,
@@ -75,60 +161,59 @@ def assign_footage_timings(tokens: List[Dict], words: List[Dict], photo_length=1
       end at next footage's start or last word end if none left.
     - Re-use is already avoided by the GPT logic,
       but we won't re-check that here. If we see duplicates, we treat them as separate footages anyway.
+
+    The script words are aligned with the spoken words (see align_words), so punctuation and small
+    tokenization differences between the script and the TTS don't shift the footages.
+    Runs in O(tokens + words).
     """
-    word_idx = 0
-    n_words = len(words)
+    # End of script = last word end
+    script_end = words[-1]["end"] if words else 0.0
 
-    def get_next_word_start():
-        nonlocal word_idx
-        if word_idx >= n_words:
-            return None
-        return words[word_idx]["start"]
+    # 1) The script's words, and for every footage the number of script words before it
+    script_words: List[str] = []
+    footages: List[Dict] = []
+    for token in tokens:
+        if token["type"] == "text":
+            script_words.extend(w for w in (normalize_word(w) for w in token["text"].split()) if w)
+        elif token["type"] == "footage":
+            footages.append({"token": token, "word_offset": len(script_words)})
 
-    # End of script = last word end
-    script_end = words[-1]["end"] if n_words > 0 else 0.0
+    # 2) The spoken words, without the pure punctuation ones
+    spoken_indices = [k for k, w in enumerate(words) if normalize_word(w["text"])]
+    spoken_words = [normalize_word(words[k]["text"]) for k in spoken_indices]
 
-    timed_footages = []
+    matched = align_words(script_words, spoken_words)
 
-    for i, token in enumerate(tokens):
-        if token["type"] == "text":
-            # Count how many words are in the text chunk, consume them from 'words'
-            chunk_word_count = len(token["text"].split())
-            word_idx += chunk_word_count
+    # 3) For every script position, the first spoken word at or after it
+    next_spoken = [len(spoken_words)] * (len(script_words) + 1)
+    for p in range(len(script_words) - 1, -1, -1):
+        next_spoken[p] = matched[p] if matched[p] is not None else next_spoken[p + 1]
 
-        elif token["type"] == "footage":
-            kind = token["footage_kind"]  # "video" or "photo"
-            filename = token["filename"]
-
-            start_time = get_next_word_start()
-            if start_time is None:
-                start_time = script_end  # or 0 if no words
-
-            if kind == "photo":
-                end_time = start_time + photo_length
-            else:  # video
-                # find next footage token's start
-                end_time = script_end
-                for j in range(i + 1, len(tokens)):
-                    if tokens[j]["type"] == "footage":
-                        # We temporarily move word_idx forward to consume text between i+1..j
-                        old_idx = word_idx
-                        for k in range(i + 1, j):
-                            if tokens[k]["type"] == "text":
-                                c = len(tokens[k]["text"].split())
-                                word_idx += c
-                        next_start = get_next_word_start()
-                        word_idx = old_idx
-                        if next_start is not None:
-                            end_time = next_start
-                        break
-
-            timed_footages.append({
-                "type": kind,
-                "filename": filename,
-                "start": start_time,
-                "end": end_time
-            })
+    def start_at(word_offset: int) -> float:
+        spoken = next_spoken[word_offset]
+        if spoken >= len(spoken_words):
+            return script_end
+        return words[spoken_indices[spoken]]["start"]
+
+    starts = [start_at(footage["word_offset"]) for footage in footages]
+
+    # 4) A video lasts until the next footage starts
+    timed_footages = []
+    for i, footage in enumerate(footages):
+        kind = footage["token"]["footage_kind"]  # "video" or "photo"
+        start_time = starts[i]
+
+        if kind == "photo":
+            end_time = start_time + photo_length
+        else:  # video
+            end_time = starts[i + 1] if i + 1 < len(footages) else script_end
+
+        timed_footages.append({
+            "type": kind,
+            "filename": footage["token"]["filename"],
+            "start": start_time,
+            "end": end_time
+        })
 
     return timed_footages
 
@@ -1,23 +1,26 @@
-import base64
 import json
 import os
 import subprocess
 import time
 import uuid
-import warnings
 from typing import Dict, List
 
 import elevenlabs
 import openai
-from elevenlabs import VoiceSettings
 
 from elevenlabs.client import ElevenLabs
 
 from openai import OpenAI
 
 import services.pipelines.ffmpeg as ffmpeg
+import services.pipelines.llm as llm
+import services.pipelines.loudness as loudness
+import services.pipelines.mezzanine as mezzanine
+import services.pipelines.streaming as streaming
 import services.pipelines.subtitles as subs
-from services.pipelines.general.footage_parser import parse_and_time_script
+import services.pipelines.tts as tts
+from services.pipelines.audio_timeline import AudioTimeline
+from services.pipelines.general.footage_parser import parse_and_time_script, FootageStreamParser
 
 
 class ShortVideoPipeline:
@@ -28,16 +31,24 @@ class ShortVideoPipeline:
 
     elevenlabs_client: elevenlabs.ElevenLabs = None
 
+    voice: tts.VoiceConfig = None
+    # How photo footages move, see ffmpeg.PHOTO_MOTIONS
+    photo_motion: str = 'none'
+
     media_dir = './media'
     # The directory where all the output files are stored, equals to ./output/{pipeline_id}
     output_dir = None
 
-    def __init__(self, open_api_key: str, elevenlaps_api_key: str, pexels_api_key: str):
+    def __init__(self, open_api_key: str, elevenlaps_api_key: str, pexels_api_key: str, openai_client=None):
+        """
+        :param openai_client: Replaces the OpenAI client, e.g. with llm.LocalChatClient in tests and benchmarks
+        """
         self.pexels_api_key = pexels_api_key
-        self.openai_client = OpenAI(
+        self.openai_client = openai_client if openai_client is not None else OpenAI(
             api_key=open_api_key,
         )
         self.elevenlabs_client = ElevenLabs(api_key=elevenlaps_api_key)
+        self.voice = tts.VoiceConfig()
 
         self.pipeline_id = uuid.uuid4()
         self.output_dir = f'./output/{self.pipeline_id}'
@@ -49,20 +60,23 @@ class ShortVideoPipeline:
             speech_path: str,
             timed_footages: List[Dict],
             # List of {"type": "video" or "photo", "filename": str, "start": float, "end": float}
-            sentences: list
+            sentences: list,
+            streaming: bool = False
     ) -> str:
         """
         Creates a final video from timed footages so that:
           1. The total timeline from 0..audio_duration is fully covered (no gaps).
           2. Each footage is clipped to its (end-start) length if it's a video,
-             or 1 second if it's a photo.
+             or 1 second if it's a photo (a still clip, see ffmpeg.create_photo_clip).
           3. Subtitles and audio are added for the entire audio duration.
+
+        With 'streaming' the footages are cut, concatenated, subtitled and mixed as one pipe-connected
+        stream (see services.pipelines.streaming), nothing but the output is written to disk.
         """
 
         speech_path = os.path.abspath(speech_path)
         concat_timeline_path = os.path.join(self.output_dir, 'concatenated_timeline.mp4')
         concat_with_subs = os.path.join(self.output_dir, 'concat_with_subs.mp4')
-        concat_with_speech = os.path.join(self.output_dir, 'concat_with_speech.mp4')
         output_path = os.path.join(self.output_dir, 'output.mp4')
 
         music_path = os.path.join(self.media_dir, 'uplifting_1.mp3')  # for background music (tmp)
@@ -101,13 +115,22 @@ class ShortVideoPipeline:
                     f"Gap found between footage[{i}] ending at {this_end} and footage[{i + 1}] starting at {next_start}."
                 )
 
+        def resolve_media_path(file_name: str):
+            return os.path.abspath(os.path.join(self.media_dir, file_name))
+
+        if streaming:
+            self.stream_edit(speech_path, sorted_footages, sentences, music_path, h264_encoder, output_path,
+                             resolve_media_path, self.photo_motion)
+
+            total_time = time.time() - edit_start
+            print(f"✅ Edited the YouTube shorts video in {total_time:.2f} sec.")
+
+            return output_path
+
         #####################################################################
         # 3) Create snippet clips for each footage
         #####################################################################
 
-        def resolve_media_path(file_name: str):
-            return os.path.abspath(os.path.join(self.media_dir, file_name))
-
         snippet_paths = []
         for i, f in enumerate(sorted_footages):
             ftype = f["type"]  # "video" or "photo"
@@ -124,24 +147,21 @@ class ShortVideoPipeline:
             if ftype == "video":
                 # We'll clip exactly segment_duration from the start of that file
                 # (assuming the source is long enough).
-                ffmpeg.format_youtube_short_video(
+                mezzanine.format_clip(
                     video_path=fname,
                     clip_length=segment_duration,
                     video_encoder=h264_encoder,
                     output_path=snippet_path
                 )
             else:  # "photo"
-                # We'll create a short clip of exactly 1 second if GPT said so,
-                # but the logic says (end - start)=1 anyway.
-                # We'll just do the same approach but with a helper for photos:
-                # ffmpeg.create_photo_clip(
-                #     photo_path=fname,
-                #     clip_length=segment_duration,
-                #     encoder=h264_encoder,
-                #     output_path=snippet_path
-                # )
-
-                warnings.warn("Photo clips are not supported yet. Skipping photo clip creation.")
+                # A looped still, far cheaper than a video clip (and cached)
+                ffmpeg.create_photo_clip(
+                    photo_path=fname,
+                    clip_length=segment_duration,
+                    encoder='libx264',
+                    output_path=snippet_path,
+                    motion=f.get("motion", self.photo_motion)
+                )
 
             snippet_paths.append(snippet_path)
 
@@ -166,36 +186,63 @@ class ShortVideoPipeline:
         print(f"✅ Added subtitles to the video, took {end - start} sec.")
 
         #####################################################################
-        # 6) Add the speech
-        #####################################################################
-        start = time.time()
-        ffmpeg.add_audio(concat_with_subs, speech_path, h264_encoder, concat_with_speech)
-        end = time.time()
-        print(f"✅ Added voice to the video, took {end - start} sec.")
-
-        #####################################################################
-        # 7) Add background music
+        # 6) Add the speech and the background music, the video is copied
         #####################################################################
         start = time.time()
-        ffmpeg.mix_background_audio(concat_with_speech, music_path, output_path)
+        (AudioTimeline(duration=audio_duration)
+         .add(speech_path, bus='speech', loudness=loudness.DEFAULT_TARGET_LOUDNESS)
+         .add(music_path, bus='music', gain_db=-25, loop=True, loudness=loudness.DEFAULT_TARGET_LOUDNESS)
+         .mux(concat_with_subs, output_path))
         end = time.time()
-        print(f"✅ Added background music to the video, took {end - start} sec.")
+        print(f"✅ Added voice and background music to the video, took {end - start} sec.")
 
         #####################################################################
-        # 8) Cleanup
+        # 7) Cleanup
         #####################################################################
         for snippet in snippet_paths:
             os.remove(snippet)
         os.remove(concat_timeline_path)
-        os.remove(concat_with_speech)
+        os.remove(concat_with_subs)
 
         total_time = time.time() - edit_start
         print(f"✅ Edited the YouTube shorts video in {total_time:.2f} sec.")
 
         return output_path
 
+    @staticmethod
+    def stream_edit(speech_path: str, sorted_footages: List[Dict], sentences: list, music_path: str,
+                    h264_encoder: str, output_path: str, resolve_media_path, photo_motion: str = 'none'):
+        footages = []
+        for f in sorted_footages:
+            segment_duration = f["end"] - f["start"]
+            if segment_duration <= 0:
+                raise ValueError(f"Invalid segment duration for {f['filename']}, start={f['start']}, end={f['end']}.")
+
+            path = resolve_media_path(f["filename"])
+            if f["type"] == "photo":
+                # the cached still clip is already 1080x1920, the concat formats it again at no real cost
+                path = ffmpeg.get_photo_clip(path, segment_duration, 'libx264', f.get("motion", photo_motion))
+
+            footages.append({"path": path, "duration": segment_duration})
+
+        start = time.time()
+        streaming.stream_frames(
+            producer_cmd=ffmpeg.build_concat_stream_cmd(footages),
+            consumer_cmd=ffmpeg.build_finish_stream_cmd(
+                audio_timeline=AudioTimeline(duration=sum(f["duration"] for f in footages))
+                .add(speech_path, bus='speech', loudness=loudness.DEFAULT_TARGET_LOUDNESS)
+                .add(music_path, bus='music', gain_db=-25, loop=True, loudness=loudness.DEFAULT_TARGET_LOUDNESS),
+                video_encoder=h264_encoder,
+                output_path=output_path
+            ),
+            transform=subs.SubtitleCompositor(sentences)
+        )
+        end = time.time()
+        print(f"✅ Streamed {len(footages)} footages with subtitles, voice and music, took {end - start} sec.")
+
     def generate_script(self, prompt: str) -> str:
-        response = self.openai_client.chat.completions.create(
+        script = llm.complete_chat(
+            self.openai_client,
             model=self.openai_model,
             messages=[
                 {"role": "system", "content": "You are an AI agent for that produces short video scripts."},
@@ -203,10 +250,7 @@ class ShortVideoPipeline:
             ],
             temperature=0.7,
             max_tokens=800
-        )
-
-        # Extract the content of the response
-        script = response.choices[0].message.content.strip()
+        ).strip()
 
         # Save to file
         with open(os.path.join(self.output_dir, 'script_1st_shot.txt'), 'w') as f:
@@ -216,7 +260,8 @@ class ShortVideoPipeline:
         return script
 
     def generate_script_2nd_shot(self, prompt) -> str:
-        response = self.openai_client.chat.completions.create(
+        script = llm.complete_chat(
+            self.openai_client,
             model=self.openai_model,
             messages=[
                 {"role": "system", "content": "You are an AI agent for that enhances short video scripts."},
@@ -224,10 +269,7 @@ class ShortVideoPipeline:
             ],
             temperature=0.7,
             max_tokens=800
-        )
-
-        # Extract the content of the response
-        script = response.choices[0].message.content.strip()
+        ).strip()
 
         # Save to file
         with open(os.path.join(self.output_dir, 'script_2nd_shot.txt'), 'w') as f:
@@ -237,19 +279,27 @@ class ShortVideoPipeline:
         return script
 
     def generate_script_with_footages(self, prompt):
-        response = self.openai_client.chat.completions.create(
+        # The ./media library has no upload step, so its videos are queued for normalization as soon as their
+        # block is streamed. This render does not wait for them, later renders of the same footage only trim it.
+        footage_parser = FootageStreamParser()
+
+        def on_delta(delta: str):
+            for footage in footage_parser.feed(delta):
+                path = os.path.abspath(os.path.join(self.media_dir, footage["filename"]))
+                if footage["footage_kind"] == "video" and os.path.exists(path):
+                    mezzanine.build_mezzanine_in_background(path)
+
+        script = llm.complete_chat(
+            self.openai_client,
             model=self.openai_model,
             messages=[
                 {"role": "system", "content": "You are an AI agent that picks footages for YouTube shorts."},
                 {"role": "user", "content": prompt},
             ],
             temperature=0.7,
-            max_tokens=800
-        )
-
-        # Extract the content of the response
-        script = response.choices[0].message.content.strip()
-
+            max_tokens=800,
+            on_delta=on_delta
+        ).strip()
 
         # Save to file
         with open(os.path.join(self.output_dir, 'script_with_footages.txt'), 'w') as f:
@@ -259,19 +309,10 @@ class ShortVideoPipeline:
         return script
 
     def text_to_speech(self, script) -> (str, list, list):
-        audio = self.elevenlabs_client.text_to_speech.convert_with_timestamps(
-            text=script,
-            # Liam
-            voice_id="TX3LPaxmHKxFdv7VOQHJ",
-            model_id="eleven_multilingual_v2",
-            output_format='mp3_44100_128',
-            voice_settings=VoiceSettings(stability=0.71, similarity_boost=0.5, style=0.0, use_speaker_boost=True)
-        )
-
         output_file = self.output_dir + '/elevenlabs_script.mp3'
 
-        audio_bytes = base64.b64decode(audio["audio_base64"])
-        alignment = audio['alignment']
+        # Goes through the TTS cache shared with the other pipelines
+        alignment = tts.text_to_speech(self.elevenlabs_client, script, output_file, voice=self.voice)
 
         words = subs.group_chars_into_words(
             alignment['characters'],
@@ -285,10 +326,6 @@ class ShortVideoPipeline:
             json_str = json.dumps(alignment, indent=4)
             f.write(json_str)
 
-        # Write the audio data to a file
-        with open(output_file, "wb") as f:
-            f.write(audio_bytes)
-
         print("✅ Generated speech using Eleven Labs")
 
         return output_file, words, sentences
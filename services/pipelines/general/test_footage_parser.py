@@ -1,7 +1,9 @@
 import pytest
 from footage_parser import (
     parse_script_with_footages,
-    parse_and_time_script
+    parse_and_time_script,
+    align_words,
+    FootageStreamParser
 )
 
 def test_parse_script_with_footages():
@@ -47,4 +49,39 @@ def test_parse_and_time_script():
     assert timed[1]["filename"] == "file_logo.png"
     # starts at next word => 2.0, ends => 2.0+1.0=3.0
     assert pytest.approx(timed[1]["start"], 0.01) == 2.0
-    assert pytest.approx(timed[1]["end"], 0.01) == 3.0
\ No newline at end of file
+    assert pytest.approx(timed[1]["end"], 0.01) == 3.0
+
+def test_parse_and_time_script_tolerates_tokenization_differences():
+    # The script has a standalone dash and "world," the TTS dropped "really" and split "ice-cream"
+    script = """Hello world, — really
+                {{"video": "a.mp4"}}
+                I like ice-cream.
+                {{"video": "b.mp4"}}
+                Bye!"""
+    words = [
+        {"text": "Hello", "start": 0.0, "end": 0.5},
+        {"text": "world,", "start": 0.5, "end": 1.0},
+        {"text": "I", "start": 1.2, "end": 1.3},
+        {"text": "like", "start": 1.3, "end": 1.6},
+        {"text": "ice", "start": 1.6, "end": 1.8},
+        {"text": "cream.", "start": 1.8, "end": 2.2},
+        {"text": "Bye!", "start": 2.4, "end": 2.8},
+    ]
+    timed = parse_and_time_script(script, words)
+
+    assert pytest.approx(timed[0]["start"], 0.01) == 1.2
+    assert pytest.approx(timed[0]["end"], 0.01) == 2.4
+    assert pytest.approx(timed[1]["start"], 0.01) == 2.4
+    assert pytest.approx(timed[1]["end"], 0.01) == 2.8
+
+def test_align_words_resynchronizes():
+    matched = align_words(["a", "b", "x", "c", "d"], ["a", "b", "c", "y", "d"])
+    assert matched == [0, 1, None, 2, 4]
+
+def test_footage_stream_parser_finds_blocks_as_they_complete():
+    parser = FootageStreamParser()
+
+    assert parser.feed('Hello {{"vid') == []
+    found = parser.feed('eo": "a.mp4"}} world {{"photo": "b.png"}}')
+    assert [f["filename"] for f in found] == ["a.mp4", "b.png"]
+    assert parser.feed(' the end') == []
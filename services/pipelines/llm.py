@@ -0,0 +1,131 @@
+import logging
+import time
+from types import SimpleNamespace
+from typing import Callable, Iterator
+
+from services.pipelines.cache import DiskCache, make_key
+
+# Scripts are a few KB each
+LLM_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_llm_cache: DiskCache = None
+
+
+def get_llm_cache() -> DiskCache:
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = DiskCache('llm', LLM_CACHE_MAX_BYTES)
+    return _llm_cache
+
+
+def client_identity(client) -> str:
+    """
+    Tells the clients apart in the cache keys, so e.g. the canned answers of a LocalChatClient are never
+    served to an openai.OpenAI client, nor the answers of one endpoint to another.
+    """
+    return f"{type(client).__module__}.{type(client).__qualname__}@{getattr(client, 'base_url', '')}"
+
+
+def stream_chat(client, model: str, messages: list[dict], temperature: float, max_tokens: int,
+                cache: DiskCache = None) -> Iterator[str]:
+    """
+    Streams a chat completion, yielding the text as it arrives.
+
+    Responses are cached by (client, model, messages, temperature, max_tokens), a cached response is yielded
+    at once.
+    Only a response that was streamed to the end is cached.
+
+    :param client: An openai.OpenAI client, or anything with the same chat.completions.create (see LocalChatClient)
+    :param cache: The response cache, defaults to the shared one
+    :return: The text deltas
+    """
+    if cache is None:
+        cache = get_llm_cache()
+
+    key = make_key(client_identity(client), model, messages, temperature, max_tokens)
+
+    cached = cache.get_json(key)
+    if cached is not None:
+        logging.info(f"✅ Using cached {model} response: {key[:12]}")
+        yield cached["content"]
+        return
+
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True
+    )
+
+    parts = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield delta
+
+    cache.put_json(key, {"model": model, "content": "".join(parts)})
+
+
+def complete_chat(client, model: str, messages: list[dict], temperature: float, max_tokens: int,
+                  on_delta: Callable[[str], None] = None, cache: DiskCache = None) -> str:
+    """
+    Same as stream_chat, but returns the whole text. 'on_delta' sees every delta as it arrives,
+    so parsing can start on partial output.
+    """
+    parts = []
+    for delta in stream_chat(client, model, messages, temperature, max_tokens, cache=cache):
+        parts.append(delta)
+        if on_delta is not None:
+            on_delta(delta)
+    return "".join(parts)
+
+
+class LocalChatClient:
+    """
+    A stand-in for openai.OpenAI in tests and benchmarks: it answers chat completions locally,
+    optionally with a simulated latency, so pipelines can run and be timed without the network.
+
+        client = LocalChatClient(lambda messages: "A script.", first_token_latency=0.3, tokens_per_second=50)
+        pipeline = ShortVideoPipeline(..., openai_client=client)
+    """
+
+    def __init__(self, respond: Callable[[list[dict]], str], first_token_latency: float = 0.0,
+                 tokens_per_second: float = None):
+        """
+        :param respond: Returns the response text for the messages
+        :param first_token_latency: Seconds before the first delta
+        :param tokens_per_second: Delta rate (a delta is a word), None for no delay
+        """
+        self.respond = respond
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+
+        self.calls: list[dict] = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, messages: list[dict], stream: bool = False, **options):
+        self.calls.append({"model": model, "messages": messages, "stream": stream, **options})
+        text = self.respond(messages)
+
+        if not stream:
+            time.sleep(self.first_token_latency)
+            if self.tokens_per_second:
+                time.sleep(len(text.split()) / self.tokens_per_second)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+        return self._stream(text)
+
+    def _stream(self, text: str):
+        time.sleep(self.first_token_latency)
+
+        # one delta per word, whitespace included, so the deltas join back into the text
+        words = text.split(' ')
+        for i, word in enumerate(words):
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            delta = word if i == len(words) - 1 else word + ' '
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
@@ -0,0 +1,214 @@
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import services.pipelines.llm as llm
+from services.pipelines.cache import DiskCache
+from services.pipelines.long_to_shorts.transcript_index import TranscriptIndex
+
+# Leaves room for the instructions and the answer in gpt-4o's context, and keeps every request fast
+DEFAULT_WINDOW_TOKENS = 6000
+
+# Cues repeated at the start of the next window, so a highlight across a boundary is seen whole once
+WINDOW_OVERLAP_CUES = 4
+
+# How far outside its window a highlight's bound may be and still be snapped into it, in seconds
+SNAP_TOLERANCE = 1.0
+
+SYSTEM_PROMPT = "You are an AI agent that finds the best moments of long videos for YouTube shorts."
+
+SELECTION_PROMPT = """Below is a part of a video transcript, one subtitle per line as [start-end] text (seconds).
+Find up to {count} self-contained moments that would make a great short{topic}.
+Each moment must last between {min_length} and {max_length} seconds and start and end on subtitle boundaries.
+
+Answer only with a JSON list like:
+[{{"start": 12.0, "end": 48.5, "title": "A short title", "score": 8}}]
+where score (1-10) is how engaging the moment is. Answer [] if there is none.
+
+Transcript:
+{transcript}"""
+
+_token_counters: dict[str, Callable[[str], int]] = {}
+
+
+def get_token_counter(model: str) -> Callable[[str], int]:
+    """
+    Counts tokens the way 'model' does, with tiktoken (loaded on first use).
+    """
+    if model not in _token_counters:
+        import tiktoken
+
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        _token_counters[model] = lambda text: len(encoding.encode(text, disallowed_special=()))
+    return _token_counters[model]
+
+
+def format_cue(index: TranscriptIndex, cue: int) -> str:
+    return f"[{index.starts[cue]:.1f}-{index.ends[cue]:.1f}] {index.texts[cue]}"
+
+
+def split_windows(index: TranscriptIndex, max_tokens: int, count_tokens: Callable[[str], int],
+                  overlap_cues: int = WINDOW_OVERLAP_CUES) -> list[dict]:
+    """
+    Splits the transcript into windows of at most 'max_tokens' tokens (a single cue longer than that is
+    a window of its own). A window ends on a sentence boundary when one falls in its second half.
+
+    :return: list of dicts like {"first": cue, "end": cue (exclusive), "text": the formatted cues}
+    """
+    lines = [format_cue(index, cue) for cue in range(len(index.texts))]
+    # +1 for the newline joining the lines
+    tokens = [count_tokens(line) + 1 for line in lines]
+    sentence_starts = set(index.sentence_starts)
+
+    windows = []
+    first = 0
+    while first < len(lines):
+        end, used = first, 0
+        while end < len(lines) and (end == first or used + tokens[end] <= max_tokens):
+            used += tokens[end]
+            end += 1
+
+        if end < len(lines):
+            boundary = max((cue for cue in range(end - 1, first, -1) if cue in sentence_starts), default=None)
+            if boundary is not None and boundary - first >= (end - first) / 2:
+                end = boundary
+
+        windows.append({"first": first, "end": end, "text": "\n".join(lines[first:end])})
+
+        if end >= len(lines):
+            break
+        first = max(first + 1, end - overlap_cues)
+
+    return windows
+
+
+def parse_highlights(content: str) -> list[dict]:
+    """
+    Extracts the highlights from an answer, tolerating code fences and text around the JSON list.
+    """
+    match = re.search(r'\[.*\]', content, re.DOTALL)
+    if match is None:
+        return []
+
+    highlights = []
+    for item in json.loads(match.group(0)):
+        try:
+            highlights.append({
+                "start": float(item["start"]),
+                "end": float(item["end"]),
+                "title": str(item.get("title", "")),
+                "score": float(item.get("score", 0))
+            })
+        except (KeyError, TypeError, ValueError):
+            continue
+    return highlights
+
+
+def merge_highlights(highlights: list[dict], max_length: float) -> list[dict]:
+    """
+    The reduce step: overlapping highlights (e.g. the same moment seen by two overlapping windows) are
+    merged into their union when it is not longer than 'max_length', otherwise the better one is kept.
+
+    :return: The highlights, best first
+    """
+    merged = []
+    for highlight in sorted(highlights, key=lambda h: h["start"]):
+        if merged and highlight["start"] < merged[-1]["end"]:
+            last = merged[-1]
+            if max(last["end"], highlight["end"]) - last["start"] <= max_length:
+                best = last if last["score"] >= highlight["score"] else highlight
+                merged[-1] = {**best, "start": last["start"], "end": max(last["end"], highlight["end"])}
+            elif highlight["score"] > last["score"]:
+                merged[-1] = highlight
+            continue
+        merged.append(highlight)
+
+    return sorted(merged, key=lambda h: h["score"], reverse=True)
+
+
+def select_clips(client, model: str, index: TranscriptIndex, topic: str = None, count: int = 5,
+                 min_length: float = 15.0, max_length: float = 60.0, max_window_tokens: int = DEFAULT_WINDOW_TOKENS,
+                 max_workers: int = 4, count_tokens: Callable[[str], int] = None,
+                 cache: DiskCache = None) -> list[dict]:
+    """
+    Picks the best moments of a long transcript with an LLM, map-reduce style.
+
+    Map: the transcript is split into token-budgeted windows (split_windows), and every window is sent
+    on its own, at most 'max_workers' at a time. The answers are cached by request (see llm.stream_chat),
+    so a window already seen with the same settings is not sent again.
+    Reduce: the highlights of all windows are snapped to the subtitles, merged and ranked (merge_highlights).
+
+    :param client: An openai.OpenAI client, or llm.LocalChatClient
+    :param topic: What the shorts should be about, None for anything engaging
+    :param count: How many clips to return
+    :param count_tokens: Counts the tokens of a text, defaults to tiktoken for 'model'
+    :return: list of dicts like {"start", "end", "title", "score"}, best first
+    """
+    if count_tokens is None:
+        count_tokens = get_token_counter(model)
+
+    windows = split_windows(index, max_window_tokens, count_tokens)
+
+    def select(window: dict) -> list[dict]:
+        prompt = SELECTION_PROMPT.format(
+            count=count,
+            topic=f" about {topic}" if topic else "",
+            min_length=min_length,
+            max_length=max_length,
+            transcript=window["text"]
+        )
+        try:
+            content = llm.complete_chat(
+                client,
+                model=model,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.2,
+                max_tokens=800,
+                cache=cache
+            )
+            highlights = parse_highlights(content)
+        except Exception as e:
+            # one bad window should not lose the others
+            logging.error(f"clip selection failed for cues {window['first']}-{window['end']}: {e}")
+            return []
+
+        return [h for h in (_snap_to_window(index, window, h) for h in highlights) if h is not None]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        highlights = [h for window_highlights in executor.map(select, windows) for h in window_highlights]
+
+    logging.info(f"✅ {len(highlights)} highlights found in {len(windows)} transcript windows")
+
+    return [
+        h for h in merge_highlights(highlights, max_length)
+        if min_length <= h["end"] - h["start"] <= max_length
+    ][:count]
+
+
+def _snap_to_window(index: TranscriptIndex, window: dict, highlight: dict,
+                    tolerance: float = SNAP_TOLERANCE) -> dict | None:
+    """
+    Moves a highlight's bounds to the subtitles of its window, None if it is outside the window
+    (e.g. made up), give or take 'tolerance' seconds.
+    """
+    starts = index.starts[window["first"]:window["end"]]
+    ends = index.ends[window["first"]:window["end"]]
+
+    low, high = starts[0] - tolerance, ends[-1] + tolerance
+    if not (low <= highlight["start"] <= high and low <= highlight["end"] <= high):
+        return None
+
+    first = min(range(len(starts)), key=lambda i: abs(starts[i] - highlight["start"]))
+    last = min(range(len(ends)), key=lambda i: abs(ends[i] - highlight["end"]))
+    if last < first:
+        return None
+
+    return {**highlight, "start": starts[first], "end": ends[last]}
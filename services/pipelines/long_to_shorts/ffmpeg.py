@@ -0,0 +1,116 @@
+import shlex
+import subprocess
+
+# Clips closer than this are decoded as one segment, a seek costs about as much as decoding the gap
+DEFAULT_MAX_GAP = 2.0
+
+
+def plan_segments(clips: list[dict], max_gap: float = DEFAULT_MAX_GAP) -> list[dict]:
+    """
+    Groups the clips into the segments of the source to decode. Overlapping or nearby clips share a
+    segment, so their frames are decoded once. Segments are sorted by start.
+
+    :param clips: list of dicts, each like {"start": float, "end": float, "crop": "w:h:x:y" or None},
+                  optionally with a "filter" applied to the clip's video after the crop
+    :param max_gap: Clips at most this far apart (in seconds) are decoded together
+    :return: list of dicts, each like {"start": float, "end": float, "clips": [index in 'clips', ...]}
+    """
+    segments = []
+    for i in sorted(range(len(clips)), key=lambda i: clips[i]["start"]):
+        clip = clips[i]
+        if clip["end"] <= clip["start"]:
+            raise ValueError(f"Clip {i} ends ({clip['end']}s) before it starts ({clip['start']}s)")
+
+        if segments and clip["start"] - segments[-1]["end"] <= max_gap:
+            segments[-1]["end"] = max(segments[-1]["end"], clip["end"])
+            segments[-1]["clips"].append(i)
+        else:
+            segments.append({"start": clip["start"], "end": clip["end"], "clips": [i]})
+
+    return segments
+
+
+def build_extract_clips_cmd(video_path: str, clips: list[dict], output_paths: list[str], video_encoder: str,
+                            audio: bool = True, max_gap: float = DEFAULT_MAX_GAP) -> list[str]:
+    """
+    Builds a single ffmpeg command cutting every clip of a video to its own file.
+
+    Every segment (see plan_segments) is an input with a fast seek (-ss before -i jumps to the keyframe
+    before the segment), so only the segments are decoded, never the whole source up to the last clip.
+    The clips of a segment are split from its decoded frames with trim, and every clip is an output
+    with its own -map.
+
+    :param video_path: The long video
+    :param clips: See plan_segments
+    :param output_paths: One output per clip
+    :param video_encoder: e.g. "h264_videotoolbox" (macOS) or "libx264"
+    :param audio: Whether the video has an audio track to cut along
+    """
+    if len(clips) != len(output_paths):
+        raise ValueError(f"Got {len(clips)} clips but {len(output_paths)} output paths")
+
+    segments = plan_segments(clips, max_gap)
+
+    cmd = [
+        "ffmpeg", '-y',
+        '-hide_banner',
+        "-loglevel", "warning",
+    ]
+
+    filter_parts = []
+    for n, segment in enumerate(segments):
+        cmd += [
+            "-ss", str(segment["start"]),
+            "-t", str(segment["end"] - segment["start"]),
+            "-i", video_path
+        ]
+
+        streams = [("v", "split", "trim", "setpts")]
+        if audio:
+            streams.append(("a", "asplit", "atrim", "asetpts"))
+
+        for stream, split, trim, setpts in streams:
+            if len(segment["clips"]) > 1:
+                labels = [f"[s{n}{stream}{i}]" for i in segment["clips"]]
+                filter_parts.append(f"[{n}:{stream}]{split}={len(labels)}{''.join(labels)}")
+            else:
+                labels = [f"[{n}:{stream}]"]
+
+            for i, label in zip(segment["clips"], labels):
+                clip = clips[i]
+                chain = [
+                    f"{trim}=start={clip['start'] - segment['start']}:end={clip['end'] - segment['start']}",
+                    f"{setpts}=PTS-STARTPTS"
+                ]
+                if stream == "v" and clip.get("crop"):
+                    chain.append(f"crop={clip['crop']}")
+                if stream == "v" and clip.get("filter"):
+                    chain.append(clip["filter"])
+                filter_parts.append(f"{label}{','.join(chain)}[{stream}{i}]")
+
+    cmd += ["-filter_complex", "; ".join(filter_parts)]
+
+    for i, output_path in enumerate(output_paths):
+        cmd += ["-map", f"[v{i}]", "-c:v", video_encoder]
+        if audio:
+            cmd += ["-map", f"[a{i}]", "-c:a", "aac"]
+        else:
+            cmd += ["-an"]
+        cmd.append(output_path)
+
+    return cmd
+
+
+def extract_clips(video_path: str, clips: list[dict], output_paths: list[str], video_encoder: str,
+                  audio: bool = True, max_gap: float = DEFAULT_MAX_GAP):
+    """
+    Cuts every clip of a video in one ffmpeg run, see build_extract_clips_cmd.
+    """
+    cmd = build_extract_clips_cmd(video_path, clips, output_paths, video_encoder, audio, max_gap)
+
+    try:
+        print("Running ffmpeg:\n", " ".join(shlex.quote(arg) for arg in cmd))
+
+        subprocess.run(cmd, check=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg command failed with error: {e.stderr}")
@@ -1,7 +1,15 @@
+import logging
 import os
 import subprocess
 import openai
 
+import services.pipelines.ffmpeg as ffmpeg
+import services.pipelines.long_to_shorts.clip_selection as clip_selection
+import services.pipelines.long_to_shorts.ffmpeg as shorts_ffmpeg
+import services.pipelines.reframe as reframe
+import services.pipelines.scenes as scenes
+from services.pipelines.long_to_shorts.transcript_index import TranscriptIndex
+
 
 class LongToShortsPipeline:
     openai_model = 'gpt-4o'
@@ -9,8 +17,11 @@ class LongToShortsPipeline:
 
     output_dir = "output"
 
-    def __init__(self, openai_api_key: str):
-        self.openai_client = openai.OpenAI(
+    def __init__(self, openai_api_key: str, openai_client=None):
+        """
+        :param openai_client: Replaces the OpenAI client, e.g. with llm.LocalChatClient in tests and benchmarks
+        """
+        self.openai_client = openai_client if openai_client is not None else openai.OpenAI(
             api_key=openai_api_key,
         )
 
@@ -41,3 +52,111 @@ class LongToShortsPipeline:
         subprocess.run(command, check=True)
 
         return os.path.join(self.output_dir, "long.mp4"), os.path.join(self.output_dir, f"long.{lang}.srt")
+
+    def find_clip_candidates(self, srt_path: str, queries: list[str], min_length: float = 15.0,
+                             max_length: float = 60.0, phrase: bool = True) -> list[dict]:
+        """
+        Finds candidate clips for the shorts in the downloaded subtitles, see TranscriptIndex.search.
+        The subtitles are indexed once for all the queries.
+
+        :return: The windows of every query, best first, each with the "query" that found it
+        """
+        index = TranscriptIndex.from_srt_file(srt_path)
+
+        candidates = []
+        for query in queries:
+            for window in index.search(query, min_length, max_length, phrase):
+                candidates.append({**window, "query": query})
+
+        return sorted(candidates, key=lambda window: window["score"], reverse=True)
+
+    def select_clips(self, srt_path: str, topic: str = None, count: int = 5, min_length: float = 15.0,
+                     max_length: float = 60.0, max_workers: int = 4) -> list[dict]:
+        """
+        Lets the LLM pick the best moments of the whole video, however long (see clip_selection.select_clips).
+
+        :param srt_path: The downloaded subtitles
+        :param topic: What the shorts should be about, None for anything engaging
+        :return: list of dicts like {"start", "end", "title", "score"}, best first, ready for cut_shorts
+        """
+        return clip_selection.select_clips(
+            self.openai_client,
+            self.openai_model,
+            TranscriptIndex.from_srt_file(srt_path),
+            topic=topic,
+            count=count,
+            min_length=min_length,
+            max_length=max_length,
+            max_workers=max_workers
+        )
+
+    @staticmethod
+    def snap_clip_to_scenes(video_path: str, clip: dict, max_shift: float) -> dict:
+        """
+        Moves the bounds of a clip to the nearest scene cuts within 'max_shift' seconds. A clip that would
+        collapse (e.g. both bounds snapping to the same cut) keeps its bounds.
+        """
+        start_cut = scenes.find_scene_cut(video_path, clip["start"], max_shift)
+        end_cut = scenes.find_scene_cut(video_path, clip["end"], max_shift)
+
+        start = clip["start"] if start_cut is None else start_cut
+        end = clip["end"] if end_cut is None else end_cut
+        if end <= start:
+            logging.warning(f"Snapping {clip['start']}-{clip['end']} to scenes collapses it, keeping it as is")
+            return clip
+
+        return {**clip, "start": start, "end": end}
+
+    def cut_shorts(self, video_path: str, clips: list[dict], snap_to_scenes: float = 0.0,
+                   reframe_clips: bool = False) -> list[str]:
+        """
+        Cuts the shorts out of the long video, all of them from a single decode of the source
+        (see long_to_shorts.ffmpeg.extract_clips).
+
+        :param video_path: The long video
+        :param clips: list of dicts, each like {"start": float, "end": float, "crop": "w:h:x:y" or None}
+        :param snap_to_scenes: Move the clip boundaries to scene cuts at most this many seconds away,
+                               0 (the default) to cut exactly. Only the source around the boundaries is
+                               analyzed (see scenes.find_scene_cut)
+        :param reframe_clips: Crop the clips without a "crop" to 9:16 following the subject (see reframe)
+        :return: The paths of the shorts, in the order of 'clips'
+        """
+        if snap_to_scenes > 0:
+            clips = [self.snap_clip_to_scenes(video_path, clip, snap_to_scenes) for clip in clips]
+
+        output_paths = [os.path.join(self.output_dir, f"short_{i}.mp4") for i in range(len(clips))]
+
+        commands_paths = []
+        if reframe_clips:
+            reframed = []
+            for i, clip in enumerate(clips):
+                if clip.get("crop"):
+                    reframed.append(clip)
+                    continue
+                # only the clip is analyzed, not the whole source
+                crop_path = reframe.get_crop_path(video_path, start=clip["start"], duration=clip["end"] - clip["start"])
+                commands_path = os.path.join(self.output_dir, f"short_{i}.cmd")
+                commands_paths.append(commands_path)
+                reframed.append({
+                    **clip,
+                    "filter": reframe.write_crop_filter(crop_path, commands_path, clip["start"], clip["end"])
+                })
+            clips = reframed
+
+        h264_encoder = ffmpeg.get_gpu_accelerated_h264_encoder()
+        if h264_encoder is None:
+            h264_encoder = 'libx264'
+
+        try:
+            shorts_ffmpeg.extract_clips(
+                video_path,
+                clips,
+                output_paths,
+                video_encoder=h264_encoder
+            )
+        finally:
+            for commands_path in commands_paths:
+                if os.path.exists(commands_path):
+                    os.remove(commands_path)
+
+        return output_paths
@@ -0,0 +1,83 @@
+import json
+import re
+import tempfile
+import unittest
+
+from services.pipelines.cache import DiskCache
+from services.pipelines.llm import LocalChatClient
+from services.pipelines.long_to_shorts.clip_selection import (
+    _snap_to_window,
+    merge_highlights,
+    select_clips,
+    split_windows
+)
+from services.pipelines.long_to_shorts.transcript_index import TranscriptIndex
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+class TestClipSelection(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = DiskCache('llm', 1024 * 1024, root=self.tmp.name)
+
+        # 60 cues of 5 seconds, a sentence every 3 cues
+        texts = [f"cue {i} {'ends.' if i % 3 == 2 else 'goes on'}" for i in range(60)]
+        self.index = TranscriptIndex([i * 5.0 for i in range(60)], [i * 5.0 + 5.0 for i in range(60)], texts)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_windows_fit_the_budget_and_cover_everything(self):
+        windows = split_windows(self.index, max_tokens=50, count_tokens=count_words, overlap_cues=1)
+
+        self.assertGreater(len(windows), 1)
+        self.assertEqual(windows[0]["first"], 0)
+        self.assertEqual(windows[-1]["end"], 60)
+        for window, following in zip(windows, windows[1:]):
+            self.assertLessEqual(count_words(window["text"]) + window["end"] - window["first"], 50)
+            self.assertEqual(following["first"], window["end"] - 1)
+
+    def test_map_reduce_with_a_local_client(self):
+        def respond(messages):
+            # picks the first 4 cues of every window, the windows are far enough apart not to overlap
+            times = [float(t) for t in re.findall(r'^\[(\d+\.\d)-', messages[-1]["content"], re.MULTILINE)]
+            return "```json\n" + json.dumps([{"start": times[0], "end": times[0] + 20.0, "score": times[0]}]) + "\n```"
+
+        client = LocalChatClient(respond)
+        clips = select_clips(client, 'gpt-4o', self.index, count=3, max_window_tokens=100,
+                             count_tokens=count_words, cache=self.cache)
+
+        self.assertEqual(len(clips), 3)
+        self.assertEqual([clip["end"] - clip["start"] for clip in clips], [20.0] * 3)
+        self.assertGreater(clips[0]["score"], clips[-1]["score"])
+
+        # every window is cached
+        calls = len(client.calls)
+        select_clips(client, 'gpt-4o', self.index, count=3, max_window_tokens=100,
+                     count_tokens=count_words, cache=self.cache)
+        self.assertEqual(len(client.calls), calls)
+
+    def test_highlights_outside_their_window_are_dropped(self):
+        window = {"first": 10, "end": 20, "text": ""}
+
+        snapped = _snap_to_window(self.index, window, {"start": 51.0, "end": 74.0, "title": "", "score": 5})
+        self.assertEqual((snapped["start"], snapped["end"]), (50.0, 75.0))
+
+        self.assertIsNone(_snap_to_window(self.index, window, {"start": 120.0, "end": 150.0, "title": "", "score": 5}))
+        self.assertIsNone(_snap_to_window(self.index, window, {"start": 90.0, "end": 110.0, "title": "", "score": 5}))
+
+    def test_overlapping_highlights_are_merged(self):
+        merged = merge_highlights([
+            {"start": 0.0, "end": 30.0, "title": "a", "score": 5},
+            {"start": 20.0, "end": 40.0, "title": "b", "score": 7},
+            {"start": 35.0, "end": 90.0, "title": "c", "score": 6},
+        ], max_length=60.0)
+
+        self.assertEqual(merged, [{"start": 0.0, "end": 40.0, "title": "b", "score": 7}])
+
+
+if __name__ == "__main__":
+    unittest.main()
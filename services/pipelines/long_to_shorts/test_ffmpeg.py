@@ -0,0 +1,43 @@
+import unittest
+
+from services.pipelines.long_to_shorts.ffmpeg import build_extract_clips_cmd, plan_segments
+
+
+class TestExtractClips(unittest.TestCase):
+    def test_nearby_clips_share_a_segment(self):
+        clips = [
+            {"start": 600.0, "end": 640.0},
+            {"start": 10.0, "end": 50.0},
+            {"start": 45.0, "end": 80.0},
+            {"start": 81.0, "end": 100.0},
+        ]
+
+        self.assertEqual(plan_segments(clips, max_gap=2.0), [
+            {"start": 10.0, "end": 100.0, "clips": [1, 2, 3]},
+            {"start": 600.0, "end": 640.0, "clips": [0]},
+        ])
+
+    def test_one_seeked_input_per_segment_and_one_output_per_clip(self):
+        clips = [
+            {"start": 10.0, "end": 20.0, "crop": "608:1080:656:0"},
+            {"start": 15.0, "end": 30.0},
+            {"start": 300.0, "end": 310.0},
+        ]
+
+        cmd = build_extract_clips_cmd('long.mp4', clips, ['a.mp4', 'b.mp4', 'c.mp4'], 'libx264')
+
+        self.assertEqual(cmd.count('-i'), 2)
+        self.assertEqual(cmd[cmd.index('-ss'):cmd.index('-ss') + 6], ['-ss', '10.0', '-t', '20.0', '-i', 'long.mp4'])
+
+        graph = cmd[cmd.index('-filter_complex') + 1]
+        self.assertIn("[0:v]split=2[s0v0][s0v1]", graph)
+        self.assertIn("[s0v1]trim=start=5.0:end=20.0,setpts=PTS-STARTPTS[v1]", graph)
+        self.assertIn("crop=608:1080:656:0[v0]", graph)
+        self.assertIn("[1:a]atrim=start=0.0:end=10.0,asetpts=PTS-STARTPTS[a2]", graph)
+
+        self.assertEqual(cmd[-1], 'c.mp4')
+        self.assertEqual(cmd.count('-map'), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from services.pipelines.long_to_shorts.transcript_index import TranscriptIndex, parse_srt
+
+SRT = """1
+00:00:00,000 --> 00:00:04,000
+Welcome back to the channel.
+
+2
+00:00:04,000 --> 00:00:09,000
+Today we talk about <i>black holes</i>
+
+3
+00:00:09,000 --> 00:00:14,000
+and why a black hole bends light.
+
+4
+00:00:20,000 --> 00:00:25,000
+Thanks for watching
+"""
+
+
+class TestTranscriptIndex(unittest.TestCase):
+    def test_parses_srt(self):
+        starts, ends, texts = parse_srt(SRT)
+
+        self.assertEqual(starts, [0.0, 4.0, 9.0, 20.0])
+        self.assertEqual(ends[-1], 25.0)
+        self.assertEqual(texts[1], "Today we talk about black holes")
+
+    def test_rolling_captions_are_kept_once(self):
+        _, _, texts = parse_srt(
+            "1\n00:00:00,000 --> 00:00:02,000\nhello there\n\n"
+            "2\n00:00:02,000 --> 00:00:04,000\nhello there\ngeneral kenobi\n"
+        )
+
+        self.assertEqual(texts, ["hello there", "general kenobi"])
+
+    def test_phrase_search_returns_sentence_windows(self):
+        index = TranscriptIndex.from_srt(SRT)
+
+        self.assertEqual(index.find_phrase("black hole"), [2])
+        self.assertEqual(index.find_phrase("holes and why"), [1])
+        self.assertEqual(index.find_keywords("BLACK watching"), [1, 2, 3])
+
+        windows = index.search("black hole", min_length=5.0, max_length=20.0)
+
+        # the sentence spans cues 1-2, the pause before cue 3 ends it
+        self.assertEqual(len(windows), 1)
+        self.assertEqual((windows[0]["start"], windows[0]["end"]), (4.0, 14.0))
+        self.assertAlmostEqual(windows[0]["density"], 13 / 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
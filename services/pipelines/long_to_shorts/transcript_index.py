@@ -0,0 +1,219 @@
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+
+SRT_TIME_PATTERN = re.compile(
+    r'(\d+):(\d{2}):(\d{2})[,.](\d{3})\s*-->\s*(\d+):(\d{2}):(\d{2})[,.](\d{3})'
+)
+SRT_TAG_PATTERN = re.compile(r'<[^>]+>|\{[^}]+\}')
+TERM_PATTERN = re.compile(r"\w+(?:'\w+)?", re.UNICODE)
+SENTENCE_END_PATTERN = re.compile(r'[.!?…]["\')\]]*$')
+
+# A silence this long between subtitles ends a sentence, auto-generated subtitles have no punctuation
+SENTENCE_PAUSE = 1.0
+
+
+def normalize_terms(text: str) -> list[str]:
+    """
+    Splits a text into lowercase terms without punctuation, the form both the index and the queries use.
+    """
+    return TERM_PATTERN.findall(text.lower())
+
+
+def parse_srt(srt_text: str) -> (list[float], list[float], list[str]):
+    """
+    Parses an SRT file into (starts, ends, texts), one entry per subtitle, in time order.
+
+    Formatting tags are dropped, and the repeated lines of YouTube's rolling auto-generated subtitles
+    are kept once.
+    """
+    starts, ends, texts = [], [], []
+    for block in re.split(r'\n\s*\n', srt_text.replace('\r\n', '\n').strip()):
+        lines = block.strip().split('\n')
+        for n, line in enumerate(lines):
+            match = SRT_TIME_PATTERN.search(line)
+            if match is None:
+                continue
+
+            h1, m1, s1, ms1, h2, m2, s2, ms2 = (int(g) for g in match.groups())
+            text = " ".join(SRT_TAG_PATTERN.sub('', l).strip() for l in lines[n + 1:])
+            text = " ".join(text.split())
+
+            # rolling captions repeat the previous line on top of the new one
+            if texts and text.startswith(texts[-1]) and texts[-1]:
+                text = text[len(texts[-1]):].strip()
+            if not text:
+                break
+
+            starts.append(h1 * 3600 + m1 * 60 + s1 + ms1 / 1000)
+            ends.append(h2 * 3600 + m2 * 60 + s2 + ms2 / 1000)
+            texts.append(text)
+            break
+
+    order = sorted(range(len(starts)), key=lambda i: starts[i])
+    return [starts[i] for i in order], [ends[i] for i in order], [texts[i] for i in order]
+
+
+class TranscriptIndex:
+    """
+    A subtitle track as time-indexed arrays with an inverted index over its terms.
+
+    A query looks up the positions of its terms instead of scanning the transcript, and a window's
+    word count is a difference of prefix sums, so searching a multi-hour video takes milliseconds.
+
+        index = TranscriptIndex.from_srt_file("output/long.en.srt")
+        for window in index.search("black hole", min_length=20, max_length=60)[:5]:
+            ...  # {"start": 754.2, "end": 801.9, "hits": 3, "density": 2.7, "score": ..., "text": ...}
+    """
+
+    starts: array = None
+    ends: array = None
+    texts: list[str] = []
+
+    # the cue of every term occurrence, and where every term occurs (positions in token order)
+    token_cues: array = None
+    postings: dict[str, array] = {}
+
+    # word_prefix[i] = number of words in the cues before i
+    word_prefix: array = None
+
+    # cue indices where a sentence starts, sorted
+    sentence_starts: array = None
+
+    def __init__(self, starts: list[float], ends: list[float], texts: list[str]):
+        self.starts = array('d', starts)
+        self.ends = array('d', ends)
+        self.texts = texts
+
+        self.token_cues = array('I')
+        self.postings = {}
+        self.word_prefix = array('I', [0])
+        self.sentence_starts = array('I')
+
+        for cue, text in enumerate(texts):
+            terms = normalize_terms(text)
+            for term in terms:
+                self.postings.setdefault(term, array('I')).append(len(self.token_cues))
+                self.token_cues.append(cue)
+            self.word_prefix.append(self.word_prefix[-1] + len(terms))
+
+            if cue == 0 or SENTENCE_END_PATTERN.search(texts[cue - 1]) \
+                    or starts[cue] - ends[cue - 1] >= SENTENCE_PAUSE:
+                self.sentence_starts.append(cue)
+
+    @classmethod
+    def from_srt(cls, srt_text: str) -> 'TranscriptIndex':
+        return cls(*parse_srt(srt_text))
+
+    @classmethod
+    def from_srt_file(cls, srt_path: str) -> 'TranscriptIndex':
+        with open(srt_path, 'r', encoding='utf-8', errors='replace') as f:
+            return cls.from_srt(f.read())
+
+    def find_phrase(self, phrase: str) -> list[int]:
+        """
+        The cues where the phrase starts, its terms following each other (across cues too).
+        """
+        terms = normalize_terms(phrase)
+        if not terms or any(term not in self.postings for term in terms):
+            return []
+
+        positions = self.postings[terms[0]]
+        for offset, term in enumerate(terms[1:], start=1):
+            following = self.postings[term]
+            positions = [p for p in positions if _contains(following, p + offset)]
+            if not positions:
+                return []
+
+        return sorted({self.token_cues[p] for p in positions})
+
+    def find_keywords(self, keywords: str) -> list[int]:
+        """
+        The cues containing any of the keywords.
+        """
+        cues = set()
+        for term in normalize_terms(keywords):
+            cues.update(self.token_cues[p] for p in self.postings.get(term, ()))
+        return sorted(cues)
+
+    def words_between(self, first_cue: int, end_cue: int) -> int:
+        return self.word_prefix[end_cue] - self.word_prefix[first_cue]
+
+    def sentence_bounds(self, cue: int) -> (int, int):
+        """
+        The cues [first, end) of the sentence around a cue.
+        """
+        i = bisect_right(self.sentence_starts, cue) - 1
+        end = self.sentence_starts[i + 1] if i + 1 < len(self.sentence_starts) else len(self.texts)
+        return self.sentence_starts[i], end
+
+    def window_around(self, cue: int, min_length: float, max_length: float) -> (int, int):
+        """
+        Grows the sentence around a cue by whole sentences, after it first then before it, until the
+        window lasts at least 'min_length' seconds without exceeding 'max_length' (unless the sentence
+        alone does).
+
+        :return: The cues [first, end) of the window
+        """
+        first, end = self.sentence_bounds(cue)
+
+        while self.ends[end - 1] - self.starts[first] < min_length:
+            if end < len(self.texts):
+                _, next_end = self.sentence_bounds(end)
+                if self.ends[next_end - 1] - self.starts[first] <= max_length:
+                    end = next_end
+                    continue
+            if first > 0:
+                previous_first, _ = self.sentence_bounds(first - 1)
+                if self.ends[end - 1] - self.starts[previous_first] <= max_length:
+                    first = previous_first
+                    continue
+            break
+
+        return first, end
+
+    def search(self, query: str, min_length: float = 15.0, max_length: float = 60.0,
+               phrase: bool = True) -> list[dict]:
+        """
+        Finds the candidate clip windows for a query, snapped to sentence and subtitle boundaries.
+
+        Overlapping windows are merged. A window's score is its number of hits times its speech density
+        (words per second), so dense, on-topic passages come first.
+
+        :param query: A phrase, or keywords if 'phrase' is False
+        :param min_length: Shortest window, in seconds
+        :param max_length: Longest window, in seconds
+        :param phrase: Match the query as a phrase, or any of its terms
+        :return: list of dicts like {"start", "end", "hits", "density", "score", "text"}, best first
+        """
+        hits = self.find_phrase(query) if phrase else self.find_keywords(query)
+
+        windows = []
+        for cue in hits:
+            first, end = self.window_around(cue, min_length, max_length)
+            if windows and first < windows[-1][1]:
+                windows[-1][0] = min(windows[-1][0], first)
+                windows[-1][1] = max(windows[-1][1], end)
+                windows[-1][2] += 1
+            else:
+                windows.append([first, end, 1])
+
+        results = []
+        for first, end, count in windows:
+            start, stop = self.starts[first], self.ends[end - 1]
+            density = self.words_between(first, end) / max(stop - start, 1e-3)
+            results.append({
+                "start": start,
+                "end": stop,
+                "hits": count,
+                "density": density,
+                "score": count * density,
+                "text": " ".join(self.texts[first:end])
+            })
+
+        return sorted(results, key=lambda window: window["score"], reverse=True)
+
+
+def _contains(sorted_positions: array, position: int) -> bool:
+    i = bisect_left(sorted_positions, position)
+    return i < len(sorted_positions) and sorted_positions[i] == position
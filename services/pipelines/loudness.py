@@ -0,0 +1,102 @@
+import json
+import logging
+import re
+import shlex
+import subprocess
+
+from services.pipelines.cache import DiskCache, file_content_hash, make_key
+
+# A few hundred bytes per asset
+LOUDNESS_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Bump when the measurement changes, so stale statistics are not reused
+LOUDNESS_VERSION = 1
+
+# EBU R128 streaming targets
+DEFAULT_TARGET_LOUDNESS = -16.0
+DEFAULT_TARGET_TRUE_PEAK = -1.5
+
+_loudness_cache: DiskCache = None
+
+
+def get_loudness_cache() -> DiskCache:
+    global _loudness_cache
+    if _loudness_cache is None:
+        _loudness_cache = DiskCache('loudness', LOUDNESS_CACHE_MAX_BYTES)
+    return _loudness_cache
+
+
+def parse_loudnorm_output(stderr: str) -> dict:
+    """
+    Extracts the measurements loudnorm prints (print_format=json) at the end of ffmpeg's stderr.
+
+    :return: {"input_i", "input_tp", "input_lra", "input_thresh"} as floats
+    """
+    match = re.search(r'\{[^{}]*"input_i"[^{}]*\}', stderr)
+    if match is None:
+        raise ValueError("No loudnorm measurement found in the ffmpeg output")
+
+    stats = json.loads(match.group(0))
+    return {name: float(stats[name]) for name in ("input_i", "input_tp", "input_lra", "input_thresh")}
+
+
+def measure_loudness(media_path: str) -> dict:
+    """
+    Measures the integrated loudness, true peak and loudness range of a media file's audio (the first
+    pass of EBU R128 normalization).
+
+    The measurement is cached by content hash, so an asset is analyzed once however many renders use it.
+
+    :param media_path: Path to the media file
+    :return: See parse_loudnorm_output
+    """
+    cache = get_loudness_cache()
+    key = make_key(file_content_hash(media_path), LOUDNESS_VERSION)
+
+    cached = cache.get_json(key)
+    if cached is not None:
+        return cached
+
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostats",
+        "-i", media_path,
+        "-vn",
+        "-af", "loudnorm=print_format=json",
+        "-f", "null",
+        "-"
+    ]
+
+    print("Running ffmpeg:\n", " ".join(shlex.quote(arg) for arg in cmd))
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg command failed with error: {e.stderr}")
+
+    stats = parse_loudnorm_output(result.stderr)
+    cache.put_json(key, stats)
+
+    logging.info(f"✅ Measured the loudness of {media_path}: {stats['input_i']} LUFS")
+    return stats
+
+
+def normalization_gain(stats: dict, target_loudness: float = DEFAULT_TARGET_LOUDNESS,
+                       target_true_peak: float = DEFAULT_TARGET_TRUE_PEAK) -> float:
+    """
+    The linear gain (in dB) bringing a measured asset to the target loudness, without pushing its
+    true peak above the target peak. Silence (-inf LUFS) is left alone.
+    """
+    if stats["input_i"] == float('-inf') or stats["input_i"] < -70.0:
+        return 0.0
+
+    return min(target_loudness - stats["input_i"], target_true_peak - stats["input_tp"])
+
+
+def loudness_gain(media_path: str, target_loudness: float = DEFAULT_TARGET_LOUDNESS,
+                  target_true_peak: float = DEFAULT_TARGET_TRUE_PEAK) -> float:
+    """
+    The second pass of the normalization as a single volume gain, from the cached measurement.
+    """
+    return normalization_gain(measure_loudness(media_path), target_loudness, target_true_peak)
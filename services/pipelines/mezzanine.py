@@ -0,0 +1,202 @@
+import logging
+import os
+import queue
+import shlex
+import shutil
+import subprocess
+import threading
+
+import services.pipelines.ffmpeg as ffmpeg
+from services.pipelines.cache import DiskCache, file_content_hash, make_key
+
+# 1080x1920 at 8 Mbit is ~60 MB per minute of footage, ~30 minutes fit on a small volume
+MEZZANINE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Background builds run one at a time, niced and with few threads, so renders keep the CPU
+BACKGROUND_THREADS = 1
+BACKGROUND_QUEUE_SIZE = 16
+
+# Bump when the normalization recipe changes, so stale mezzanines are not reused
+MEZZANINE_VERSION = 1
+
+# A keyframe every second, so a trim from the start never has to wait for a distant one
+KEYFRAME_INTERVAL = 1.0
+
+_mezzanine_cache: DiskCache = None
+
+_building: set[tuple] = set()
+_building_lock = threading.Lock()
+
+_queue: queue.Queue = None
+_worker: threading.Thread = None
+
+
+def get_mezzanine_cache() -> DiskCache:
+    global _mezzanine_cache
+    if _mezzanine_cache is None:
+        _mezzanine_cache = DiskCache('mezzanine', MEZZANINE_CACHE_MAX_BYTES)
+    return _mezzanine_cache
+
+
+def mezzanine_key(video_path: str, width: int = 1080, height: int = 1920, fps: int = 30) -> str:
+    return make_key(file_content_hash(video_path), width, height, fps, MEZZANINE_VERSION)
+
+
+def get_mezzanine(video_path: str, width: int = 1080, height: int = 1920, fps: int = 30) -> str or None:
+    """
+    Returns the path of the normalized copy of a video, or None if it was not built (yet).
+    """
+    return get_mezzanine_cache().get_path(mezzanine_key(video_path, width, height, fps), '.mp4')
+
+
+def build_mezzanine(video_path: str, width: int = 1080, height: int = 1920, fps: int = 30,
+                    video_encoder: str = 'libx264', threads: int = None, low_priority: bool = False) -> str:
+    """
+    Normalizes a whole video once, the same way format_youtube_short_video does (center crop to 9:16,
+    scale, fps, 8 Mbit), and stores it by content hash. Uses of the video then only need a stream-copy
+    trim, see format_clip.
+
+    :param video_path: Path to the source video
+    :param video_encoder: The encoder to use
+    :param threads: Limit ffmpeg's threads
+    :param low_priority: Run ffmpeg at the lowest CPU priority, through nice where it is available
+    :return: Path to the cached mezzanine
+    """
+    cache = get_mezzanine_cache()
+    key = mezzanine_key(video_path, width, height, fps)
+
+    cached_path = cache.get_path(key, '.mp4')
+    if cached_path is not None:
+        return cached_path
+
+    tmp_path = cache.temp_path('.mp4')
+    try:
+        cmd = [
+            "ffmpeg", '-y',
+            '-hide_banner',
+            "-loglevel", "warning",
+            '-i', video_path,
+            '-vf', f'crop=({width}/{height}*ih):ih,scale={width}:{height}',
+            '-b:v', '8M',
+            '-r', str(fps),
+            '-c:v', video_encoder,
+            '-force_key_frames', f'expr:gte(t,n_forced*{KEYFRAME_INTERVAL})',
+            '-an',
+            tmp_path
+        ]
+        if threads is not None:
+            cmd[-1:-1] = ['-threads', str(threads)]
+        # a preexec_fn calling os.nice is not safe in a threaded process, the nice command is
+        if low_priority and shutil.which('nice') is not None:
+            cmd = ['nice', '-n', '19', *cmd]
+
+        print("Running ffmpeg:\n", " ".join(shlex.quote(arg) for arg in cmd))
+
+        subprocess.run(cmd, check=True)
+
+        path = cache.put_file(key, '.mp4', tmp_path, move=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg command failed with error: {e.stderr}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    logging.info(f"✅ Built the mezzanine of {os.path.basename(video_path)}")
+    return path
+
+
+def build_mezzanine_in_background(video_path: str, width: int = 1080, height: int = 1920, fps: int = 30):
+    """
+    Queues build_mezzanine for the single background worker, unless the same mezzanine is already queued.
+    The worker builds one mezzanine at a time, niced and with BACKGROUND_THREADS threads, so it only uses
+    the CPU renders leave idle. When the queue is full the video is skipped, its renders stay correct.
+
+    Meant to be called when footage is added: at upload time, or by a pipeline streaming the choice of its
+    shared library footage (see ShortVideoPipeline.generate_script_with_footages), which has no upload step.
+    A render may queue builds, it never waits for one: it formats the clip directly until the mezzanine exists.
+    """
+    global _queue, _worker
+
+    # by path, hashing a large upload is left to the worker
+    job = (os.path.abspath(video_path), width, height, fps)
+
+    with _building_lock:
+        if job in _building:
+            return
+
+        if _worker is None:
+            _queue = queue.Queue(maxsize=BACKGROUND_QUEUE_SIZE)
+            _worker = threading.Thread(target=_build_queued, daemon=True)
+            _worker.start()
+
+        try:
+            _queue.put_nowait(job)
+        except queue.Full:
+            logging.warning(f"mezzanine queue is full, skipping {video_path}")
+            return
+        _building.add(job)
+
+
+def _build_queued():
+    while True:
+        job = _queue.get()
+        video_path, width, height, fps = job
+        try:
+            build_mezzanine(video_path, width, height, fps, threads=BACKGROUND_THREADS, low_priority=True)
+        except Exception as e:
+            logging.error(f"failed to build the mezzanine of {video_path}: {e}")
+        finally:
+            with _building_lock:
+                _building.discard(job)
+
+
+def trim(video_path: str, clip_length: float, output_path: str):
+    """
+    Cuts the first 'clip_length' seconds of a video without re-encoding.
+    """
+    try:
+        cmd = [
+            "ffmpeg", '-y',
+            '-hide_banner',
+            "-loglevel", "warning",
+            '-i', video_path,
+            "-t", str(clip_length),
+            '-c', 'copy',
+            '-an',
+            output_path
+        ]
+
+        print("Running ffmpeg:\n", " ".join(shlex.quote(arg) for arg in cmd))
+
+        subprocess.run(cmd, check=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg command failed with error: {e.stderr}")
+
+
+def format_clip(video_path: str, clip_length: float, video_encoder: str, output_path: str, threads: int = None):
+    """
+    Same result as ffmpeg.format_youtube_short_video, but from the mezzanine when there is one.
+
+    Without a mezzanine the clip is formatted directly. No mezzanine is built from here: builds are
+    queued when footage is added (see build_mezzanine_in_background) and run niced on one thread, so
+    renders only give them their idle CPU.
+    """
+    mezzanine_path = get_mezzanine(video_path)
+    if mezzanine_path is not None:
+        video_duration = ffmpeg.get_media_duration(mezzanine_path)
+        if video_duration < clip_length:
+            raise ValueError(
+                f"Requested clip_length ({clip_length}s) is greater than video duration ({video_duration:.2f}s) "
+                f"for '{video_path}'."
+            )
+
+        trim(mezzanine_path, clip_length, output_path)
+        return
+
+    ffmpeg.format_youtube_short_video(
+        video_path=video_path,
+        clip_length=clip_length,
+        video_encoder=video_encoder,
+        output_path=output_path,
+        threads=threads
+    )
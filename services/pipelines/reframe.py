@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import shlex
+import subprocess
+
+import numpy as np
+
+from services.pipelines.cache import DiskCache, file_content_hash, make_key
+
+# A few KB per source
+REFRAME_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Bump when the analysis changes, so stale crop paths are not reused
+REFRAME_VERSION = 2
+
+# The analysis decodes tiny grayscale frames at a low rate, a small fraction of a full-resolution pass
+ANALYSIS_WIDTH = 128
+ANALYSIS_HEIGHT = 72
+ANALYSIS_FPS = 2.0
+
+# How much the edges count against the motion in the saliency
+EDGE_WEIGHT = 0.25
+
+# The crop moves like the average of the subject's position over this window, so it never jitters
+SMOOTHING_SECONDS = 2.0
+
+# Frames analyzed per numpy batch, bounds the memory however long the video
+BATCH_FRAMES = 256
+
+_reframe_cache: DiskCache = None
+
+
+def get_reframe_cache() -> DiskCache:
+    global _reframe_cache
+    if _reframe_cache is None:
+        _reframe_cache = DiskCache('reframe', REFRAME_CACHE_MAX_BYTES)
+    return _reframe_cache
+
+
+def saliency_centers(frames: np.ndarray, previous: np.ndarray = None) -> np.ndarray:
+    """
+    The horizontal center of interest of every frame, as a fraction of the width.
+
+    The saliency of a pixel is its motion (difference with the previous frame) plus its edges, a frame
+    without any falls back to the center.
+
+    :param frames: (n, height, width) grayscale frames
+    :param previous: The frame before the first one, if any
+    :return: (n,) centers in [0, 1]
+    """
+    frames = frames.astype(np.float32)
+    before = np.concatenate([(frames[:1] if previous is None else previous[None].astype(np.float32)), frames[:-1]])
+
+    motion = np.abs(frames - before)
+    edges = np.zeros_like(frames)
+    edges[:, :, 1:] = np.abs(np.diff(frames, axis=2))
+
+    profile = (motion + EDGE_WEIGHT * edges).sum(axis=1)
+    total = profile.sum(axis=1)
+    xs = (np.arange(frames.shape[2]) + 0.5) / frames.shape[2]
+
+    centers = np.full(len(frames), 0.5, dtype=np.float64)
+    salient = total > 1e-6 * frames.shape[1] * frames.shape[2]
+    centers[salient] = (profile[salient] @ xs) / total[salient]
+    return centers
+
+
+def smooth_path(centers: np.ndarray, crop_fraction: float, fps: float = ANALYSIS_FPS,
+                smoothing_seconds: float = SMOOTHING_SECONDS) -> np.ndarray:
+    """
+    Turns the centers of interest into crop positions: smoothed with a moving average, and kept inside
+    the frame.
+
+    :param crop_fraction: The width of the crop as a fraction of the source width (e.g. 9/16 / 16/9)
+    :return: The crop's left edge as a fraction of the room it has to move ((x) / (iw - ow)), in [0, 1]
+    """
+    if len(centers) == 0:
+        return np.array([])
+    if crop_fraction >= 1.0:
+        return np.full(len(centers), 0.5)
+
+    window = max(1, int(round(smoothing_seconds * fps)))
+    padded = np.pad(centers, (window // 2, window - 1 - window // 2), mode='edge')
+    smoothed = np.convolve(padded, np.ones(window) / window, mode='valid')
+
+    return np.clip((smoothed - crop_fraction / 2) / (1 - crop_fraction), 0.0, 1.0)
+
+
+def probe_video_size(video_path: str) -> (int, int):
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=width,height',
+        '-of', 'json',
+        video_path
+    ]
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffprobe command failed with error: {e.stderr}")
+
+    stream = json.loads(result.stdout)["streams"][0]
+    return int(stream["width"]), int(stream["height"])
+
+
+def analyze_centers(video_path: str, start: float = None, duration: float = None) -> np.ndarray:
+    """
+    Samples the video at ANALYSIS_FPS as ANALYSIS_WIDTH x ANALYSIS_HEIGHT grayscale frames and
+    returns their centers of interest (see saliency_centers), batch by batch.
+
+    :param start: Only analyze from here (a fast seek), in seconds
+    :param duration: Only analyze this long, in seconds
+    """
+    inputs = []
+    if start is not None:
+        inputs += ['-ss', str(start)]
+    if duration is not None:
+        inputs += ['-t', str(duration)]
+
+    cmd = [
+        "ffmpeg",
+        '-hide_banner',
+        "-loglevel", "error",
+        *inputs,
+        '-i', video_path,
+        '-an', '-sn', '-dn',
+        '-vf', f'fps={ANALYSIS_FPS},scale={ANALYSIS_WIDTH}:{ANALYSIS_HEIGHT},format=gray',
+        '-f', 'rawvideo',
+        '-'
+    ]
+
+    print("Running ffmpeg:\n", " ".join(shlex.quote(arg) for arg in cmd))
+
+    frame_size = ANALYSIS_WIDTH * ANALYSIS_HEIGHT
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    centers = []
+    previous = None
+    while True:
+        data = process.stdout.read(frame_size * BATCH_FRAMES)
+        n = len(data) // frame_size
+        if n == 0:
+            break
+
+        frames = np.frombuffer(data[:n * frame_size], dtype=np.uint8).reshape(n, ANALYSIS_HEIGHT, ANALYSIS_WIDTH)
+        centers.append(saliency_centers(frames, previous))
+        previous = frames[-1]
+
+    stderr = process.stderr.read().decode(errors='replace')
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg command failed with error: {stderr}")
+
+    return np.concatenate(centers) if centers else np.array([])
+
+
+def get_crop_path(video_path: str, aspect: float = 9 / 16, start: float = 0.0, duration: float = None) -> dict:
+    """
+    Returns the crop path of a video for crops of the given aspect (width / height) at full height,
+    analyzing it on the first call. The path is cached by content hash.
+
+    Only [start, start + duration] is decoded, so reframing a few clips of a long video costs the
+    clips, not the video.
+
+    :param duration: Defaults to the rest of the video
+    :return: {"start": time of the first sample, "fps": samples per second, "positions": crop positions,
+             see smooth_path}
+    """
+    cache = get_reframe_cache()
+    key = make_key(file_content_hash(video_path), round(aspect, 4), round(start, 3),
+                   None if duration is None else round(duration, 3), ANALYSIS_WIDTH, ANALYSIS_HEIGHT,
+                   ANALYSIS_FPS, SMOOTHING_SECONDS, REFRAME_VERSION)
+
+    cached = cache.get_json(key)
+    if cached is not None:
+        return cached
+
+    width, height = probe_video_size(video_path)
+    centers = analyze_centers(video_path, start=start or None, duration=duration)
+    positions = smooth_path(centers, crop_fraction=height * aspect / width)
+
+    path = {"start": start, "fps": ANALYSIS_FPS, "positions": [round(float(p), 4) for p in positions]}
+    cache.put_json(key, path)
+
+    logging.info(f"✅ Analyzed the framing of {os.path.basename(video_path)}: {len(positions)} samples")
+    return path
+
+
+def build_sendcmd(crop_path: dict, start: float = 0.0, end: float = None) -> str:
+    """
+    The sendcmd commands moving a crop filter along the path between 'start' and 'end' (in seconds of
+    the source), with times relative to 'start'.
+
+    Every command sets the crop's x to a linear ramp to the next sample, evaluated per frame by crop,
+    so the crop glides instead of jumping twice a second.
+    """
+    fps, positions = crop_path["fps"], crop_path["positions"]
+    path_start = crop_path.get("start", 0.0)
+    if not positions:
+        return ""
+
+    first = _sample_at(crop_path, start)
+    last = len(positions) - 1 if end is None else min(len(positions) - 1, int(np.ceil((end - path_start) * fps)))
+
+    commands = []
+    for i in range(first, max(first, last) + 1):
+        t = max(0.0, path_start + i / fps - start)
+        p = positions[i]
+        slope = (positions[i + 1] - p) * fps if i + 1 < len(positions) else 0.0
+        commands.append(f"{t:.3f} crop x (iw-ow)*({p:.4f}+{slope:.4f}*(t-{t:.3f}));")
+
+    return "\n".join(commands) + "\n"
+
+
+def _sample_at(crop_path: dict, t: float) -> int:
+    index = int((t - crop_path.get("start", 0.0)) * crop_path["fps"])
+    return max(0, min(len(crop_path["positions"]) - 1, index))
+
+
+def escape_filter_path(path: str) -> str:
+    """
+    Escapes a path for a filter option inside a filtergraph: quoted for the option parser, then
+    backslash-escaped for the graph parser.
+    """
+    value = "'" + path.replace("'", "'\\''") + "'"
+    for char in '\\\'[],;':
+        value = value.replace(char, '\\' + char)
+    return value
+
+
+def build_crop_filter(commands_path: str, aspect: float = 9 / 16, first_position: float = 0.5) -> str:
+    """
+    The filters cropping along a path, given the file holding its build_sendcmd commands.
+    """
+    return (
+        f"sendcmd=f={escape_filter_path(commands_path)},"
+        f"crop=w=ih*{aspect:.6f}:h=ih:x=(iw-ow)*{first_position:.4f}"
+    )
+
+
+def write_crop_filter(crop_path: dict, commands_path: str, start: float = 0.0, end: float = None,
+                      aspect: float = 9 / 16) -> str:
+    """
+    Writes the commands of a part of the path and returns the filters applying them.
+    """
+    with open(commands_path, 'w') as f:
+        f.write(build_sendcmd(crop_path, start, end))
+
+    positions = crop_path["positions"]
+    first_position = positions[_sample_at(crop_path, start)] if positions else 0.5
+    return build_crop_filter(commands_path, aspect, first_position)
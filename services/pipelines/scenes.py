@@ -0,0 +1,92 @@
+import re
+import shlex
+import subprocess
+
+# A frame whose scene score ('scene' of ffmpeg's select filter) exceeds this starts a new scene
+DEFAULT_SCENE_THRESHOLD = 0.3
+
+# Scene scores are computed on frames this wide, which is plenty to tell shots apart
+SCENE_ANALYSIS_WIDTH = 160
+
+
+def parse_scene_scores(metadata_output: str) -> (list[float], list[float]):
+    """
+    Extracts (times, scores) from the output of ffmpeg's 'metadata=print' filter after a scene select.
+    """
+    times, scores = [], []
+    time = None
+    for line in metadata_output.splitlines():
+        match = re.search(r'pts_time:(\S+)', line)
+        if match:
+            time = float(match.group(1))
+            continue
+
+        match = re.search(r'lavfi\.scene_score=(\S+)', line)
+        if match and time is not None:
+            times.append(time)
+            scores.append(float(match.group(1)))
+            time = None
+
+    return times, scores
+
+
+def detect_scenes(video_path: str, threshold: float = DEFAULT_SCENE_THRESHOLD, start: float = None,
+                  duration: float = None) -> (list[float], list[float]):
+    """
+    Finds the scene cuts of a video, scoring a downscaled decode without audio.
+
+    :param start: Only look from here (a fast seek), in seconds
+    :param duration: Only look this long, in seconds
+    :return: (times, scores) of the frames scoring above 'threshold', times in seconds of the whole video
+    """
+    inputs = []
+    if start is not None:
+        inputs += ['-ss', str(start)]
+    if duration is not None:
+        inputs += ['-t', str(duration)]
+
+    cmd = [
+        "ffmpeg",
+        '-hide_banner',
+        '-nostats',
+        "-loglevel", "error",
+        *inputs,
+        '-i', video_path,
+        '-an', '-sn', '-dn',
+        '-vf', f"scale={SCENE_ANALYSIS_WIDTH}:-2,select='gt(scene,{threshold})',metadata=print:file=-",
+        '-f', 'null',
+        '-'
+    ]
+
+    print("Running ffmpeg:\n", " ".join(shlex.quote(arg) for arg in cmd))
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg command failed with error: {e.stderr}")
+
+    times, scores = parse_scene_scores(result.stdout)
+    # a fast seek restarts the timestamps at 0
+    return [time + (start or 0.0) for time in times], scores
+
+
+def find_scene_cut(video_path: str, t: float, max_shift: float,
+                   threshold: float = DEFAULT_SCENE_THRESHOLD) -> float | None:
+    """
+    The scene cut nearest to 't' within 'max_shift' seconds, None if there is none.
+
+    Only the 2 * 'max_shift' seconds around 't' are decoded, so snapping a few clip boundaries of a
+    long video costs a few seconds of decoding, not a pass over the whole video.
+    """
+    # a little earlier, the first decoded frame has no scene score
+    start = max(0.0, t - max_shift - 0.1)
+    times, _ = detect_scenes(video_path, threshold, start=start, duration=t + max_shift - start)
+    return nearest_cut(times, t, max_shift)
+
+
+def nearest_cut(times: list[float], t: float, max_shift: float) -> float | None:
+    """
+    The time nearest to 't' within 'max_shift' seconds, None if there is none.
+    """
+    cuts = [time for time in times if abs(time - t) <= max_shift]
+    return min(cuts, key=lambda cut: abs(cut - t), default=None)
@@ -0,0 +1,106 @@
+import shlex
+import subprocess
+import threading
+from typing import Callable
+
+import numpy as np
+
+# The format every stage of a streamed render agrees on
+FRAME_WIDTH = 1080
+FRAME_HEIGHT = 1920
+FPS = 30
+
+
+def rawvideo_output_args(fps: int = FPS) -> list[str]:
+    """
+    Output arguments making ffmpeg write raw RGB frames to its stdout.
+    """
+    return ["-an", "-f", "rawvideo", "-pix_fmt", "rgb24", "-r", str(fps), "pipe:1"]
+
+
+def rawvideo_input_args(width: int = FRAME_WIDTH, height: int = FRAME_HEIGHT, fps: int = FPS) -> list[str]:
+    """
+    Input arguments making ffmpeg read raw RGB frames from its stdin.
+    """
+    return ["-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "pipe:0"]
+
+
+def _drain(stream, sink: list):
+    # Keep stderr flowing, a full pipe would block ffmpeg
+    sink.append(stream.read())
+
+
+def stream_frames(producer_cmd: list[str], consumer_cmd: list[str],
+                  transform: Callable[[np.ndarray, float], np.ndarray] = None,
+                  width: int = FRAME_WIDTH, height: int = FRAME_HEIGHT, fps: int = FPS):
+    """
+    Runs two ffmpeg stages concurrently, linked by a pipe of raw frames, so the frames in between never hit disk.
+
+    The producer must write rawvideo to stdout (see rawvideo_output_args), the consumer must read it from stdin
+    (see rawvideo_input_args). Without 'transform' the two processes are connected directly, otherwise every frame
+    passes through transform(frame, t) on the way, e.g. to composite subtitles.
+
+    :param producer_cmd: ffmpeg command writing the frames
+    :param consumer_cmd: ffmpeg command reading the frames and writing the output
+    :param transform: Optional function (frame as an HxWx3 uint8 array, time in seconds) -> frame
+    :return: None
+    """
+    print("Running ffmpeg:\n", " ".join(shlex.quote(arg) for arg in producer_cmd))
+    print("Piped into ffmpeg:\n", " ".join(shlex.quote(arg) for arg in consumer_cmd))
+
+    producer = subprocess.Popen(producer_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if transform is None:
+        consumer = subprocess.Popen(consumer_cmd, stdin=producer.stdout, stderr=subprocess.PIPE)
+        # the consumer holds its own copy, closing ours lets the producer see a broken pipe if the consumer dies
+        producer.stdout.close()
+    else:
+        consumer = subprocess.Popen(consumer_cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    errors = {"producer": [], "consumer": []}
+    drains = [
+        threading.Thread(target=_drain, args=(producer.stderr, errors["producer"]), daemon=True),
+        threading.Thread(target=_drain, args=(consumer.stderr, errors["consumer"]), daemon=True),
+    ]
+    for drain in drains:
+        drain.start()
+
+    try:
+        if transform is not None:
+            frame_size = width * height * 3
+            index = 0
+            try:
+                while True:
+                    data = producer.stdout.read(frame_size)
+                    if len(data) < frame_size:
+                        break
+
+                    frame = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+                    frame = transform(frame, index / fps)
+                    consumer.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+                    index += 1
+            except BrokenPipeError:
+                # the consumer stopped early, its return code tells why
+                pass
+            finally:
+                producer.stdout.close()
+                try:
+                    consumer.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        consumer.wait()
+        if consumer.returncode != 0 and producer.poll() is None:
+            producer.kill()
+        producer.wait()
+    except BaseException:
+        producer.kill()
+        consumer.kill()
+        raise
+    finally:
+        for drain in drains:
+            drain.join()
+
+    if consumer.returncode != 0:
+        raise RuntimeError(f"ffmpeg command failed with error: {b''.join(errors['consumer']).decode(errors='replace')}")
+    if producer.returncode != 0:
+        raise RuntimeError(f"ffmpeg command failed with error: {b''.join(errors['producer']).decode(errors='replace')}")
@@ -195,6 +195,30 @@ def create_line_with_word_highlight(
     return [base_line, *highlight_clips]
 
 
+def create_subtitle_clips(sentences: list, highlight_color: str = '#7710e2', color='white') -> list[TextClip]:
+    """
+    Creates the text clips of the subtitles, positioned and timed for a 1080x1920 video.
+
+    :param sentences:  List of sentences, each a list of word dicts.
+    """
+    text_clips: list[TextClip] = []
+
+    for s in sentences:
+        clip = create_line_with_word_highlight(
+            s,
+            video_w=1080,
+            video_h=1920,
+            font='BebasNeue-Regular',
+            fontsize=100,
+            base_color=color,
+            highlight_bg=highlight_color,
+            line_y_ratio=0.8
+        )
+        text_clips.extend(clip)
+
+    return text_clips
+
+
 def add_subtitles(video_path: str, sentences: list, video_duration: float, output_path: str,
                   highlight_color: str = '#7710e2', color='white'):
     """
@@ -208,25 +232,12 @@ def add_subtitles(video_path: str, sentences: list, video_duration: float, outpu
     :return: None
     """
 
-    text_clips: list[TextClip] = []
-
     video_clip = mp.VideoFileClip(
         filename=video_path,
         audio=True,
     )
 
-    for s in sentences:
-        clip = create_line_with_word_highlight(
-            s,
-            video_w=1080,
-            video_h=1920,
-            font='BebasNeue-Regular',
-            fontsize=100,
-            base_color=color,
-            highlight_bg=highlight_color,
-            line_y_ratio=0.8
-        )
-        text_clips.extend(clip)
+    text_clips = create_subtitle_clips(sentences, highlight_color=highlight_color, color=color)
 
     video = mp.CompositeVideoClip([video_clip] + text_clips).with_duration(video_duration)
     video.write_videofile(
@@ -239,3 +250,28 @@ def add_subtitles(video_path: str, sentences: list, video_duration: float, outpu
         threads=4,
         audio_bitrate='320k',
     )
+
+
+class SubtitleCompositor:
+    """
+    Draws the subtitles onto frames one at a time, for streamed renders (see services.pipelines.streaming).
+
+    Unlike add_subtitles it never decodes or encodes a video: it is called with the frames of another stage
+    and returns them with the subtitles alpha-blended on top.
+    """
+
+    def __init__(self, sentences: list, highlight_color: str = '#7710e2', color='white',
+                 video_w: int = 1080, video_h: int = 1920):
+        self.text_clips = create_subtitle_clips(sentences, highlight_color=highlight_color, color=color)
+        # Without a background the composite gets a mask, the coverage of the text
+        self.overlay = mp.CompositeVideoClip(self.text_clips, size=(video_w, video_h))
+
+    def __call__(self, frame, t: float):
+        # Most frames fall between or after the lines, leave them untouched
+        if not any(clip.start <= t < clip.end for clip in self.text_clips):
+            return frame
+
+        rgb = self.overlay.get_frame(t)
+        alpha = self.overlay.mask.get_frame(t)[..., None]
+
+        return (frame * (1.0 - alpha) + rgb * alpha).astype('uint8')
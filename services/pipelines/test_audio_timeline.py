@@ -0,0 +1,32 @@
+import unittest
+
+from services.pipelines.audio_timeline import AudioTimeline
+
+
+class TestAudioTimeline(unittest.TestCase):
+    def test_build_graph_places_and_ducks_clips(self):
+        timeline = (AudioTimeline(duration=30.0)
+                    .add('speech.mp3', bus='speech', duration=28.0)
+                    .add('music.mp3', bus='music', gain_db=-25, loop=True)
+                    .add('whoosh.wav', start=4.5, bus='sfx', duration=1.0)
+                    .duck('music', under='speech'))
+
+        inputs, filters, label = timeline.build_graph(first_input=1)
+
+        self.assertEqual(label, '[mix]')
+        # the looped music is cut to the rest of the timeline
+        self.assertEqual(inputs[4:10], ['-stream_loop', '-1', '-t', '30.0', '-i', 'music.mp3'])
+        graph = "; ".join(filters)
+        self.assertIn('[1:a]', graph)
+        self.assertIn('volume=-25.00dB', graph)
+        self.assertIn('adelay=delays=4500:all=1', graph)
+        self.assertIn('[bus_music][key_speech_music]sidechaincompress', graph)
+        self.assertIn('atrim=duration=30.0[mix]', graph)
+
+    def test_empty_timeline_raises(self):
+        with self.assertRaises(ValueError):
+            AudioTimeline(duration=1.0).build_graph()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import logging
+import os
+import tempfile
+import unittest
+
+from services.pipelines.cache import DiskCache
+from services.pipelines.dag import DAGExecutor, Step
+
+
+class TestDAGExecutor(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.calls = []
+
+        self.source_path = os.path.join(self.tmp.name, 'source.txt')
+        with open(self.source_path, 'w') as f:
+            f.write('hello')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def executor(self, max_bytes: int = 1024 * 1024) -> DAGExecutor:
+        return DAGExecutor(
+            cache=DiskCache('steps', max_bytes, root=self.tmp.name),
+            logger=logging.getLogger(__name__),
+            tool_version='test'
+        )
+
+    def steps(self, suffix: str) -> list[Step]:
+        def upper(source_path: str, output_path: str):
+            self.calls.append('upper')
+            with open(source_path) as src, open(output_path, 'w') as dst:
+                dst.write(src.read().upper())
+
+        def decorate(text_path: str, suffix: str, output_path: str):
+            self.calls.append('decorate')
+            with open(text_path) as src, open(output_path, 'w') as dst:
+                dst.write(src.read() + suffix)
+
+        return [
+            Step(name='decorate', func=decorate, inputs={"text_path": ('upper', 'output_path')},
+                 params={"suffix": suffix}, outputs={"output_path": ".txt"}),
+            Step(name='upper', func=upper, files={"source_path": self.source_path},
+                 outputs={"output_path": ".txt"}),
+        ]
+
+    def test_runs_in_dependency_order(self):
+        results = self.executor().run(self.steps('!'))
+
+        self.assertEqual(self.calls, ['upper', 'decorate'])
+        with open(results['decorate']['output_path']) as f:
+            self.assertEqual(f.read(), 'HELLO!')
+
+    def test_skips_cached_steps(self):
+        self.executor().run(self.steps('!'))
+        self.calls.clear()
+
+        # Same inputs: nothing runs
+        self.executor().run(self.steps('!'))
+        self.assertEqual(self.calls, [])
+
+        # Only a downstream param changed: only the downstream step runs
+        results = self.executor().run(self.steps('?'))
+        self.assertEqual(self.calls, ['decorate'])
+        with open(results['decorate']['output_path']) as f:
+            self.assertEqual(f.read(), 'HELLO?')
+
+    def test_reruns_when_input_content_changes(self):
+        self.executor().run(self.steps('!'))
+        self.calls.clear()
+
+        with open(self.source_path, 'w') as f:
+            f.write('bye')
+        os.utime(self.source_path, ns=(0, 0))
+
+        results = self.executor().run(self.steps('!'))
+        self.assertEqual(self.calls, ['upper', 'decorate'])
+        with open(results['decorate']['output_path']) as f:
+            self.assertEqual(f.read(), 'BYE!')
+
+    def test_failing_step_raises(self):
+        def fail(output_path: str):
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            self.executor().run([Step(name='fail', func=fail, outputs={"output_path": ".txt"})])
+
+    def test_keep_going_isolates_failures(self):
+        def fail(output_path: str):
+            raise RuntimeError("boom")
+
+        steps = self.steps('!') + [
+            Step(name='fail', func=fail, outputs={"output_path": ".txt"}),
+            Step(name='after_fail', func=lambda text_path, output_path: None,
+                 inputs={"text_path": ('fail', 'output_path')}, outputs={"output_path": ".txt"}),
+        ]
+
+        results, errors = self.executor().run_keep_going(steps)
+
+        self.assertIn('decorate', results)
+        self.assertEqual(list(errors), ['fail'])
+        self.assertNotIn('after_fail', results)
+
+    def test_needed_outputs_survive_eviction_until_completed(self):
+        # every put evicts everything that is not pinned
+        completed = {}
+
+        def read(name, outputs):
+            with open(outputs['output_path']) as f:
+                completed[name] = f.read()
+
+        self.executor(max_bytes=1).run(self.steps('!'), on_complete=read)
+
+        self.assertEqual(completed, {'upper': 'HELLO', 'decorate': 'HELLO!'})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import tempfile
+import unittest
+
+from services.pipelines.cache import DiskCache
+from services.pipelines.llm import LocalChatClient, complete_chat
+
+
+class TestLLM(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = DiskCache('llm', 1024 * 1024, root=self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_streams_and_caches_responses(self):
+        client = LocalChatClient(lambda messages: "Top 5 places to visit in Rome.")
+        messages = [{"role": "user", "content": "Write a script"}]
+
+        deltas = []
+        text = complete_chat(client, 'gpt-4o', messages, 0.7, 800, on_delta=deltas.append, cache=self.cache)
+
+        self.assertEqual(text, "Top 5 places to visit in Rome.")
+        self.assertGreater(len(deltas), 1)
+        self.assertTrue(client.calls[0]["stream"])
+
+        # Same request: answered from the cache
+        self.assertEqual(complete_chat(client, 'gpt-4o', messages, 0.7, 800, cache=self.cache), text)
+        self.assertEqual(len(client.calls), 1)
+
+        # Another temperature is another request
+        complete_chat(client, 'gpt-4o', messages, 0.2, 800, cache=self.cache)
+        self.assertEqual(len(client.calls), 2)
+
+    def test_clients_do_not_share_responses(self):
+        class OtherClient(LocalChatClient):
+            pass
+
+        messages = [{"role": "user", "content": "Write a script"}]
+        complete_chat(LocalChatClient(lambda messages: "canned"), 'gpt-4o', messages, 0.7, 800, cache=self.cache)
+
+        other = OtherClient(lambda messages: "real")
+        self.assertEqual(complete_chat(other, 'gpt-4o', messages, 0.7, 800, cache=self.cache), "real")
+        self.assertEqual(len(other.calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from services.pipelines.loudness import parse_loudnorm_output, normalization_gain
+
+
+class TestLoudness(unittest.TestCase):
+    def test_parse_loudnorm_output(self):
+        stderr = """
+[Parsed_loudnorm_0 @ 0x7f8] 
+{
+	"input_i" : "-27.61",
+	"input_tp" : "-4.47",
+	"input_lra" : "18.06",
+	"input_thresh" : "-39.20",
+	"output_i" : "-16.58",
+	"output_tp" : "-1.50",
+	"output_lra" : "14.78",
+	"output_thresh" : "-27.71",
+	"normalization_type" : "dynamic",
+	"target_offset" : "0.58"
+}
+"""
+        stats = parse_loudnorm_output(stderr)
+
+        self.assertEqual(stats, {"input_i": -27.61, "input_tp": -4.47, "input_lra": 18.06, "input_thresh": -39.2})
+
+    def test_normalization_gain_respects_true_peak(self):
+        # +11.61 dB would reach the loudness target, but the peak only has 2.97 dB of headroom
+        self.assertAlmostEqual(normalization_gain({"input_i": -27.61, "input_tp": -4.47}), 2.97)
+        self.assertAlmostEqual(normalization_gain({"input_i": -10.0, "input_tp": -0.5}), -6.0)
+        self.assertEqual(normalization_gain({"input_i": float('-inf'), "input_tp": float('-inf')}), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
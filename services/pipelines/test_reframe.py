@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+
+from services.pipelines.reframe import build_crop_filter, build_sendcmd, saliency_centers, smooth_path
+
+
+class TestReframe(unittest.TestCase):
+    def test_centers_follow_the_moving_subject(self):
+        frames = np.zeros((4, 72, 128), dtype=np.uint8)
+        for i, x in enumerate([10, 40, 70, 100]):
+            frames[i, 30:40, x:x + 10] = 255
+
+        centers = saliency_centers(frames)
+
+        # the first frame has no motion, only the edges of the square
+        self.assertAlmostEqual(centers[0], 15 / 128, places=1)
+        self.assertTrue(np.all(np.diff(centers) > 0))
+        # a still, empty frame stays centered
+        self.assertEqual(saliency_centers(np.zeros((1, 72, 128), dtype=np.uint8))[0], 0.5)
+
+    def test_path_is_smoothed_and_kept_in_frame(self):
+        centers = np.array([0.0, 0.0, 1.0, 1.0, 1.0, 1.0])
+
+        positions = smooth_path(centers, crop_fraction=0.3, fps=2.0, smoothing_seconds=1.0)
+
+        self.assertEqual(positions[0], 0.0)
+        self.assertEqual(positions[-1], 1.0)
+        self.assertTrue(0.0 < positions[2] < 1.0)
+
+    def test_sendcmd_ramps_between_samples_relative_to_the_clip(self):
+        path = {"fps": 2.0, "positions": [0.0, 0.5, 0.5, 1.0]}
+
+        commands = build_sendcmd(path, start=0.5, end=1.5).splitlines()
+
+        self.assertEqual(commands, [
+            "0.000 crop x (iw-ow)*(0.5000+0.0000*(t-0.000));",
+            "0.500 crop x (iw-ow)*(0.5000+1.0000*(t-0.500));",
+            "1.000 crop x (iw-ow)*(1.0000+0.0000*(t-1.000));",
+        ])
+
+    def test_path_of_a_clip_is_relative_to_its_start(self):
+        path = {"start": 100.0, "fps": 2.0, "positions": [0.2, 0.2, 0.4]}
+
+        commands = build_sendcmd(path, start=100.0, end=101.0).splitlines()
+
+        self.assertEqual(commands[-1], "1.000 crop x (iw-ow)*(0.4000+0.0000*(t-1.000));")
+
+    def test_commands_path_is_escaped(self):
+        crop_filter = build_crop_filter("/tmp/it's, [a]:b;c.cmd")
+
+        self.assertEqual(crop_filter.split(",crop=")[0], r"sendcmd=f=\'/tmp/it\'\\\'\'s\, \[a\]:b\;c.cmd\'")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+import unittest
+
+from services.pipelines.scenes import nearest_cut, parse_scene_scores
+
+
+class TestScenes(unittest.TestCase):
+    def test_parses_ffmpeg_output(self):
+        times, scores = parse_scene_scores(
+            "frame:0    pts:4004    pts_time:4.004\n"
+            "lavfi.scene_score=0.512000\n"
+            "frame:1    pts:9009    pts_time:9.009\n"
+            "lavfi.scene_score=0.931000\n"
+        )
+        self.assertEqual(times, [4.004, 9.009])
+        self.assertEqual(scores, [0.512, 0.931])
+
+    def test_nearest_cut(self):
+        self.assertEqual(nearest_cut([4.1, 12.5, 20.0], 12.0, max_shift=1.0), 12.5)
+        self.assertIsNone(nearest_cut([4.1, 12.5, 20.0], 16.0, max_shift=1.0))
+        self.assertIsNone(nearest_cut([], 16.0, max_shift=1.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
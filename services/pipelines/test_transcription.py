@@ -0,0 +1,92 @@
+import unittest
+
+import numpy as np
+
+from services.pipelines.audio import SAMPLE_RATE
+from services.pipelines.transcription import plan_chunks, merge_chunk_results, restore_timestamps
+
+
+class TestChunkedTranscription(unittest.TestCase):
+    def test_plan_chunks_cuts_at_silences(self):
+        """
+        70 seconds of "speech" with a silence at 20-22s and 45-46s, chunks of at most 30s
+        should be cut in the middle of those silences.
+        """
+        samples = np.full(70 * SAMPLE_RATE, 0.5, dtype=np.float32)
+        samples[20 * SAMPLE_RATE:22 * SAMPLE_RATE] = 0.0
+        samples[45 * SAMPLE_RATE:46 * SAMPLE_RATE] = 0.0
+
+        chunks = plan_chunks(samples, max_chunk_length=30.0, overlap=1.0)
+
+        self.assertEqual([round(c["own_end"], 2) for c in chunks], [21.0, 45.5, 70.0])
+        # owned ranges tile the timeline
+        self.assertEqual(chunks[0]["own_start"], 0.0)
+        for prev, nxt in zip(chunks, chunks[1:]):
+            self.assertEqual(prev["own_end"], nxt["own_start"])
+        # every chunk fits the limit, overlaps included
+        for chunk in chunks:
+            self.assertLessEqual(chunk["end"] - chunk["start"], 30.0)
+
+    def test_plan_chunks_hard_cut_without_silence(self):
+        samples = np.full(50 * SAMPLE_RATE, 0.5, dtype=np.float32)
+
+        chunks = plan_chunks(samples, max_chunk_length=30.0, overlap=1.0)
+
+        self.assertEqual([c["own_end"] for c in chunks], [28.0, 50.0])
+
+    def test_plan_chunks_edge_cases(self):
+        self.assertEqual(plan_chunks(np.zeros(0, dtype=np.float32)), [])
+
+        # the chunks could never advance
+        with self.assertRaises(ValueError):
+            plan_chunks(np.zeros(SAMPLE_RATE, dtype=np.float32), max_chunk_length=2.0, overlap=1.0)
+
+    def test_merge_chunk_results_deduplicates_overlap(self):
+        chunks = [
+            {"start": 0.0, "end": 11.0, "own_start": 0.0, "own_end": 10.0},
+            {"start": 9.0, "end": 20.0, "own_start": 10.0, "own_end": 20.0},
+        ]
+        results = [
+            {"language": "en", "segments": [{"start": 8.0, "end": 10.8, "text": " Hello world", "words": [
+                {"start": 8.0, "end": 8.5, "word": " Hello"},
+                {"start": 10.2, "end": 10.8, "word": " world"},
+            ]}]},
+            {"language": "en", "segments": [{"start": 1.2, "end": 3.0, "text": " world again", "words": [
+                {"start": 1.2, "end": 1.8, "word": " world"},
+                {"start": 2.5, "end": 3.0, "word": " again"},
+            ]}]},
+        ]
+
+        merged = merge_chunk_results(chunks, results)
+
+        words = [w for segment in merged["segments"] for w in segment["words"]]
+        self.assertEqual([w["word"] for w in words], [" Hello", " world", " again"])
+        self.assertAlmostEqual(words[1]["start"], 10.2)
+        self.assertAlmostEqual(words[2]["start"], 11.5)
+        self.assertEqual(merged["text"], " Hello world again")
+
+    def test_restore_timestamps_after_vad(self):
+        """
+        Speech at 2-4s and 10-11s was transcribed as 3 seconds of compact audio.
+        """
+        regions = [{"start": 2.0, "end": 4.0}, {"start": 10.0, "end": 11.0}]
+        result = {"language": "en", "segments": [{"start": 0.0, "end": 3.0, "text": " one two three", "words": [
+            {"start": 0.1, "end": 0.8, "word": " one"},
+            {"start": 1.5, "end": 2.2, "word": " two"},
+            {"start": 2.3, "end": 2.9, "word": " three"},
+        ]}]}
+
+        restored = restore_timestamps(result, regions)
+
+        words = restored["segments"][0]["words"]
+        self.assertAlmostEqual(words[0]["start"], 2.1)
+        self.assertAlmostEqual(words[0]["end"], 2.8)
+        # "two" straddles the cut, it must not swallow the silence between the regions
+        self.assertAlmostEqual(words[1]["start"], 3.5)
+        self.assertAlmostEqual(words[1]["end"], 4.0)
+        self.assertAlmostEqual(words[2]["start"], 10.3)
+        self.assertAlmostEqual(words[2]["end"], 10.9)
+
+
+if __name__ == "__main__":
+    unittest.main()
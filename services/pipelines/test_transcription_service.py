@@ -0,0 +1,42 @@
+import unittest
+
+import numpy as np
+
+from services.pipelines.audio import SAMPLE_RATE
+from services.pipelines.transcription_service import TranscriptionService
+
+
+class FakeTranscriptionService(TranscriptionService):
+    """
+    Decodes every window to one word, or to a malformed result when the window is silent.
+    """
+
+    def _decode_batch(self, windows: list[np.ndarray], language: str or None) -> list[dict]:
+        results = []
+        for window in windows:
+            if not window.any():
+                results.append({"language": language})
+                continue
+            word = {"start": 0.1, "end": 0.4, "word": " hello"}
+            results.append({"language": language, "segments": [{"words": [word]}]})
+        return results
+
+
+class TestTranscriptionService(unittest.TestCase):
+    def test_a_failing_job_does_not_stop_the_worker(self):
+        service = FakeTranscriptionService(batch_size=4, max_wait=0.01)
+
+        silent = np.zeros(SAMPLE_RATE * 2, dtype=np.float32)
+        speech = np.full(SAMPLE_RATE * 2, 0.5, dtype=np.float32)
+
+        # the merge of the malformed result raises inside the worker
+        failing = service.submit(silent, language='en')
+        with self.assertRaises(KeyError):
+            failing.result(timeout=5)
+
+        result = service.submit(speech, language='en').result(timeout=5)
+        self.assertEqual(result["text"], " hello")
+
+
+if __name__ == "__main__":
+    unittest.main()
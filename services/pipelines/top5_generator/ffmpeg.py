@@ -1,7 +1,11 @@
 import subprocess
 import shlex
 
-def overlay_videos(background_footage_path, footages, output_path, video_encoder):
+import services.pipelines.ffmpeg as ffmpeg
+import services.pipelines.streaming as streaming
+
+
+def overlay_videos(background_footage_path, footages, output_path, video_encoder, duration=None):
     """
     Creates a final video where 'background_footage_path' is the base,
     and each item in 'footages' is overlaid in a specified time window.
@@ -9,6 +13,9 @@ def overlay_videos(background_footage_path, footages, output_path, video_encoder
     All the footages and the background video must be correctly formatted
     before calling this function. The final video will be saved at 'output_path'.
 
+    When the footages don't overlap, the video is cut together instead of overlaid,
+    see plan_timeline.
+
     :param background_footage_path: str, path to the background video (the final length).
     :param footages: list of dicts, each like:
                      {
@@ -18,6 +25,50 @@ def overlay_videos(background_footage_path, footages, output_path, video_encoder
                      }
     :param output_path: str, path to save the final video.
     :param video_encoder: e.g. "h264_videotoolbox" (macOS) or "libx264"
+    :param duration: float, optional length of the final video, if the inputs are longer
+    """
+    cmd, current_label = _build_graph(background_footage_path, footages, duration)
+
+    # 4) Finish constructing the ffmpeg command
+    cmd += [
+        # Map the final labeled output to the output file
+        "-map", current_label,
+        # Use the desired encoder
+        "-c:v", video_encoder,
+        # Drop audio (or change to -c:a copy, amix, etc., if needed)
+        "-an",
+    ]
+    if duration is not None:
+        cmd += ["-t", str(duration)]
+    cmd.append(output_path)
+
+    # 5) (Optional) Print the command for debugging
+    print("Running ffmpeg:\n", " ".join(shlex.quote(c) for c in cmd))
+
+    # 6) Execute the ffmpeg process
+    subprocess.run(cmd, check=True)
+
+
+def build_overlay_videos_stream_cmd(background_footage_path, footages, duration=None) -> list[str]:
+    """
+    Same as overlay_videos, but the command writes raw frames to stdout instead of an encoded file,
+    to feed the next stage of a streamed render (see services.pipelines.streaming).
+    """
+    cmd, current_label = _build_graph(background_footage_path, footages, duration)
+
+    cmd += ["-map", current_label]
+    if duration is not None:
+        cmd += ["-t", str(duration)]
+    cmd += streaming.rawvideo_output_args()
+
+    return cmd
+
+
+def _build_overlay_graph(background_footage_path, footages) -> (list[str], str):
+    """
+    Builds the inputs and the filter_complex of the overlay.
+
+    :return: (the command so far, the label of the overlaid video)
     """
     # 1) Build the base ffmpeg command, adding the background as the first input
     cmd = [
@@ -65,22 +116,92 @@ def overlay_videos(background_footage_path, footages, output_path, video_encoder
 
     # Join all filter steps with semicolons
     filter_complex = "; ".join(filter_parts)
+    cmd += ["-filter_complex", filter_complex]
 
-    # 4) Finish constructing the ffmpeg command
-    cmd += [
-        # Provide the filtergraph
-        "-filter_complex", filter_complex,
-        # Map the final labeled output to the output file
-        "-map", current_label,
-        # Use the desired encoder
-        "-c:v", video_encoder,
-        # Drop audio (or change to -c:a copy, amix, etc., if needed)
-        "-an",
-        output_path
+    return cmd, current_label
+
+
+def plan_timeline(footages, duration) -> list[dict] or None:
+    """
+    Turns overlays into a cut list, when that gives the same picture.
+
+    The footages are formatted full-frame and opaque, so while one is shown the background is hidden.
+    If no two footages overlap in time, the result is simply the background where no footage is shown,
+    and the footages themselves in between.
+
+    :param footages: Same as overlay_videos
+    :param duration: The length of the final video
+    :return: The pieces in order, each {"footage": path or None for the background, "start": float, "end": float},
+             or None if footages overlap and have to be overlaid
+    """
+    pieces = []
+    position = 0.0
+
+    for item in sorted(footages, key=lambda f: f["start"]):
+        start = max(item["start"], 0.0)
+        end = min(item["end"], duration)
+        if end <= start:
+            continue
+        if start < position - 1e-6:
+            return None
+
+        if start > position:
+            pieces.append({"footage": None, "start": position, "end": start})
+        pieces.append({"footage": item["footage"], "start": start, "end": end})
+        position = end
+
+    if position < duration:
+        pieces.append({"footage": None, "start": position, "end": duration})
+
+    return pieces
+
+
+def _build_graph(background_footage_path, footages, duration) -> (list[str], str):
+    if duration is None:
+        duration = ffmpeg.get_media_duration(background_footage_path)
+
+    pieces = plan_timeline(footages, duration)
+    if pieces is None or not pieces:
+        return _build_overlay_graph(background_footage_path, footages)
+
+    return _build_timeline_graph(background_footage_path, pieces)
+
+
+def _build_timeline_graph(background_footage_path, pieces) -> (list[str], str):
+    """
+    Builds the inputs and the filter_complex concatenating the pieces of plan_timeline.
+
+    Every piece is its own input, cut with input options, so the background is only decoded where it is seen.
+    A piece shorter than its slot (e.g. a place clip shorter than its segment) holds its last frame until the
+    slot ends, like the overlay's eof_action=repeat, so the timeline never drifts from the speech.
+
+    :return: (the command so far, the label of the video)
+    """
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-hide_banner",
+        "-loglevel", "warning",
     ]
 
-    # 5) (Optional) Print the command for debugging
-    print("Running ffmpeg:\n", " ".join(shlex.quote(c) for c in cmd))
+    filter_parts = []
+    for i, piece in enumerate(pieces):
+        length = piece["end"] - piece["start"]
+        if piece["footage"] is None:
+            # seek the background to where it shows
+            cmd += ["-ss", str(piece["start"]), "-t", str(length), "-i", background_footage_path]
+        else:
+            # a footage starts from its beginning, like an overlay shifted to 'start'
+            cmd += ["-t", str(length), "-i", piece["footage"]]
 
-    # 6) Execute the ffmpeg process
-    subprocess.run(cmd, check=True)
\ No newline at end of file
+        filter_parts.append(
+            f"[{i}:v]setpts=PTS-STARTPTS,setsar=1,"
+            f"tpad=stop_mode=clone:stop_duration={length},trim=duration={length}[p{i}]"
+        )
+
+    inputs = "".join(f"[p{i}]" for i in range(len(pieces)))
+    filter_parts.append(f"{inputs}concat=n={len(pieces)}:v=1[outv]")
+
+    cmd += ["-filter_complex", "; ".join(filter_parts)]
+
+    return cmd, "[outv]"
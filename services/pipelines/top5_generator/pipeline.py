@@ -1,19 +1,74 @@
-import base64
-import hashlib
-import json
+import functools
 import logging
 import math
 import os
+import shutil
+import string
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-from elevenlabs import ElevenLabs, VoiceSettings
+from elevenlabs import ElevenLabs
 
 import services.pipelines.subtitles as subs
 import services.pipelines.top5_generator.script_parser as parser
 import services.pipelines.top5_generator.ffmpeg as top5_ffmpeg
 import services.pipelines.ffmpeg as ffmpeg
 import services.pipelines.pause_detector as pause
+import services.pipelines.dag as dag
+import services.pipelines.loudness as loudness
+import services.pipelines.mezzanine as mezzanine
+import services.pipelines.streaming as streaming
+import services.pipelines.tts as tts
+from services.pipelines.audio_timeline import AudioTimeline
+from services.pipelines.cache import DiskCache
+
+# Intermediate renders of one project, the least recently used ones are evicted first
+STEP_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+
+def estimate_speech_length(script: str, words_per_second: float = 2.0, granularity: float = 15.0) -> float:
+    """
+    A generous upper estimate of how long the speech of a script will be, before it is synthesized.
+
+    ElevenLabs voices speak ~2.5 words per second, so 2.0 leaves headroom. The estimate is rounded up
+    to 'granularity' seconds, so small script edits keep the same estimate (and the cached steps using it).
+    """
+    estimate = len(script.split()) / words_per_second
+    return max(granularity, math.ceil(estimate / granularity) * granularity)
+
+
+def estimate_place_lengths(script: str, words_per_second: float = 2.0, granularity: float = 5.0) -> list[float]:
+    """
+    Same as estimate_speech_length, for the segment of every place: the words from its PLACE marker to the
+    next one (or the end of the script), see script_parser.get_footage_segments.
+
+    :return: One length per PLACE marker, in order
+    """
+    words = script.split()
+    markers = [i for i, word in enumerate(words) if word.strip(string.punctuation) == 'PLACE']
+
+    lengths = []
+    for marker, next_marker in zip(markers, markers[1:] + [len(words)]):
+        estimate = (next_marker - marker) / words_per_second
+        lengths.append(max(granularity, math.ceil(estimate / granularity) * granularity))
+    return lengths
+
+
+def refined_footage_length(footage_duration: float, source_duration: float, segment_length: float,
+                           tolerance: float = 0.05) -> float | None:
+    """
+    How long a place footage must be normalized again once its segment is known, None to keep it.
+
+    A source shorter than its segment cannot give more than itself: its footage (already clamped to the
+    source) is kept, and the timeline holds its last frame.
+
+    :param tolerance: A re-encode can measure a frame shorter than its source
+    """
+    length = min(segment_length, source_duration)
+    if footage_duration >= length - tolerance:
+        return None
+    return length
 
 
 class TOP5PipelineConfig:
@@ -43,6 +98,21 @@ class TOP5PipelineConfig:
             raise ValueError("Background music must be an MP3 or MP4 file")
 
 
+class TOP5Variant:
+    """
+    One video of a batch, see TOP5Pipeline.run_batch. The background, music and effect come from the
+    pipeline's TOP5PipelineConfig, the variant brings its own script and place videos.
+    """
+    script: str = None
+    places_videos: list[str] = []
+    output_name: str = None
+
+    def __init__(self, script: str, places_videos: list[str], output_name: str):
+        self.script = script
+        self.places_videos = places_videos
+        self.output_name = output_name
+
+
 class TOP5Pipeline:
     elevenlabs_client: ElevenLabs = None
 
@@ -50,13 +120,24 @@ class TOP5Pipeline:
 
     config: TOP5PipelineConfig = None
 
+    voice: tts.VoiceConfig = None
+    # Synthesize sentence by sentence, so an edited script only re-synthesizes the changed sentences
+    incremental_tts: bool = False
+    # Render the edit, speech, subtitles, music and effect stages as one pipe-connected stream,
+    # so the only video written to disk is the final one
+    streaming: bool = False
+
     working_dir: str = None
 
-    def __init__(self, logger: logging.Logger, config: TOP5PipelineConfig, elevenlaps_api_key: str, working_dir: str):
+    def __init__(self, logger: logging.Logger, config: TOP5PipelineConfig, elevenlaps_api_key: str, working_dir: str,
+                 voice: tts.VoiceConfig = None, incremental_tts: bool = False, streaming: bool = False):
         self.elevenlabs_client = ElevenLabs(api_key=elevenlaps_api_key)
         self.working_dir = working_dir
         self.logger = logger
         self.config = config
+        self.voice = voice if voice is not None else tts.VoiceConfig()
+        self.incremental_tts = incremental_tts
+        self.streaming = streaming
 
     def assert_working_dir(self):
         if not os.path.exists(self.working_dir):
@@ -85,233 +166,672 @@ class TOP5Pipeline:
             script: str,
             subtitle_color: str = 'white',
             subtitle_highlight_color: str = '#7710e2',
-            background_music_volume_adjustment: int = -25
-            ):
+            background_music_volume_adjustment: int = -25,
+            output_name: str = 'video_with_effects.mp4',
+            sound_effects: list[dict] = None
+            ) -> str:
+        """
+        Renders the video as a DAG of cached steps, see services/pipelines/dag.py.
+
+        Every step's output is stored under a hash of its inputs and parameters, so changing e.g. only
+        the subtitle color re-renders the subtitles and what comes after them, and an interrupted run
+        resumes from the last completed step.
+
+        :param sound_effects: Optional list of {"file": name in input/sound_effects, "start": float, "gain_db": float}
+        :return: Path to the rendered video, 'output/{output_name}'
+        """
 
         start = time.time()
 
         self.assert_working_dir()
 
-        background_video_path = os.path.join(self.working_dir, 'input', 'videos', self.config.background_video)
-        background_music_name = os.path.join(self.working_dir, 'input', 'music', self.config.background_music)
-        effect_path = os.path.join(self.working_dir, 'input', 'video_effects', self.config.video_effect)
+        steps = self.build_steps(
+            script=script,
+            subtitle_color=subtitle_color,
+            subtitle_highlight_color=subtitle_highlight_color,
+            background_music_volume_adjustment=background_music_volume_adjustment,
+            sound_effects=sound_effects
+        )
+
+        executor = dag.DAGExecutor(
+            cache=DiskCache('steps', STEP_CACHE_MAX_BYTES, root=os.path.join(self.working_dir, 'output', '.cache')),
+            logger=self.logger
+        )
+        # the last step renders the final video
+        target = steps[-1].name
+        output_path = os.path.join(self.working_dir, 'output', output_name)
+
+        def copy_output(name: str, outputs: dict[str, str]):
+            if name == target:
+                shutil.copyfile(outputs['output_path'], output_path)
+
+        executor.run(steps, targets=[target], on_complete=copy_output)
+
+        end = time.time()
+
+        self.logger.info(f"⌛ Generated a video in {end - start} seconds")
+
+        return output_path
+
+    def run_batch(self,
+                  variants: list[TOP5Variant],
+                  subtitle_color: str = 'white',
+                  subtitle_highlight_color: str = '#7710e2',
+                  background_music_volume_adjustment: int = -25,
+                  max_workers: int = None
+                  ) -> list[dict]:
+        """
+        Renders several videos sharing the config's background, music and effect in one DAG.
+
+        The background is normalized once for the longest script and each place video once, however many
+        variants use it. The per-variant steps of all the variants run concurrently on the executor's pool,
+        and a failing variant does not stop the others.
+
+        :param variants: The videos to render, their output names must be unique
+        :param max_workers: The size of the executor's pool, defaults to the number of cores
+        :return: One status per variant, in order: {"output_name": str, "status": "done" or "failed",
+                 "output_path": str or None, "error": str or None}
+        """
+        start = time.time()
+
+        self.assert_working_dir()
+
+        output_names = [variant.output_name for variant in variants]
+        if len(set(output_names)) != len(output_names):
+            raise ValueError("The output names of the variants must be unique")
+
+        statuses = [
+            {"output_name": variant.output_name, "status": "failed", "output_path": None, "error": None}
+            for variant in variants
+        ]
+
+        # Variants with missing inputs fail upfront, the rest still run
+        runnable: list[tuple[int, TOP5Variant, list[str]]] = []
+        for index, variant in enumerate(variants):
+            video_names = [os.path.join(self.working_dir, 'input', 'videos', video) for video in variant.places_videos]
+            missing = [video for video in video_names if not os.path.exists(video)]
+            if missing:
+                statuses[index]["error"] = f"Places video not found: {missing[0]}"
+                continue
+            runnable.append((index, variant, video_names))
+
+        if not runnable:
+            return statuses
+
+        h264_encoder = self.get_video_encoder()
+
+        # One normalization per distinct place video, long enough for the longest segment showing it
+        place_steps: dict[str, str] = {}
+        place_lengths: dict[str, float] = {}
+        for _, variant, video_names in runnable:
+            for video, place_length in zip(video_names, self.get_place_lengths(variant.script, video_names)):
+                if video not in place_steps:
+                    place_steps[video] = f'place_{len(place_steps)}'
+                place_lengths[video] = max(place_lengths.get(video, 0.0), place_length)
+        length = max(estimate_speech_length(variant.script) for _, variant, _ in runnable)
+
+        steps = self.build_footage_steps(place_steps, length, place_lengths, h264_encoder)
+        targets = {}
+        for index, variant, video_names in runnable:
+            # named after the output, so the cached steps of a variant survive reordering the batch
+            variant_steps = self.build_variant_steps(
+                script=variant.script,
+                video_names=video_names,
+                place_steps=place_steps,
+                subtitle_color=subtitle_color,
+                subtitle_highlight_color=subtitle_highlight_color,
+                background_music_volume_adjustment=background_music_volume_adjustment,
+                video_encoder=h264_encoder,
+                prefix=f'{variant.output_name}/'
+            )
+            steps += variant_steps
+            targets[index] = variant_steps[-1].name
+
+        executor = dag.DAGExecutor(
+            cache=DiskCache('steps', STEP_CACHE_MAX_BYTES, root=os.path.join(self.working_dir, 'output', '.cache')),
+            logger=self.logger,
+            max_workers=max_workers
+        )
+        # Copied out as soon as a variant is done, while the executor still pins it in the cache
+        variant_of_target = {targets[index]: (index, variant) for index, variant, _ in runnable}
+
+        def copy_output(name: str, outputs: dict[str, str]):
+            if name not in variant_of_target:
+                return
+            index, variant = variant_of_target[name]
+            output_path = os.path.join(self.working_dir, 'output', variant.output_name)
+            shutil.copyfile(outputs['output_path'], output_path)
+            statuses[index].update(status="done", output_path=output_path)
+
+        _, errors = executor.run_keep_going(steps, targets=list(targets.values()), on_complete=copy_output)
+
+        for index, variant, video_names in runnable:
+            if statuses[index]["status"] == "done":
+                continue
+
+            # the first failed step of the variant's own or shared steps
+            own = {'background', *(place_steps[video] for video in video_names)}
+            for step in steps:
+                if step.name in errors and (step.name in own or step.name.startswith(f'{variant.output_name}/')):
+                    statuses[index]["error"] = f"Step '{step.name}' failed: {errors[step.name]}"
+                    break
+
+        done = sum(1 for status in statuses if status["status"] == "done")
+        self.logger.info(f"⌛ Generated {done}/{len(variants)} videos in {time.time() - start} seconds")
+
+        return statuses
+
+    def build_steps(self,
+                    script: str,
+                    subtitle_color: str,
+                    subtitle_highlight_color: str,
+                    background_music_volume_adjustment: int,
+                    sound_effects: list[dict] = None
+                    ) -> list[dag.Step]:
         video_names = [os.path.join(self.working_dir, 'input', 'videos', video) for video in self.config.places_videos]
+        h264_encoder = self.get_video_encoder()
+
+        place_steps = {video: f'place_{i}' for i, video in enumerate(video_names)}
+
+        return [
+            *self.build_footage_steps(
+                place_steps,
+                estimate_speech_length(script),
+                dict(zip(video_names, self.get_place_lengths(script, video_names))),
+                h264_encoder
+            ),
+            *self.build_variant_steps(
+                script=script,
+                video_names=video_names,
+                place_steps=place_steps,
+                subtitle_color=subtitle_color,
+                subtitle_highlight_color=subtitle_highlight_color,
+                background_music_volume_adjustment=background_music_volume_adjustment,
+                video_encoder=h264_encoder,
+                sound_effects=sound_effects
+            )
+        ]
 
+    @staticmethod
+    def get_video_encoder() -> str:
         h264_encoder = ffmpeg.get_gpu_accelerated_h264_encoder()
         if h264_encoder is None:
             h264_encoder = 'libx264'
+        return h264_encoder
+
+    @staticmethod
+    def get_place_lengths(script: str, video_names: list[str]) -> list[float]:
+        """
+        The estimated segment length of every place video, the whole script's if the markers don't match.
+        """
+        lengths = estimate_place_lengths(script)
+        if len(lengths) != len(video_names):
+            return [estimate_speech_length(script)] * len(video_names)
+        return lengths
 
-        # 2. Generate speech using Eleven Labs
-        speech_file, words = self.text_to_speech(script)
+    def build_footage_steps(self, place_steps: dict[str, str], length: float, place_lengths: dict[str, float],
+                            video_encoder: str) -> list[dag.Step]:
+        """
+        Steps normalizing the background and the place videos. They don't depend on the speech, so the executor
+        runs them while the TTS request is in flight. The lengths are estimated from the script, the edit step
+        refines whatever turns out to be too short.
+
+        :param place_steps: Place video path -> name of the step normalizing it
+        :param length: The length to normalize the background to
+        :param place_lengths: Place video path -> the length to normalize it to
+        """
+        background_video_path = os.path.join(self.working_dir, 'input', 'videos', self.config.background_video)
+
+        # These steps run side by side on the executor, so they split the cores instead of each taking them all.
+        # The threads only change the speed, they are bound to the functions rather than being (cache key) params.
+        _, threads = ffmpeg.get_parallel_jobs_budget(1 + len(place_steps))
+
+        return [
+            dag.Step(
+                name='background',
+                func=functools.partial(self.prepare_background_step, threads=threads),
+                files={"video_path": background_video_path},
+                params={"length": length, "video_encoder": video_encoder},
+                outputs={"output_path": ".mp4"}
+            ),
+            *[
+                dag.Step(
+                    name=name,
+                    func=functools.partial(self.prepare_place_step, threads=threads),
+                    files={"video_path": video},
+                    params={"length": place_lengths[video], "video_encoder": video_encoder},
+                    outputs={"output_path": ".mp4"}
+                )
+                for video, name in place_steps.items()
+            ],
+        ]
+
+    def build_variant_steps(self,
+                            script: str,
+                            video_names: list[str],
+                            place_steps: dict[str, str],
+                            subtitle_color: str,
+                            subtitle_highlight_color: str,
+                            background_music_volume_adjustment: int,
+                            video_encoder: str,
+                            prefix: str = '',
+                            sound_effects: list[dict] = None
+                            ) -> list[dag.Step]:
+        """
+        The steps specific to one script, see build_footage_steps for the footage they use.
 
-        # 3. Detect pauses and split the script into sentences
+        :param prefix: Prepended to the step names, so several variants fit in one DAG
+        :param sound_effects: See run
+        """
+        background_video_path = os.path.join(self.working_dir, 'input', 'videos', self.config.background_video)
+        background_music_name = os.path.join(self.working_dir, 'input', 'music', self.config.background_music)
+        effect_path = os.path.join(self.working_dir, 'input', 'video_effects', self.config.video_effect)
+
+        # The audio of the final mix, see build_audio_timeline
+        sound_effects = sound_effects or []
+        audio_files = {
+            "music_path": background_music_name,
+            **{
+                f"sfx_{i}": os.path.join(self.working_dir, 'input', 'sound_effects', effect['file'])
+                for i, effect in enumerate(sound_effects)
+            }
+        }
+        audio_params = {
+            "volume_adjustment": background_music_volume_adjustment,
+            "sound_effects": [
+                {"start": effect['start'], "gain_db": effect.get('gain_db', 0.0)} for effect in sound_effects
+            ]
+        }
+
+        steps = [
+            # 1. Generate speech using Eleven Labs
+            dag.Step(
+                name=f'{prefix}speech',
+                func=self.speech_step,
+                params={"script": script, "voice": self.voice.cache_key_parts(), "incremental": self.incremental_tts},
+                outputs={"speech_path": ".mp3", "words_path": ".json"}
+            ),
+            # 2. Detect and trim the pauses
+            dag.Step(
+                name=f'{prefix}pauses',
+                func=self.pauses_step,
+                inputs={
+                    "speech_path": (f'{prefix}speech', 'speech_path'),
+                    "words_path": (f'{prefix}speech', 'words_path')
+                },
+                params={"threshold": 0.4, "pad": 0.075},
+                outputs={"no_pauses_path": ".mp4", "shifted_words_path": ".json"}
+            ),
+            # 3. Parse the script and get footage segments
+            dag.Step(
+                name=f'{prefix}segments',
+                func=self.segments_step,
+                inputs={"words_path": (f'{prefix}pauses', 'shifted_words_path')},
+                params={"script": script, "video_names": video_names},
+                outputs={"segments_path": ".json"}
+            ),
+        ]
+
+        # 4. The normalized footages, see build_footage_steps
+        footage_inputs = {
+            "segments_path": (f'{prefix}segments', 'segments_path'),
+            "background_path": ('background', 'output_path'),
+            **{f"place_{i}": (place_steps[video], 'output_path') for i, video in enumerate(video_names)}
+        }
+
+        if self.streaming:
+            # 5-8. Edit, subtitles, effects and audio in one pass, see render_step
+            steps.append(dag.Step(
+                name=f'{prefix}render',
+                func=self.render_step,
+                inputs={
+                    **footage_inputs,
+                    "speech_path": (f'{prefix}pauses', 'no_pauses_path'),
+                    "words_path": (f'{prefix}pauses', 'shifted_words_path')
+                },
+                files={**audio_files, "effect_path": effect_path},
+                params={
+                    **audio_params,
+                    "background_video_path": background_video_path,
+                    "video_encoder": video_encoder,
+                    "color": subtitle_color,
+                    "highlight_color": subtitle_highlight_color,
+                    "blend_mode": 'lignten',
+                    "opacity": 0.2
+                },
+                outputs={"output_path": ".mp4"}
+            ))
+            return steps
+
+        return steps + [
+            # 5. Create audio-less edit
+            dag.Step(
+                name=f'{prefix}edit',
+                func=self.edit_step,
+                inputs=footage_inputs,
+                params={"background_video_path": background_video_path, "video_encoder": video_encoder},
+                outputs={"output_path": ".mp4"}
+            ),
+            # 6. Add subtitles to the edit
+            dag.Step(
+                name=f'{prefix}subtitles',
+                func=self.subtitles_step,
+                inputs={
+                    "video_path": (f'{prefix}edit', 'output_path'),
+                    "words_path": (f'{prefix}pauses', 'shifted_words_path'),
+                    "segments_path": (f'{prefix}segments', 'segments_path')
+                },
+                params={"color": subtitle_color, "highlight_color": subtitle_highlight_color},
+                outputs={"output_path": ".mp4"}
+            ),
+            # 7. Add effects to the edit
+            dag.Step(
+                name=f'{prefix}effects',
+                func=ffmpeg.overlay_effect,
+                inputs={"video_path": (f'{prefix}subtitles', 'output_path')},
+                files={"effect_path": effect_path},
+                params={"blend_mode": 'lignten', "opacity": 0.2, "video_encoder": video_encoder},
+                outputs={"output_path": ".mp4"}
+            ),
+            # 8. Mix speech, music and sound effects onto the video, without re-encoding it
+            dag.Step(
+                name=f'{prefix}audio',
+                func=self.audio_step,
+                inputs={
+                    "video_path": (f'{prefix}effects', 'output_path'),
+                    "speech_path": (f'{prefix}pauses', 'no_pauses_path'),
+                    "segments_path": (f'{prefix}segments', 'segments_path')
+                },
+                files=audio_files,
+                params=audio_params,
+                outputs={"output_path": ".mp4"}
+            ),
+        ]
+
+    def speech_step(self, script: str, voice: list, incremental: bool, speech_path: str, words_path: str):
+        # 'voice' and 'incremental' are step params so that changing them invalidates the step,
+        # text_to_speech reads them from self
+        words = self.text_to_speech(script, speech_path)
+        dag.write_json(words_path, words)
+
+    def pauses_step(self, speech_path: str, words_path: str, threshold: float, pad: float,
+                    no_pauses_path: str, shifted_words_path: str):
         words, pauses = pause.detect_pauses(
-            words,
-            threshold=0.4,
-            pad=0.075
+            dag.read_json(words_path),
+            threshold=threshold,
+            pad=pad
         )
         self.logger.info(f"ℹ️ Detected {len(pauses)} pauses")
 
-        # 4. Trim the pauses
-        no_pauses_file = os.path.join(self.working_dir, 'output', 'no_pauses_speech.mp4')
-        ffmpeg.trim_pauses_from_media(speech_file, pauses, no_pauses_file)
+        ffmpeg.trim_pauses_from_media(speech_path, pauses, no_pauses_path)
+        dag.write_json(shifted_words_path, words)
 
-        # 5. Build the sentences
-        sentences = subs.group_words_into_sentences(words)
+    @staticmethod
+    def segments_step(words_path: str, script: str, video_names: list[str], segments_path: str):
+        dag.write_json(segments_path, parser.get_footage_segments(script, dag.read_json(words_path), video_names))
 
-        # 6. Parse the script and get footage segments
-        footage_segments = parser.get_footage_segments(script, words, video_names)
+    def prepare_background_step(self, video_path: str, length: float, video_encoder: str, output_path: str,
+                                threads: int = None):
+        # An already normalized copy only needs looping and trimming, both without re-encoding
+        mezzanine_path = mezzanine.get_mezzanine(video_path)
+        source_path = mezzanine_path or video_path
 
-        # 7.  Check the length of the background video, if it is not long enough, loop it
-        background_video_duration = ffmpeg.get_media_duration(background_video_path)
-        if background_video_duration < footage_segments['script_end']:
-            looped_background_path = os.path.join(self.working_dir, 'output', 'looped_background.mp4')
+        # Check the length of the background video, if it is not long enough, loop it
+        looped_background_path = None
+        background_video_duration = ffmpeg.get_media_duration(source_path)
+        if background_video_duration < length:
+            looped_background_path = os.path.join(self.working_dir, 'output', f'looped_background_{uuid.uuid4().hex}.mp4')
             ffmpeg.loop_video(
-                video_path=background_video_path,
+                video_path=source_path,
                 output_path=looped_background_path,
-                loop_count=math.ceil(footage_segments['script_end'] / background_video_duration),
+                loop_count=math.ceil(length / background_video_duration),
             )
-            background_video_path = looped_background_path
+            source_path = looped_background_path
             self.logger.info("✅ Looped background video to match the script duration")
 
-        # 8. Create audio-less edit
-        video_edit_path = os.path.join(self.working_dir, 'output', 'video_edit.mp4')
-        self.overlay_footages(
-            video_segments=footage_segments['segments'],
-            background_video_path=background_video_path,
-            output_path=video_edit_path,
-            video_encoder=h264_encoder,
-            duration=footage_segments['script_end']
-        )
-
-        # 9. Add speech to the edit
-        with_speech_path = os.path.join(self.working_dir, 'output', 'video_with_speech.mp4')
-        ffmpeg.add_audio(
-            video_path=video_edit_path,
-            audio_path=no_pauses_file,
-            encoder=h264_encoder,
-            output_path=with_speech_path
+        try:
+            if mezzanine_path is not None:
+                mezzanine.trim(source_path, length, output_path)
+            else:
+                ffmpeg.format_youtube_short_video(
+                    video_path=source_path,
+                    clip_length=length,
+                    video_encoder=video_encoder,
+                    output_path=output_path,
+                    threads=threads
+                )
+            self.logger.info("✅ Formatted background video")
+        finally:
+            if looped_background_path is not None:
+                os.remove(looped_background_path)
+
+    def prepare_place_step(self, video_path: str, length: float, video_encoder: str, output_path: str,
+                           threads: int = None):
+        mezzanine.format_clip(
+            video_path=video_path,
+            clip_length=min(length, ffmpeg.get_media_duration(video_path)),
+            video_encoder=video_encoder,
+            output_path=output_path,
+            threads=threads
         )
-        self.logger.info("✅ Added speech to the edit")
+        self.logger.info(f"✅ Formatted video segment: {video_path}")
 
-        # 10. Add subtitles to the edit
-        with_subtitles_path = os.path.join(self.working_dir, 'output', 'video_with_subtitles.mp4')
-        subs.add_subtitles(
-            video_path=with_speech_path,
-            sentences=sentences,
-            video_duration=footage_segments['script_end'],
-            output_path=with_subtitles_path,
-            highlight_color=subtitle_highlight_color,
-            color=subtitle_color
-        )
-        self.logger.info("✅ Generated video with subtitles")
-
-        # 11. Add background music to the edit
-        with_music_path = os.path.join(self.working_dir, 'output', 'video_with_music.mp4')
-        ffmpeg.mix_background_audio(
-            video_path=with_subtitles_path,
-            audio_path=background_music_name,
-            output_path=with_music_path,
-            volume_adjustment=background_music_volume_adjustment
-        )
+    def resolve_footages(self, segments_path: str, background_path: str, background_video_path: str,
+                         video_encoder: str, place_paths: dict[str, str]) -> (float, str, list[dict], list[str]):
+        """
+        Picks the normalized footages for the overlay. Now that the alignment is known, whatever was
+        normalized too short is normalized again.
 
-        # 12. Add effects to the edit
-        with_effects_path = os.path.join(self.working_dir, 'output', 'video_with_effects.mp4')
-        ffmpeg.overlay_effect(
-            video_path=with_music_path,
-            effect_path=effect_path,
-            blend_mode='lignten',
-            opacity=0.2,
-            video_encoder=h264_encoder,
-            output_path=with_effects_path
+        :return: (duration, background path, overlay segments, paths of the re-normalized files to remove)
+        """
+        footage_segments = dag.read_json(segments_path)
+        duration = footage_segments['script_end']
+
+        refined_paths = []
+        try:
+            if ffmpeg.get_media_duration(background_path) < duration:
+                self.logger.info("ℹ️ The speech is longer than estimated, normalizing the background again")
+                background_path = os.path.join(self.working_dir, 'output', f'background_fmt_{uuid.uuid4().hex}.mp4')
+                refined_paths.append(background_path)
+                self.prepare_background_step(background_video_path, duration, video_encoder, background_path)
+
+            jobs = []
+            fmt_segments: list[dict[str, any]] = []
+            for i, segment in enumerate(footage_segments['segments']):
+                footage = place_paths[f'place_{i}']
+                clip_length = refined_footage_length(
+                    footage_duration=ffmpeg.get_media_duration(footage),
+                    source_duration=ffmpeg.get_media_duration(segment['footage']),
+                    segment_length=segment['end'] - segment['start']
+                )
+                if clip_length is not None:
+                    footage = os.path.join(self.working_dir, 'output', f'{uuid.uuid4().hex}.mp4')
+                    jobs.append({
+                        "video_path": segment['footage'],
+                        "clip_length": clip_length,
+                        "output_path": footage
+                    })
+                    refined_paths.append(footage)
+
+                fmt_segments.append({
+                    "footage": footage,
+                    "start": segment['start'],
+                    "end": segment['end']
+                })
+
+            if jobs:
+                self.format_footages(jobs, video_encoder)
+        except Exception:
+            self.remove_files(refined_paths)
+            raise
+
+        return duration, background_path, fmt_segments, refined_paths
+
+    @staticmethod
+    def remove_files(paths: list[str]):
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def edit_step(self, segments_path: str, background_path: str, background_video_path: str, video_encoder: str,
+                  output_path: str, **place_paths):
+        duration, background_path, fmt_segments, refined_paths = self.resolve_footages(
+            segments_path, background_path, background_video_path, video_encoder, place_paths
         )
 
-        self.logger.info("✅ Added background music to the edit")
-
-        end = time.time()
-
-        self.logger.info(f"⌛ Generated a video in {end - start} seconds")
-
-    def overlay_footages(self, video_segments: list[dict[str, any]], background_video_path: str, output_path: str,
-                         duration: float,
-                         video_encoder: str):
-        background_video_fmt_path = os.path.join(os.path.dirname(output_path), 'background_fmt.mp4')
-        ffmpeg.format_youtube_short_video(
-            video_path=background_video_path,
-            clip_length=duration,
-            video_encoder=video_encoder,
-            output_path=background_video_fmt_path
-        )
-        self.logger.info("✅ Formatted background video")
-
-        fmt_segments: list[dict[str, any]] = []
-        for segment in video_segments:
-            fmt_segment_path = os.path.join(os.path.dirname(output_path), f'{uuid.uuid4().hex}.mp4')
-            ffmpeg.format_youtube_short_video(
-                video_path=segment['footage'],
-                clip_length=segment['end'] - segment['start'],
+        try:
+            top5_ffmpeg.overlay_videos(
+                background_footage_path=background_path,
+                footages=fmt_segments,
+                output_path=output_path,
                 video_encoder=video_encoder,
-                output_path=fmt_segment_path
+                duration=duration
             )
-            self.logger.info(f"✅ Formatted video segment: {segment['footage']}")
+            self.logger.info("✅ Overlayed video footages")
+        finally:
+            self.remove_files(refined_paths)
+
+    def render_step(self, segments_path: str, background_path: str, background_video_path: str, video_encoder: str,
+                    speech_path: str, words_path: str, music_path: str, effect_path: str, color: str,
+                    highlight_color: str, volume_adjustment: int, sound_effects: list[dict], blend_mode: str,
+                    opacity: float, output_path: str, **paths):
+        """
+        The streaming equivalent of the edit, subtitles, effects and audio steps.
 
-            fmt_segments.append({
-                "footage": fmt_segment_path,
-                "start": segment['start'],
-                "end": segment['end']
-            })
+        The overlay runs in one ffmpeg process writing raw frames to a pipe, the subtitles are drawn onto
+        the frames in this process, and a second ffmpeg process blends the effect, mixes the audio and
+        encodes the result. All three run concurrently, only 'output_path' is written.
 
-        top5_ffmpeg.overlay_videos(
-            background_footage_path=background_video_fmt_path,
-            footages=fmt_segments,
-            output_path=output_path,
-            video_encoder=video_encoder
+        :param paths: The place videos ('place_{i}') and the sound effects ('sfx_{i}')
+        """
+        duration, background_path, fmt_segments, refined_paths = self.resolve_footages(
+            segments_path, background_path, background_video_path, video_encoder, paths
         )
 
-        self.logger.info("✅ Overlayed video footages")
+        try:
+            compositor = subs.SubtitleCompositor(
+                subs.group_words_into_sentences(dag.read_json(words_path)),
+                highlight_color=highlight_color,
+                color=color
+            )
 
-        os.remove(background_video_fmt_path)
-        for segment in fmt_segments:
-            os.remove(segment['footage'])
+            streaming.stream_frames(
+                producer_cmd=top5_ffmpeg.build_overlay_videos_stream_cmd(background_path, fmt_segments, duration),
+                consumer_cmd=ffmpeg.build_finish_stream_cmd(
+                    audio_timeline=self.build_audio_timeline(
+                        duration=duration,
+                        speech_path=speech_path,
+                        music_path=music_path,
+                        volume_adjustment=volume_adjustment,
+                        sound_effects=sound_effects,
+                        paths=paths
+                    ),
+                    video_encoder=video_encoder,
+                    output_path=output_path,
+                    effect_path=effect_path,
+                    blend_mode=blend_mode,
+                    opacity=opacity
+                ),
+                transform=compositor
+            )
+            self.logger.info("✅ Rendered the video in one streamed pass")
+        finally:
+            self.remove_files(refined_paths)
 
-    def text_to_speech(self, script) -> (str, list[dict]):
-        """
-        Convert text to speech via ElevenLabs, with caching based on the script hash.
-        Returns:
-          - speech_file: path to the generated (or cached) speech file (.mp3)
-          - words: list of word-level data
-          - sentences: list of sentence-level data
+    @staticmethod
+    def build_audio_timeline(duration: float, speech_path: str, music_path: str, volume_adjustment: int,
+                             sound_effects: list[dict], paths: dict[str, str]) -> AudioTimeline:
         """
+        The speech, the looped background music and the sound effects (their paths are paths['sfx_{i}']).
 
-        # ------------------------------------------------------
-        # 1) Compute a hash of the script to identify duplicates
-        # ------------------------------------------------------
-        script_hash = hashlib.md5(script.encode('utf-8')).hexdigest()
-
-        speech_file = os.path.join(
-            self.working_dir,
-            'output',
-            f"eleven_labs_speech_{script_hash}.mp3"
+        The speech and the music are loudness-normalized first, so 'volume_adjustment' sets the music
+        relative to the speech whatever the levels of the uploaded track.
+        """
+        timeline = AudioTimeline(duration=duration)
+        timeline.add(speech_path, bus='speech', loudness=loudness.DEFAULT_TARGET_LOUDNESS)
+        timeline.add(music_path, bus='music', gain_db=volume_adjustment, fade_out=1.0, loop=True,
+                     loudness=loudness.DEFAULT_TARGET_LOUDNESS)
+        for i, effect in enumerate(sound_effects):
+            timeline.add(paths[f'sfx_{i}'], start=effect['start'], bus='sfx', gain_db=effect['gain_db'])
+        return timeline
+
+    def audio_step(self, video_path: str, speech_path: str, segments_path: str, music_path: str,
+                   volume_adjustment: int, sound_effects: list[dict], output_path: str, **sfx_paths):
+        timeline = self.build_audio_timeline(
+            duration=dag.read_json(segments_path)['script_end'],
+            speech_path=speech_path,
+            music_path=music_path,
+            volume_adjustment=volume_adjustment,
+            sound_effects=sound_effects,
+            paths=sfx_paths
         )
-        alignment_file = os.path.join(
-            self.working_dir,
-            'output',
-            f"eleven_labs_alignment_{script_hash}.json"
+        timeline.mux(video_path, output_path)
+        self.logger.info("✅ Mixed the audio onto the video")
+
+    @staticmethod
+    def subtitles_step(video_path: str, words_path: str, segments_path: str, color: str, highlight_color: str,
+                       output_path: str):
+        subs.add_subtitles(
+            video_path=video_path,
+            sentences=subs.group_words_into_sentences(dag.read_json(words_path)),
+            video_duration=dag.read_json(segments_path)['script_end'],
+            output_path=output_path,
+            highlight_color=highlight_color,
+            color=color
         )
 
-        # ----------------------------------------------------------------
-        # 2) Check if cached files exist. If yes, reuse them; if not, call TTS
-        # ----------------------------------------------------------------
-        if os.path.exists(speech_file) and os.path.exists(alignment_file):
-            self.logger.info(f"✅ Using cached ElevenLabs speech for hash: {script_hash}")
-
-            # Read alignment JSON
-            with open(alignment_file, 'r') as f:
-                alignment = json.load(f)
-
-            # Reconstruct the words and sentences from alignment
-            words = subs.group_chars_into_words(
-                alignment['characters'],
-                alignment['character_start_times_seconds'],
-                alignment['character_end_times_seconds']
-            )
-            sentences = subs.group_words_into_sentences(words)
+    def format_footages(self, jobs: list[dict[str, any]], video_encoder: str):
+        """
+        Runs mezzanine.format_clip for each job ({"video_path", "clip_length", "output_path"}) concurrently,
+        on a pool sized to the host's core budget.
+        """
+        workers, threads = ffmpeg.get_parallel_jobs_budget(len(jobs))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    mezzanine.format_clip,
+                    video_path=job['video_path'],
+                    clip_length=job['clip_length'],
+                    video_encoder=video_encoder,
+                    output_path=job['output_path'],
+                    threads=threads
+                )
+                for job in jobs
+            ]
+
+            # Collect in submission order, so the reported error does not depend on timing
+            errors = []
+            for job, future in zip(jobs, futures):
+                try:
+                    future.result()
+                    self.logger.info(f"✅ Formatted video segment: {job['video_path']}")
+                except Exception as e:
+                    errors.append(e)
+
+        if errors:
+            for job in jobs:
+                if os.path.exists(job['output_path']):
+                    os.remove(job['output_path'])
+            raise errors[0]
+
+    def text_to_speech(self, script: str, speech_file: str) -> list[dict]:
+        """
+        Convert text to speech via ElevenLabs, through the shared TTS cache (see services/pipelines/tts.py).
 
+        :param speech_file: Where to write the speech (.mp3), e.g. the speech step's output
+        :return: list of word-level data
+        """
+        if self.incremental_tts:
+            alignment = tts.incremental_text_to_speech(self.elevenlabs_client, script, speech_file, voice=self.voice)
         else:
-            self.logger.info("⌛ No cached version found. Generating fresh speech using ElevenLabs...")
-
-            # 3) Call ElevenLabs for TTS
-            audio = self.elevenlabs_client.text_to_speech.convert_with_timestamps(
-                text=script,
-                voice_id="TX3LPaxmHKxFdv7VOQHJ",  # example: "Liam"
-                model_id="eleven_multilingual_v2",
-                output_format='mp3_44100_128',
-                voice_settings=VoiceSettings(
-                    stability=0.71,
-                    similarity_boost=0.5,
-                    style=0.0,
-                    use_speaker_boost=True
-                )
-            )
+            alignment = tts.text_to_speech(self.elevenlabs_client, script, speech_file, voice=self.voice)
 
-            # 4) Write MP3 file
-            audio_bytes = base64.b64decode(audio["audio_base64"])
-            with open(speech_file, "wb") as f:
-                f.write(audio_bytes)
-
-            # 5) Process alignment
-            alignment = audio['alignment']
-            with open(alignment_file, 'w') as f:
-                json_str = json.dumps(alignment)
-                f.write(json_str)
-
-            # 6) Build words & sentences
-            words = subs.group_chars_into_words(
-                alignment['characters'],
-                alignment['character_start_times_seconds'],
-                alignment['character_end_times_seconds']
-            )
-            self.logger.info("✅ Generated new speech and alignment from ElevenLabs")
+        words = subs.group_chars_into_words(
+            alignment['characters'],
+            alignment['character_start_times_seconds'],
+            alignment['character_end_times_seconds']
+        )
+        self.logger.info("✅ Generated speech and alignment from ElevenLabs")
 
-        # Return paths and data
-        return speech_file, words
+        return words
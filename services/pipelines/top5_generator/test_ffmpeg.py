@@ -0,0 +1,50 @@
+import unittest
+
+from services.pipelines.top5_generator.ffmpeg import _build_timeline_graph, plan_timeline
+
+
+class TestPlanTimeline(unittest.TestCase):
+    def test_background_only_where_uncovered(self):
+        footages = [
+            {"footage": "b.mp4", "start": 9.0, "end": 15.0},
+            {"footage": "a.mp4", "start": 3.0, "end": 9.0},
+        ]
+
+        pieces = plan_timeline(footages, 20.0)
+
+        self.assertEqual(pieces, [
+            {"footage": None, "start": 0.0, "end": 3.0},
+            {"footage": "a.mp4", "start": 3.0, "end": 9.0},
+            {"footage": "b.mp4", "start": 9.0, "end": 15.0},
+            {"footage": None, "start": 15.0, "end": 20.0},
+        ])
+
+    def test_overlapping_footages_need_overlays(self):
+        footages = [
+            {"footage": "a.mp4", "start": 3.0, "end": 10.0},
+            {"footage": "b.mp4", "start": 9.0, "end": 15.0},
+        ]
+
+        self.assertIsNone(plan_timeline(footages, 20.0))
+
+    def test_footages_are_clipped_to_the_duration(self):
+        footages = [{"footage": "a.mp4", "start": 2.0, "end": 12.0}]
+
+        pieces = plan_timeline(footages, 10.0)
+
+        self.assertEqual(pieces[-1], {"footage": "a.mp4", "start": 2.0, "end": 10.0})
+
+    def test_short_footages_hold_their_last_frame(self):
+        # a.mp4 may be shorter than its 6s segment, the concat must still last 6s there
+        pieces = plan_timeline([{"footage": "a.mp4", "start": 3.0, "end": 9.0}], 9.0)
+
+        cmd, label = _build_timeline_graph('background.mp4', pieces)
+        graph = cmd[cmd.index("-filter_complex") + 1]
+
+        self.assertIn("[1:v]setpts=PTS-STARTPTS,setsar=1,tpad=stop_mode=clone:stop_duration=6.0,"
+                      "trim=duration=6.0[p1]", graph)
+        self.assertIn("tpad=stop_mode=clone:stop_duration=3.0,trim=duration=3.0[p0]", graph)
+
+
+if __name__ == "__main__":
+    unittest.main()
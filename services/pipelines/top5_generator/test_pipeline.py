@@ -0,0 +1,23 @@
+import unittest
+
+from services.pipelines.top5_generator.pipeline import refined_footage_length
+
+
+class TestRefinedFootageLength(unittest.TestCase):
+    def test_short_estimate_is_normalized_again(self):
+        self.assertEqual(refined_footage_length(footage_duration=10.0, source_duration=60.0, segment_length=14.0),
+                         14.0)
+
+    def test_long_enough_footage_is_kept(self):
+        self.assertIsNone(refined_footage_length(footage_duration=15.0, source_duration=60.0, segment_length=14.0))
+
+    def test_source_shorter_than_its_segment_is_kept(self):
+        # the footage was clamped to the 8s source, the timeline holds its last frame
+        self.assertIsNone(refined_footage_length(footage_duration=7.98, source_duration=8.0, segment_length=14.0))
+
+    def test_source_between_the_estimate_and_the_segment(self):
+        self.assertEqual(refined_footage_length(footage_duration=5.0, source_duration=8.0, segment_length=14.0), 8.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
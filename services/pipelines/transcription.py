@@ -0,0 +1,505 @@
+import bisect
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+
+from services.pipelines import audio
+from services.pipelines.cache import DiskCache, file_content_hash, make_key
+
+# Whisper output for a long upload is a few hundred KB of JSON, 512 MB keeps plenty of them around
+TRANSCRIPTION_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# What a long-form worker needs besides shared fp32 weights (torch runtime and activations), measured
+# at ~330 MB with the 'small' model
+CHUNK_WORKER_MEMORY_BYTES = 512 * 1024 * 1024
+
+
+def available_memory() -> int | None:
+    """
+    The memory that can be used without swapping (MemAvailable), None where it is unknown.
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def slim_transcription(result: dict) -> dict:
+    """
+    Keeps only the parts of a whisper result the pipelines use: segments with their word timestamps.
+    """
+    return {
+        "text": result.get("text", ""),
+        "language": result.get("language"),
+        "segments": [
+            {
+                "start": segment["start"],
+                "end": segment["end"],
+                "text": segment["text"],
+                "words": [
+                    {"start": word["start"], "end": word["end"], "word": word["word"]}
+                    for word in segment.get("words", [])
+                ]
+            }
+            for segment in result["segments"]
+        ]
+    }
+
+
+def plan_chunks(
+        samples: np.ndarray,
+        max_chunk_length: float = 30.0,
+        overlap: float = 1.0,
+        noise_threshold: float = -35,
+        min_silence: float = 0.3,
+        sample_rate: int = audio.SAMPLE_RATE
+) -> list[dict]:
+    """
+    Splits audio into chunks of at most 'max_chunk_length' seconds, cutting in the middle of silences where possible.
+
+    Each chunk is extended by 'overlap' seconds on both sides, so words at a cut are heard in full by at
+    least one chunk. "own_start"/"own_end" is the part of the timeline the chunk is responsible for, the
+    owned ranges of all chunks tile the audio without gaps.
+
+    :return: A list of {"start", "end", "own_start", "own_end"} dicts, in seconds, none for empty audio
+    """
+    if overlap < 0 or max_chunk_length <= 2 * overlap:
+        raise ValueError(
+            f"max_chunk_length ({max_chunk_length}s) must be longer than twice the overlap ({overlap}s)"
+        )
+
+    total = audio.audio_duration(samples, sample_rate)
+    silences = audio.detect_silences(samples, noise_threshold, min_silence, sample_rate=sample_rate)
+    cut_points = [(s["start"] + s["end"]) / 2 for s in silences]
+
+    chunks = []
+    own_start = 0.0
+    while own_start < total:
+        limit = own_start + max_chunk_length - 2 * overlap
+        if limit >= total:
+            own_end = total
+        else:
+            # the last silence in the second half of the window, or a hard cut if the speech never stops
+            own_end = limit
+            idx = bisect.bisect_right(cut_points, limit) - 1
+            if idx >= 0 and cut_points[idx] > own_start + (limit - own_start) / 2:
+                own_end = cut_points[idx]
+
+        chunks.append({
+            "start": max(0.0, own_start - overlap),
+            "end": min(total, own_end + overlap),
+            "own_start": own_start,
+            "own_end": own_end
+        })
+        own_start = own_end
+
+    return chunks
+
+
+def merge_chunk_results(chunks: list[dict], results: list[dict]) -> dict:
+    """
+    Merges per-chunk transcriptions back into one timeline.
+
+    Timestamps in 'results' are relative to their chunk's start. A word is kept by the chunk that owns
+    its midpoint, which de-duplicates the words heard twice in the overlaps.
+    """
+    segments = []
+    language = None
+
+    for chunk, result in zip(chunks, results):
+        language = language or result.get("language")
+        offset = chunk["start"]
+
+        for segment in result["segments"]:
+            words = []
+            for word in segment["words"]:
+                start = word["start"] + offset
+                end = word["end"] + offset
+                if chunk["own_start"] <= (start + end) / 2 < chunk["own_end"]:
+                    words.append({"start": start, "end": end, "word": word["word"]})
+
+            if words:
+                segments.append({
+                    "start": words[0]["start"],
+                    "end": words[-1]["end"],
+                    "text": "".join(w["word"] for w in words),
+                    "words": words
+                })
+
+    return {
+        "text": "".join(segment["text"] for segment in segments),
+        "language": language,
+        "segments": segments
+    }
+
+
+def gate_speech(samples: np.ndarray, regions: list[dict], sample_rate: int = audio.SAMPLE_RATE) -> np.ndarray:
+    """
+    Concatenates the speech regions of the audio, dropping everything in between.
+    """
+    if not regions:
+        return np.empty(0, dtype=np.float32)
+
+    return np.concatenate([
+        samples[int(region["start"] * sample_rate):int(region["end"] * sample_rate)]
+        for region in regions
+    ])
+
+
+def restore_timestamps(result: dict, regions: list[dict]) -> dict:
+    """
+    Maps the timestamps of a transcription of gate_speech() output back to the original timeline.
+    """
+    compact_starts = []
+    position = 0.0
+    for region in regions:
+        compact_starts.append(position)
+        position += region["end"] - region["start"]
+
+    def region_of(t: float) -> int:
+        return max(0, bisect.bisect_right(compact_starts, t) - 1)
+
+    def restore(t: float) -> float:
+        idx = region_of(t)
+        return regions[idx]["start"] + (t - compact_starts[idx])
+
+    def restore_word(word: dict) -> dict:
+        start = restore(word["start"])
+        # a word can not span the silence cut out between two regions, it would hide the pause
+        end = min(restore(word["end"]), max(start, regions[region_of(word["start"])]["end"]))
+        return {"start": start, "end": end, "word": word["word"]}
+
+    segments = []
+    for segment in result["segments"]:
+        words = [restore_word(word) for word in segment["words"]]
+
+        segments.append({
+            "start": words[0]["start"] if words else restore(segment["start"]),
+            "end": words[-1]["end"] if words else restore(segment["end"]),
+            "text": segment["text"],
+            "words": words
+        })
+
+    return {**result, "segments": segments}
+
+
+# Set by _init_chunk_worker in every worker of the pool
+_worker_model = None
+
+
+def _init_chunk_worker(model_name: str, dims: dict | None, state: dict | None, threads: int):
+    """
+    Wraps the parent's shared fp32 weights ('dims' and 'state'), or loads the prebuilt int8 model when
+    there are none.
+    """
+    global _worker_model
+
+    import torch
+
+    torch.set_num_threads(threads)
+
+    if state is not None:
+        from services.pipelines.whisper_quantization import model_from_state
+
+        _worker_model = model_from_state(dims, state, model_name)
+    else:
+        from services.pipelines.whisper_quantization import load_quantized_model
+
+        _worker_model = load_quantized_model(model_name, allow_build=False)
+
+
+def _transcribe_chunk(args) -> dict:
+    npy_path, start, end, language, options = args
+
+    samples = np.load(npy_path, mmap_mode='c')
+    chunk = np.ascontiguousarray(samples[int(start * audio.SAMPLE_RATE):int(end * audio.SAMPLE_RATE)])
+
+    return slim_transcription(_worker_model.transcribe(audio=chunk, language=language, **options))
+
+
+class Transcriber:
+    """
+    Transcribes media with whisper and caches the results on disk.
+
+    The cache key is (audio content hash, model name, language, transcription options), so anything
+    that only post-processes the words (e.g. pause detection) can be re-run without transcribing again.
+    The whisper model itself is only loaded on the first cache miss.
+    """
+
+    model_name: str = None
+    language: str = None
+    quantized: bool = False
+
+    cache: DiskCache = None
+
+    def __init__(self, model_name: str = "small", language: str = None, quantized: bool = False,
+                 cache: DiskCache = None):
+        self.model_name = model_name
+        self.language = language
+        self.quantized = quantized
+        self.cache = cache if cache is not None else DiskCache('transcriptions', TRANSCRIPTION_CACHE_MAX_BYTES)
+
+        self._model = None
+
+    @property
+    def model_key(self) -> str:
+        """
+        Identifies the model in cache keys, int8 results are not interchangeable with fp32 ones.
+        """
+        return f"{self.model_name}-int8" if self.quantized else self.model_name
+
+    @property
+    def model(self):
+        if self._model is None:
+            if self.quantized:
+                from services.pipelines.whisper_quantization import load_quantized_model
+
+                self._model = load_quantized_model(self.model_name, allow_build=False)
+            else:
+                import whisper
+
+                self._model = whisper.load_model(self.model_name)
+        return self._model
+
+    def transcribe(self, media_path: str, vad: bool = False, **options) -> dict:
+        """
+        Transcribes the media file with word timestamps.
+
+        :param media_path: Path to the audio or video file
+        :param vad: Only feed the speech regions to whisper (see audio.detect_speech_regions), the word
+                    timestamps are mapped back to the original timeline
+        :param options: Extra options passed to whisper's transcribe, they are part of the cache key
+        :return: A whisper-like result: {"text", "language", "segments": [{"start", "end", "text", "words"}]}
+        """
+        options = {"word_timestamps": True, **options}
+
+        key_parts = [file_content_hash(media_path), self.model_key, self.language, options]
+        if vad:
+            key_parts.append('vad')
+
+        key = make_key(*key_parts)
+        cached = self.cache.get_json(key)
+        if cached is not None:
+            logging.info(f"✅ Using cached transcription for {media_path}")
+            return cached
+
+        # whisper gets the shared decoded buffer instead of running its own ffmpeg decode
+        samples = audio.load_audio(media_path)
+
+        if vad:
+            # Dead air costs decoding time and makes whisper hallucinate, skip it
+            regions = audio.detect_speech_regions(samples)
+            speech = gate_speech(samples, regions)
+            logging.info(f"ℹ️ VAD kept {audio.audio_duration(speech):.1f}s of {audio.audio_duration(samples):.1f}s")
+
+            if len(speech) == 0:
+                result = {"text": "", "language": self.language, "segments": []}
+            else:
+                result = restore_timestamps(slim_transcription(self.model.transcribe(
+                    audio=speech,
+                    language=self.language,
+                    **options
+                )), regions)
+        else:
+            result = slim_transcription(self.model.transcribe(
+                audio=samples,
+                language=self.language,
+                **options
+            ))
+
+        self.cache.put_json(key, result)
+        logging.info(f"✅ Transcribed {media_path} with whisper {self.model_key}")
+
+        return result
+
+    def transcribe_long(
+            self,
+            media_path: str,
+            max_chunk_length: float = 30.0,
+            overlap: float = 1.0,
+            workers: int = None,
+            vad: bool = False,
+            **options
+    ) -> dict:
+        """
+        Transcribes a long recording in chunks, in parallel.
+
+        The audio is split at silences into bounded chunks with small overlaps (see plan_chunks), the chunks
+        are transcribed by a process pool, and the word timestamps are merged back into one timeline
+        (see merge_chunk_results).
+
+        The workers are started with forkserver (spawn where it is not available): forking this process,
+        with torch's thread pools running and the web server's threads, can deadlock. The fp32 weights are
+        moved to shared memory and every worker maps them, so only its activations are its own. The int8
+        weights cannot be shared (they are repacked on load), every worker loads its own copy of them.
+
+        :param media_path: Path to the audio or video file
+        :param max_chunk_length: Maximum chunk length in seconds, including the overlaps
+        :param overlap: Overlap in seconds added on each side of a cut
+        :param workers: Number of worker processes, defaults to the number of available cores, as many as
+                        the available memory allows (see CHUNK_WORKER_MEMORY_BYTES)
+        :param vad: Only transcribe the speech regions, see transcribe
+        :param options: Extra options passed to whisper's transcribe, they are part of the cache key
+        :return: A whisper-like result, see transcribe
+        """
+        options = {"word_timestamps": True, **options}
+
+        key_parts = [file_content_hash(media_path), self.model_key, self.language, options,
+                     'long_form', max_chunk_length, overlap]
+        if vad:
+            key_parts.append('vad')
+
+        key = make_key(*key_parts)
+        cached = self.cache.get_json(key)
+        if cached is not None:
+            logging.info(f"✅ Using cached transcription for {media_path}")
+            return cached
+
+        decoded_cache = audio.get_decoded_audio_cache()
+        decoded_path = npy_path = audio.decode_audio(media_path)
+        # the workers open it by path, it must not be evicted before they do
+        decoded_cache.pin(decoded_path)
+
+        regions = None
+        speech_path = None
+        try:
+            if vad:
+                # The workers read the chunks from disk, so the gated speech gets a file of its own
+                samples = np.load(npy_path, mmap_mode='c')
+                regions = audio.detect_speech_regions(samples)
+                speech_path = decoded_cache.temp_path('.npy')
+                np.save(speech_path, gate_speech(samples, regions))
+                npy_path = speech_path
+
+            chunks = plan_chunks(np.load(npy_path, mmap_mode='c'), max_chunk_length=max_chunk_length,
+                                 overlap=overlap)
+
+            if not chunks:
+                result = {"text": "", "language": self.language, "segments": []}
+                self.cache.put_json(key, result)
+                return result
+
+            cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+            if workers is None:
+                workers = min(cores, self.max_chunk_workers())
+            workers = max(1, min(workers, len(chunks)))
+
+            import torch.multiprocessing
+
+            if self.quantized:
+                dims, state = None, None
+            else:
+                dims, state = self.share_model()
+
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            with torch.multiprocessing.get_context(start_method).Pool(
+                    processes=workers,
+                    initializer=_init_chunk_worker,
+                    initargs=(self.model_name, dims, state, max(1, cores // workers))
+            ) as pool:
+                results = pool.map(
+                    _transcribe_chunk,
+                    [(npy_path, chunk["start"], chunk["end"], self.language, options) for chunk in chunks]
+                )
+        finally:
+            decoded_cache.unpin(decoded_path)
+            if speech_path is not None and os.path.exists(speech_path):
+                os.remove(speech_path)
+
+        result = merge_chunk_results(chunks, results)
+        if regions is not None:
+            result = restore_timestamps(result, regions)
+
+        self.cache.put_json(key, result)
+        logging.info(f"✅ Transcribed {media_path} in {len(chunks)} chunks with {workers} workers")
+
+        return result
+
+    def share_model(self) -> (dict, dict):
+        """
+        Moves the fp32 model's weights to shared memory, in place, so worker processes can map them
+        instead of loading their own copy (see whisper_quantization.model_from_state).
+
+        :return: (dims, state_dict), cheap to send to a torch.multiprocessing worker
+        """
+        import dataclasses
+
+        import torch
+        import torch.multiprocessing
+
+        # by file name: the default passes a file descriptor per tensor, more than forkserver can send
+        torch.multiprocessing.set_sharing_strategy('file_system')
+
+        state = self.model.state_dict()
+        for tensor in state.values():
+            if isinstance(tensor, torch.Tensor):
+                tensor.share_memory_()
+
+        return dataclasses.asdict(self.model.dims), dict(state)
+
+    def max_chunk_workers(self) -> int:
+        """
+        How many long-form workers fit into the available memory, at least 1.
+        """
+        memory = available_memory()
+        if memory is None:
+            return os.cpu_count() or 1
+
+        per_worker = CHUNK_WORKER_MEMORY_BYTES
+        if self.quantized:
+            from services.pipelines.whisper_quantization import get_quantized_model_path
+
+            # every worker loads its own int8 weights
+            model_path = get_quantized_model_path(self.model_name)
+            if model_path is not None:
+                per_worker += os.path.getsize(model_path)
+
+        return max(1, memory // per_worker)
+
+    def transcribe_batched(self, media_path: str, vad: bool = False) -> dict:
+        """
+        Transcribes the media through the shared batching service, see services.pipelines.transcription_service.
+
+        Under load the windows of concurrent tasks are decoded together, which uses the CPU far better than
+        independent transcribe calls.
+
+        :param media_path: Path to the audio or video file
+        :param vad: Only transcribe the speech regions, see transcribe
+        :return: A whisper-like result, see transcribe
+        """
+        from services.pipelines.transcription_service import get_transcription_service
+
+        key_parts = [file_content_hash(media_path), self.model_key, self.language, 'batched']
+        if vad:
+            key_parts.append('vad')
+
+        key = make_key(*key_parts)
+        cached = self.cache.get_json(key)
+        if cached is not None:
+            logging.info(f"✅ Using cached transcription for {media_path}")
+            return cached
+
+        samples = audio.load_audio(media_path)
+        regions = None
+        if vad:
+            regions = audio.detect_speech_regions(samples)
+            samples = gate_speech(samples, regions)
+
+        if len(samples) == 0:
+            result = {"text": "", "language": self.language, "segments": []}
+        else:
+            service = get_transcription_service(self.model_name, self.quantized)
+            result = service.submit(samples, language=self.language).result()
+            if regions is not None:
+                result = restore_timestamps(result, regions)
+
+        self.cache.put_json(key, result)
+        logging.info(f"✅ Transcribed {media_path} with the batched whisper {self.model_key} service")
+
+        return result
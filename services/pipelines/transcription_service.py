@@ -0,0 +1,229 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+from services.pipelines import audio
+from services.pipelines.transcription import plan_chunks, merge_chunk_results
+
+# whisper sees at most 30 seconds of audio at once
+WINDOW_LENGTH = 30.0
+
+
+class _Job:
+    """
+    One submitted recording, split into windows that are decoded as part of shared batches.
+    """
+
+    def __init__(self, samples: np.ndarray, language: str or None, future: Future):
+        self.samples = samples
+        self.language = language
+        self.future = future
+
+        self.chunks = plan_chunks(samples, max_chunk_length=WINDOW_LENGTH, overlap=0.5)
+        self.results: list[dict or None] = [None] * len(self.chunks)
+        self.pending = len(self.chunks)
+
+        self.lock = threading.Lock()
+
+    def window(self, index: int) -> np.ndarray:
+        chunk = self.chunks[index]
+        start = int(chunk["start"] * audio.SAMPLE_RATE)
+        end = int(chunk["end"] * audio.SAMPLE_RATE)
+        return np.ascontiguousarray(self.samples[start:end])
+
+    def complete(self, index: int, result: dict):
+        with self.lock:
+            self.results[index] = result
+            self.pending -= 1
+            done = self.pending == 0
+
+        if done and not self.future.done():
+            self.future.set_result(merge_chunk_results(self.chunks, self.results))
+
+    def fail(self, e: Exception):
+        if not self.future.done():
+            self.future.set_exception(e)
+
+
+class TranscriptionService:
+    """
+    Transcribes the recordings of all concurrent jobs with one shared whisper model.
+
+    Submitted audio is split into 30-second windows, a single worker thread collects pending windows from
+    all jobs into batches and decodes each batch in one forward pass. Results are stitched back together
+    per job and returned through futures.
+    """
+
+    model_name: str = None
+    quantized: bool = False
+
+    batch_size: int = None
+    max_wait: float = None
+
+    def __init__(self, model_name: str = "small", quantized: bool = False, batch_size: int = 8,
+                 max_wait: float = 0.05):
+        self.model_name = model_name
+        self.quantized = quantized
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+
+        self._model = None
+        self._windows: queue.Queue = queue.Queue()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, samples: np.ndarray, language: str = None) -> Future:
+        """
+        Queues a recording for transcription.
+
+        :param samples: 16 kHz mono float32 audio, see services.pipelines.audio.load_audio
+        :param language: The spoken language, None to detect it per window
+        :return: A future resolving to a whisper-like result with word timestamps
+        """
+        future = Future()
+        job = _Job(samples, language, future)
+
+        if not job.chunks:
+            future.set_result({"text": "", "language": language, "segments": []})
+            return future
+
+        for index in range(len(job.chunks)):
+            self._windows.put((job, index))
+
+        return future
+
+    def _collect_batch(self) -> list[tuple[_Job, int]]:
+        batch = [self._windows.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._windows.get(timeout=self.max_wait))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # The worker must outlive any failure, every pending and future submit depends on it
+        while True:
+            batch = self._collect_batch()
+            try:
+                self._process_batch(batch)
+            except Exception as e:
+                logging.error(f"batched transcription failed: {e}")
+                for job, _ in batch:
+                    job.fail(e)
+
+    def _process_batch(self, batch: list[tuple[_Job, int]]):
+        # One decoding pass per language, windows of jobs without a language detect it themselves
+        by_language: dict[str or None, list[tuple[_Job, int]]] = {}
+        for job, index in batch:
+            if job.future.done():
+                continue
+            by_language.setdefault(job.language, []).append((job, index))
+
+        for language, items in by_language.items():
+            # a job failing to provide or merge its windows only fails that job
+            windows, decodable = [], []
+            for job, index in items:
+                try:
+                    windows.append(job.window(index))
+                    decodable.append((job, index))
+                except Exception as e:
+                    job.fail(e)
+
+            if not decodable:
+                continue
+
+            try:
+                results = self._decode_batch(windows, language)
+            except Exception as e:
+                logging.error(f"batched transcription failed: {e}")
+                for job, _ in decodable:
+                    job.fail(e)
+                continue
+
+            for (job, index), result in zip(decodable, results):
+                try:
+                    job.complete(index, result)
+                except Exception as e:
+                    job.fail(e)
+
+    def _decode_batch(self, windows: list[np.ndarray], language: str or None) -> list[dict]:
+        import torch
+        import whisper
+        from whisper.timing import add_word_timestamps
+        from whisper.tokenizer import get_tokenizer
+
+        if self._model is None:
+            if self.quantized:
+                from services.pipelines.whisper_quantization import load_quantized_model
+
+                self._model = load_quantized_model(self.model_name, allow_build=False)
+            else:
+                self._model = whisper.load_model(self.model_name)
+        model = self._model
+
+        mels = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(window)), model.dims.n_mels)
+            for window in windows
+        ]).to(model.device)
+
+        decoded = whisper.decode(model, mels, whisper.DecodingOptions(
+            language=language,
+            without_timestamps=True,
+            fp16=False
+        ))
+
+        results = []
+        for window, mel, result in zip(windows, mels, decoded):
+            duration = len(window) / audio.SAMPLE_RATE
+
+            tokenizer = get_tokenizer(
+                model.is_multilingual,
+                num_languages=model.num_languages,
+                language=result.language,
+                task="transcribe"
+            )
+            text_tokens = [token for token in result.tokens if token < tokenizer.eot]
+
+            # the same "no speech" rule whisper's transcribe uses
+            if not text_tokens or (result.no_speech_prob > 0.6 and result.avg_logprob < -1.0):
+                results.append({"language": result.language, "segments": []})
+                continue
+
+            segment = {
+                "seek": 0,
+                "start": 0.0,
+                "end": duration,
+                "text": result.text,
+                "tokens": text_tokens
+            }
+            add_word_timestamps(
+                segments=[segment],
+                model=model,
+                tokenizer=tokenizer,
+                mel=mel,
+                num_frames=int(duration * audio.SAMPLE_RATE / whisper.audio.HOP_LENGTH),
+                last_speech_timestamp=0.0
+            )
+
+            results.append({"language": result.language, "segments": [segment]})
+
+        return results
+
+
+_services: dict[tuple[str, bool], TranscriptionService] = {}
+_services_lock = threading.Lock()
+
+
+def get_transcription_service(model_name: str, quantized: bool = False) -> TranscriptionService:
+    """
+    Returns the process-wide transcription service for a whisper model, all tasks share it.
+    """
+    with _services_lock:
+        if (model_name, quantized) not in _services:
+            _services[(model_name, quantized)] = TranscriptionService(model_name, quantized)
+        return _services[(model_name, quantized)]
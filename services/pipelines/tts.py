@@ -0,0 +1,271 @@
+import base64
+import json
+import logging
+import os
+import re
+import shlex
+import subprocess
+import tempfile
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from elevenlabs import ElevenLabs, VoiceSettings
+
+import services.pipelines.ffmpeg as ffmpeg
+from services.pipelines.cache import DiskCache, make_key
+
+# A minute of mp3_44100_128 speech is ~1 MB
+TTS_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Sentences sent to ElevenLabs at the same time, kept under the account's concurrency limit
+SYNTHESIS_WORKERS = 4
+
+_tts_cache: DiskCache = None
+
+
+def get_tts_cache() -> DiskCache:
+    global _tts_cache
+    if _tts_cache is None:
+        _tts_cache = DiskCache('tts', TTS_CACHE_MAX_BYTES)
+    return _tts_cache
+
+
+class VoiceConfig:
+    voice_id: str = None
+    model_id: str = None
+    output_format: str = None
+
+    stability: float = None
+    similarity_boost: float = None
+    style: float = None
+    use_speaker_boost: bool = None
+
+    def __init__(self,
+                 voice_id: str = "TX3LPaxmHKxFdv7VOQHJ",  # Liam
+                 model_id: str = "eleven_multilingual_v2",
+                 output_format: str = 'mp3_44100_128',
+                 stability: float = 0.71,
+                 similarity_boost: float = 0.5,
+                 style: float = 0.0,
+                 use_speaker_boost: bool = True):
+        self.voice_id = voice_id
+        self.model_id = model_id
+        self.output_format = output_format
+        self.stability = stability
+        self.similarity_boost = similarity_boost
+        self.style = style
+        self.use_speaker_boost = use_speaker_boost
+
+    def voice_settings(self) -> VoiceSettings:
+        return VoiceSettings(
+            stability=self.stability,
+            similarity_boost=self.similarity_boost,
+            style=self.style,
+            use_speaker_boost=self.use_speaker_boost
+        )
+
+    def cache_key_parts(self) -> list:
+        return [
+            self.voice_id,
+            self.model_id,
+            self.output_format,
+            self.stability,
+            self.similarity_boost,
+            self.style,
+            self.use_speaker_boost
+        ]
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes a script for synthesis, so that differences ElevenLabs can't hear don't miss the cache.
+    """
+    text = unicodedata.normalize('NFC', text)
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = re.sub(r' *\n *', '\n', text)
+    return text.strip()
+
+
+def _write_entry(path: str, audio_bytes: bytes, alignment: dict):
+    # One compact file per entry: the encoded audio and the alignment as packed arrays
+    with open(path, 'wb') as f:
+        np.savez(
+            f,
+            audio=np.frombuffer(audio_bytes, dtype=np.uint8),
+            characters=np.frombuffer(json.dumps(alignment['characters']).encode('utf-8'), dtype=np.uint8),
+            starts=np.asarray(alignment['character_start_times_seconds'], dtype=np.float64),
+            ends=np.asarray(alignment['character_end_times_seconds'], dtype=np.float64)
+        )
+
+
+def _read_entry(path: str) -> (bytes, dict):
+    with np.load(path) as entry:
+        audio_bytes = entry['audio'].tobytes()
+        alignment = {
+            'characters': json.loads(entry['characters'].tobytes().decode('utf-8')),
+            'character_start_times_seconds': entry['starts'].tolist(),
+            'character_end_times_seconds': entry['ends'].tolist()
+        }
+    return audio_bytes, alignment
+
+
+def synthesize(client: ElevenLabs, text: str, voice: VoiceConfig = None) -> (bytes, dict):
+    """
+    Synthesizes speech with ElevenLabs, going through the shared TTS cache.
+
+    The cache is keyed by (normalized text, voice_id, model_id, output_format, voice settings) and shared by all
+    projects, so the same script with the same voice is only ever synthesized once.
+
+    :param client: The ElevenLabs client
+    :param text: The text to synthesize
+    :param voice: The voice to use, defaults to VoiceConfig()
+    :return: (encoded audio, character alignment), the alignment is a dict with
+             "characters", "character_start_times_seconds" and "character_end_times_seconds"
+    """
+    if voice is None:
+        voice = VoiceConfig()
+
+    text = normalize_text(text)
+
+    cache = get_tts_cache()
+    key = make_key(text, *voice.cache_key_parts())
+
+    cached_path = cache.get_path(key, '.npz')
+    if cached_path is not None:
+        logging.info(f"✅ Using cached ElevenLabs speech: {key[:12]}")
+        return _read_entry(cached_path)
+
+    logging.info("⌛ No cached version found. Generating fresh speech using ElevenLabs...")
+
+    response = client.text_to_speech.convert_with_timestamps(
+        text=text,
+        voice_id=voice.voice_id,
+        model_id=voice.model_id,
+        output_format=voice.output_format,
+        voice_settings=voice.voice_settings()
+    )
+    audio_bytes = base64.b64decode(response["audio_base64"])
+    alignment = response['alignment']
+
+    tmp_path = cache.temp_path('.npz')
+    _write_entry(tmp_path, audio_bytes, alignment)
+    cache.put_file(key, '.npz', tmp_path, move=True)
+
+    return audio_bytes, alignment
+
+
+def text_to_speech(client: ElevenLabs, text: str, output_path: str, voice: VoiceConfig = None) -> dict:
+    """
+    Synthesizes the whole text at once (see synthesize) and writes the audio to 'output_path'.
+
+    :return: The character alignment
+    """
+    audio_bytes, alignment = synthesize(client, text, voice)
+
+    with open(output_path, 'wb') as f:
+        f.write(audio_bytes)
+
+    return alignment
+
+
+def split_sentences(text: str) -> list[str]:
+    """
+    Splits a script into sentences: after '.', '!' or '?' followed by whitespace, and at line breaks.
+    """
+    return [sentence for sentence in re.split(r'(?<=[.!?])\s+|\n+', normalize_text(text)) if sentence.strip()]
+
+
+def stitch_alignments(alignments: list[dict], offsets: list[float]) -> dict:
+    """
+    Joins per-sentence alignments into one, shifting each by the start of its audio in the stitched track.
+    Sentences are separated by a single space character at the boundary.
+    """
+    characters, starts, ends = [], [], []
+
+    for i, (alignment, offset) in enumerate(zip(alignments, offsets)):
+        if i > 0:
+            characters.append(' ')
+            starts.append(offset)
+            ends.append(offset)
+
+        characters.extend(alignment['characters'])
+        starts.extend(t + offset for t in alignment['character_start_times_seconds'])
+        ends.extend(t + offset for t in alignment['character_end_times_seconds'])
+
+    return {
+        'characters': characters,
+        'character_start_times_seconds': starts,
+        'character_end_times_seconds': ends
+    }
+
+
+def incremental_text_to_speech(client: ElevenLabs, text: str, output_path: str, voice: VoiceConfig = None,
+                               max_workers: int = SYNTHESIS_WORKERS) -> dict:
+    """
+    Synthesizes the text sentence by sentence and stitches the audio and the alignments together.
+
+    Every sentence goes through the TTS cache on its own, so after a small edit only the changed
+    sentences are sent to ElevenLabs again. The sentences are synthesized at most 'max_workers' at a
+    time, then stitched in order.
+
+    :param client: The ElevenLabs client
+    :param text: The text to synthesize
+    :param output_path: Where to write the stitched audio, same format as the voice's output_format
+    :param voice: The voice to use, defaults to VoiceConfig()
+    :param max_workers: How many sentences are synthesized concurrently
+    :return: The character alignment of the stitched track
+    """
+    sentences = split_sentences(text)
+    if not sentences:
+        raise ValueError("Nothing to synthesize, the text is empty.")
+
+    ext = os.path.splitext(output_path)[1] or '.mp3'
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        piece_paths = []
+        alignments = []
+        offsets = []
+        position = 0.0
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            syntheses = list(executor.map(lambda sentence: synthesize(client, sentence, voice), sentences))
+
+        for i, (audio_bytes, alignment) in enumerate(syntheses):
+            piece_path = os.path.join(tmp_dir, f"sentence_{i}{ext}")
+            with open(piece_path, 'wb') as f:
+                f.write(audio_bytes)
+
+            piece_paths.append(piece_path)
+            alignments.append(alignment)
+            offsets.append(position)
+            # the real length of the piece, it includes the encoder padding the concat will keep
+            position += ffmpeg.get_media_duration(piece_path)
+
+        list_path = os.path.join(tmp_dir, 'pieces.txt')
+        with open(list_path, 'w') as f:
+            for piece_path in piece_paths:
+                f.write(f"file '{piece_path}'\n")
+
+        # All the pieces share one encoding, they are joined without re-encoding
+        cmd = [
+            "ffmpeg", "-y",
+            "-hide_banner",
+            "-loglevel", "error",
+            "-f", "concat",
+            "-safe", "0",
+            "-i", list_path,
+            "-c", "copy",
+            output_path
+        ]
+
+        print("Running ffmpeg:\n", " ".join(shlex.quote(arg) for arg in cmd))
+
+        try:
+            subprocess.run(cmd, check=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"ffmpeg command failed with error: {e.stderr}")
+
+    logging.info(f"✅ Stitched speech from {len(sentences)} sentences")
+
+    return stitch_alignments(alignments, offsets)
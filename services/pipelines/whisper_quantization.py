@@ -0,0 +1,274 @@
+import argparse
+import dataclasses
+import difflib
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import torch
+import whisper
+from whisper.model import AudioEncoder, ModelDimensions, TextDecoder, Whisper
+
+from services.pipelines import audio
+from services.pipelines.cache import DiskCache, make_key
+
+# int8 'small' is ~250 MB and 'medium' ~800 MB on disk
+QUANTIZED_MODEL_CACHE_MAX_BYTES = 3 * 1024 * 1024 * 1024
+
+# Bump when the quantization recipe changes, so stale weights are not reused
+QUANTIZATION_VERSION = 1
+
+
+def _replace_linear(module: torch.nn.Module):
+    """
+    Swaps whisper's Linear subclass for plain torch.nn.Linear, which is what quantize_dynamic knows how to convert.
+    """
+    for name, child in module.named_children():
+        if isinstance(child, whisper.model.Linear):
+            linear = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None,
+                                     device=child.weight.device)
+            linear.weight = child.weight
+            if child.bias is not None:
+                linear.bias = child.bias
+            setattr(module, name, linear)
+        else:
+            _replace_linear(child)
+
+
+def quantize_model(model: Whisper) -> Whisper:
+    """
+    Applies dynamic int8 quantization to the linear layers of a (CPU, fp32) whisper model, in place.
+    """
+    _replace_linear(model)
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def build_skeleton(dims: ModelDimensions) -> Whisper:
+    """
+    Builds a whisper model whose parameters and buffers are on the meta device, nothing is allocated.
+    Load a state dict into it with assign=True, or materialize it with to_empty.
+
+    Same as Whisper(dims), whose sparse alignment heads cannot be created on the meta device.
+    """
+    model = Whisper.__new__(Whisper)
+    torch.nn.Module.__init__(model)
+    model.dims = dims
+
+    with torch.device('meta'):
+        model.encoder = AudioEncoder(dims.n_mels, dims.n_audio_ctx, dims.n_audio_state, dims.n_audio_head,
+                                     dims.n_audio_layer)
+        model.decoder = TextDecoder(dims.n_vocab, dims.n_text_ctx, dims.n_text_state, dims.n_text_head,
+                                    dims.n_text_layer)
+
+    # the last half of the decoder layers, as Whisper.__init__ does
+    all_heads = torch.zeros(dims.n_text_layer, dims.n_text_head, dtype=torch.bool)
+    all_heads[dims.n_text_layer // 2:] = True
+    model.register_buffer("alignment_heads", all_heads.to_sparse(), persistent=False)
+
+    return model
+
+
+def model_from_state(dims: dict, state: dict[str, torch.Tensor], model_name: str) -> Whisper:
+    """
+    Builds an fp32 whisper model around existing tensors (e.g. another process' weights in shared memory,
+    see torch.multiprocessing) without copying them.
+
+    :param dims: The model's dimensions, as a dict
+    :param state: The model's state_dict
+    """
+    dims = ModelDimensions(**dims)
+    model = build_skeleton(dims)
+    model.load_state_dict(state, assign=True)
+
+    # The causal mask is not part of the state dict
+    n_ctx = dims.n_text_ctx
+    model.decoder.mask = torch.empty(n_ctx, n_ctx).fill_(-np.inf).triu_(1)
+
+    if model_name in whisper._ALIGNMENT_HEADS:
+        model.set_alignment_heads(whisper._ALIGNMENT_HEADS[model_name])
+
+    return model.eval()
+
+
+def _build_quantized_skeleton(dims: ModelDimensions) -> Whisper:
+    """
+    Builds an int8 model without materializing the fp32 weights, so a reload never needs fp32 memory.
+    """
+    model = build_skeleton(dims)
+
+    _replace_linear(model)
+
+    def swap(module: torch.nn.Module):
+        for name, child in module.named_children():
+            if isinstance(child, torch.nn.Linear):
+                setattr(module, name, torch.ao.nn.quantized.dynamic.Linear(
+                    child.in_features, child.out_features, bias_=child.bias is not None, dtype=torch.qint8
+                ))
+            else:
+                swap(child)
+
+    swap(model)
+    # to_empty would also empty the (already real) alignment heads
+    alignment_heads = model.alignment_heads
+    model.to_empty(device='cpu')
+    model.register_buffer("alignment_heads", alignment_heads, persistent=False)
+
+    # The causal mask is not part of the state dict
+    n_ctx = dims.n_text_ctx
+    model.decoder.mask = torch.empty(n_ctx, n_ctx).fill_(-np.inf).triu_(1)
+
+    return model
+
+
+def _quantized_model_key(model_name: str) -> str:
+    return make_key(model_name, torch.__version__, QUANTIZATION_VERSION)
+
+
+def get_quantized_model_path(model_name: str, cache: DiskCache = None) -> str | None:
+    """
+    The cached int8 weights of a model, None if they are not built yet.
+    """
+    if cache is None:
+        cache = DiskCache('whisper_int8', QUANTIZED_MODEL_CACHE_MAX_BYTES)
+    return cache.get_path(_quantized_model_key(model_name), '.pt')
+
+
+def _save_quantized_model(model: Whisper, model_name: str, cache: DiskCache) -> str:
+    tmp_path = cache.temp_path('.pt')
+    torch.save({"dims": dataclasses.asdict(model.dims), "model_state_dict": model.state_dict()}, tmp_path)
+    return cache.put_file(_quantized_model_key(model_name), '.pt', tmp_path, move=True)
+
+
+def prebuild_quantized_model(model_name: str, cache: DiskCache = None) -> str:
+    """
+    Quantizes a model into the cache ahead of time (e.g. at deploy time), so the serving processes only
+    ever load the int8 weights. Does nothing if they are already cached.
+
+    :return: Path to the cached int8 weights
+    """
+    if cache is None:
+        cache = DiskCache('whisper_int8', QUANTIZED_MODEL_CACHE_MAX_BYTES)
+
+    cached_path = get_quantized_model_path(model_name, cache)
+    if cached_path is not None:
+        return cached_path
+
+    path = _save_quantized_model(quantize_model(whisper.load_model(model_name, device='cpu')), model_name, cache)
+    logging.info(f"✅ Quantized whisper {model_name} to int8")
+    return path
+
+
+def load_quantized_model(model_name: str, cache: DiskCache = None, allow_build: bool = True) -> Whisper:
+    """
+    Returns an int8-quantized whisper model for CPU inference.
+
+    The quantized weights are cached on disk. A cache miss downloads the fp32 model and quantizes it, which
+    needs the fp32 weights in memory on top of everything else: serving processes should find the weights
+    prebuilt (see prebuild_quantized_model, or `python -m services.pipelines.whisper_quantization --prebuild`).
+
+    :param model_name: The whisper model name, e.g. 'small'
+    :param cache: The cache for the quantized weights
+    :param allow_build: Quantize on a cache miss, raise RuntimeError otherwise
+    :return: The quantized model
+    """
+    if cache is None:
+        cache = DiskCache('whisper_int8', QUANTIZED_MODEL_CACHE_MAX_BYTES)
+
+    cached_path = get_quantized_model_path(model_name, cache)
+    if cached_path is not None:
+        # our own file, it holds packed int8 params that the weights_only loader does not handle
+        checkpoint = torch.load(cached_path, map_location='cpu', weights_only=False)
+        model = _build_quantized_skeleton(ModelDimensions(**checkpoint["dims"]))
+        model.load_state_dict(checkpoint["model_state_dict"])
+        logging.info(f"✅ Loaded the cached int8 whisper {model_name}")
+    elif not allow_build:
+        raise RuntimeError(
+            f"The int8 whisper {model_name} is not prebuilt, run "
+            f"`python -m services.pipelines.whisper_quantization --prebuild --model {model_name}` first"
+        )
+    else:
+        logging.warning(f"⚠️ The int8 whisper {model_name} is not prebuilt, quantizing it now with the fp32 "
+                        f"weights in memory")
+        model = quantize_model(whisper.load_model(model_name, device='cpu'))
+        _save_quantized_model(model, model_name, cache)
+        logging.info(f"✅ Quantized whisper {model_name} to int8")
+
+    if model_name in whisper._ALIGNMENT_HEADS:
+        model.set_alignment_heads(whisper._ALIGNMENT_HEADS[model_name])
+
+    return model.eval()
+
+
+def _words(result: dict) -> list[dict]:
+    return [word for segment in result["segments"] for word in segment["words"]]
+
+
+def benchmark(media_path: str, model_name: str = "small") -> dict:
+    """
+    Transcribes a file with the fp32 and the int8 model and measures the speedup and the word timestamp drift.
+
+    The drift is measured over the words both models recognized identically.
+    """
+    samples = np.array(audio.load_audio(media_path))
+
+    fp32_model = whisper.load_model(model_name, device='cpu')
+    start = time.time()
+    fp32_result = fp32_model.transcribe(samples, word_timestamps=True, fp16=False)
+    fp32_time = time.time() - start
+    del fp32_model
+
+    int8_model = load_quantized_model(model_name)
+    start = time.time()
+    int8_result = int8_model.transcribe(samples, word_timestamps=True, fp16=False)
+    int8_time = time.time() - start
+
+    fp32_words = _words(fp32_result)
+    int8_words = _words(int8_result)
+
+    matcher = difflib.SequenceMatcher(
+        a=[w["word"].strip().lower() for w in fp32_words],
+        b=[w["word"].strip().lower() for w in int8_words],
+        autojunk=False
+    )
+    drifts = []
+    for block in matcher.get_matching_blocks():
+        for k in range(block.size):
+            a, b = fp32_words[block.a + k], int8_words[block.b + k]
+            drifts.append(max(abs(a["start"] - b["start"]), abs(a["end"] - b["end"])))
+
+    return {
+        "media": os.path.basename(media_path),
+        "model": model_name,
+        "audio_seconds": audio.audio_duration(samples),
+        "fp32_seconds": fp32_time,
+        "int8_seconds": int8_time,
+        "speedup": fp32_time / int8_time if int8_time > 0 else None,
+        "word_match_ratio": matcher.ratio(),
+        "mean_drift_seconds": float(np.mean(drifts)) if drifts else None,
+        "max_drift_seconds": float(np.max(drifts)) if drifts else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark int8 whisper against fp32")
+    parser.add_argument("media_path", nargs="?")
+    parser.add_argument("--model", default="small")
+    parser.add_argument("--output", help="Append the result as a JSON line to this file")
+    parser.add_argument("--prebuild", action="store_true",
+                        help="Only quantize the model into the cache, without benchmarking")
+    args = parser.parse_args()
+
+    if args.prebuild:
+        print(prebuild_quantized_model(args.model))
+        raise SystemExit(0)
+    if args.media_path is None:
+        parser.error("media_path is required unless --prebuild is given")
+
+    report = benchmark(args.media_path, args.model)
+    print(json.dumps(report, indent=4))
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(report) + "\n")
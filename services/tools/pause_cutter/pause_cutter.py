@@ -1,22 +1,25 @@
 import os.path
 
-import whisper
-
-from services.pipelines import ffmpeg
+from services.pipelines import audio, ffmpeg
 from services.pipelines.pause_detector import detect_pauses
+from services.pipelines.transcription import Transcriber
 
 
 class PauseCutter:
     working_dir: str = None
 
-    whisper: whisper.Whisper
+    transcriber: Transcriber = None
 
-    def __init__(self, working_dir: str, whisper_model: str = "small"):
+    def __init__(self, working_dir: str, whisper_model: str = "small", language: str = None, quantized: bool = False):
         self.working_dir = working_dir
 
-        self.whisper = whisper.load_model(whisper_model)
+        # The model is loaded lazily, re-runs with a different threshold or padding hit the transcription cache
+        # quantized=True runs dynamic int8 inference, see services/pipelines/whisper_quantization.py
+        # its weights are prebuilt at deploy time (see the Dockerfile), a missing model raises instead of quantizing
+        self.transcriber = Transcriber(model_name=whisper_model, language=language, quantized=quantized)
 
-    def run(self, video_name: str,output_name: str, pause_threshold=0.5, pad=0.1):
+    def run(self, video_name: str,output_name: str, pause_threshold=0.5, pad=0.1, long_form=False, batched=False,
+            vad=False):
         video_encoder = ffmpeg.get_gpu_accelerated_h264_encoder()
         if video_encoder is None:
             video_encoder = "libx264"
@@ -24,19 +27,26 @@ class PauseCutter:
         if audio_encoder is None:
             audio_encoder = "aac"
 
-        transcription = self.whisper.transcribe(
-            audio=os.path.join(self.working_dir, 'input', 'videos', video_name),
-            word_timestamps=True
-        )
+        video_path = os.path.join(self.working_dir, 'input', 'videos', video_name)
+
+        if batched:
+            # Shares batched inference with the other pause cutter tasks running in this worker
+            transcription = self.transcriber.transcribe_batched(video_path, vad=vad)
+        elif long_form:
+            # Split at silences and transcribe the chunks in parallel, wall time scales with cores
+            transcription = self.transcriber.transcribe_long(video_path, vad=vad)
+        else:
+            transcription = self.transcriber.transcribe(video_path, vad=vad)
 
         _, pauses = detect_pauses(get_word_timings(transcription), threshold=pause_threshold, pad=pad)
 
         ffmpeg.trim_pauses_from_media(
-            media_path=os.path.join(self.working_dir, 'input', 'videos', video_name),
+            media_path=video_path,
             pauses=pauses,
             output_path=os.path.join(self.working_dir, 'output', output_name),
             video_codec=video_encoder,
-            audio_codec=audio_encoder
+            audio_codec=audio_encoder,
+            total_duration=audio.audio_duration(audio.load_audio(video_path))
         )
 
 